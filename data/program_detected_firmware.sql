@@ -0,0 +1,19 @@
+-- Table the detected firmware is written to (DbAdapter.record_detected).
+-- One row per device found in a crate, or a single row without device when
+-- the slot information could not be read. The columns are recorder.ROW_FIELDS.
+-- Adapt the schema to the one set in record_detected_table of pm_config.cfg.
+
+create table Alim.Program_Detected_Firmware (
+    converter     varchar(64)      not null,
+    recorded_at   double precision not null,  -- Seconds since the epoch
+    slot          varchar(8),
+    board         varchar(64),
+    state         varchar(32),
+    device        varchar(64),
+    variant       varchar(64),
+    var_revision  varchar(16),
+    api_revision  varchar(16),
+    outcome       varchar(32)
+);
+
+create index Program_Detected_Firmware_Conv on Alim.Program_Detected_Firmware (converter, recorded_at);
@@ -1,7 +1,18 @@
+import json
 import logging
 import os
+import threading
+import time
 from collections import namedtuple
 
+try:
+    import sqlalchemy
+
+except ImportError:
+    sqlalchemy = None
+
+from program_manager.recorder import ROW_FIELDS, detected_rows
+
 def getAdapter(adapter, adapter_data):
     if adapter == "db":
         return DbAdapter(*adapter_data)
@@ -25,35 +36,207 @@ class Adapter:
     def get_detected(self):
         pass
 
-    def record_detected(self):
+    def record_detected(self, records):
+        """Stores a batch of recorder.DetectedRecords. Called by the WriteBehindRecorder thread."""
         pass
 
 
 class DbAdapter(Adapter):
-    RELEASE_INFO_TABLE    = ""
-    RECORD_DETECTED_TABLE = ""
+    """Expected data read from the release information view.
+
+    The whole view is loaded with one query into an in-memory index keyed by
+    converter, board and device, refreshed every refresh_sec seconds (by the
+    first get_expected after that time) or on demand with refresh(). Queries
+    go through a pool of connections. The view has no slot column, so the
+    expected data of a converter is keyed by board.
+
+    Detected firmware is inserted in record_table, which is not part of the
+    release information schema: it must be created beforehand (see
+    data/program_detected_firmware.sql). Its existence is checked when the
+    adapter is created.
+    """
+    RELEASE_INFO_TABLE    = "Alim.Program_Files_Parameters_View"
+    RECORD_DETECTED_TABLE = "Alim.Program_Detected_Firmware"
+
+    # Index field -> column of RELEASE_INFO_TABLE
+    RELEASE_INFO_COLUMNS  = {"converter"    : "device",
+                             "board"        : "board",
+                             "device"       : "component_type",
+                             "variant"      : "variant",
+                             "var_revision" : "variant_revision",
+                             "api_revision" : "api_revision"}
+
+    REFRESH_SEC   = 600
+    POOL_SIZE     = 5
+    MAX_OVERFLOW  = 10
+    POOL_RECYCLE  = 3600
+
+    def __init__(self, connection_string, username="", password="", record_table=None, table=RELEASE_INFO_TABLE, refresh_sec=REFRESH_SEC,
+                 clock=time.monotonic):
+        if sqlalchemy is None:
+            raise RuntimeError("DbAdapter needs SQLAlchemy, install program_manager[db]")
+
+        self.table        = table
+        self.record_table = record_table or DbAdapter.RECORD_DETECTED_TABLE
+        self.refresh_sec  = refresh_sec
+        self._clock       = clock
+        self._engine      = self._create_engine(connection_string, username, password)
+        self._query       = sqlalchemy.text(f"select {', '.join(DbAdapter.RELEASE_INFO_COLUMNS.values())} from {table}")
+        self._insert      = sqlalchemy.text(f"insert into {self.record_table} ({', '.join(ROW_FIELDS)}) "
+                                            f"values ({', '.join(':' + field for field in ROW_FIELDS)})")
+        self._check_record_table()
+
+        # converter -> board -> {"board": board, "devices": {device: Adapter.Device}}
+        self._expected     = dict()
+        self._loaded_at    = None
+        self._lock         = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+        self.queries = 0
 
-    
-    def __init__(self, connection_string, username, password, fw_file_loc):
         self._logger = logging.getLogger("pm_main." + __name__)
         self._logger.info(f"Adapter {type(self).__name__} created")
 
-#     def get_detected(self):
-#         raise NotImplementedError
+    @staticmethod
+    def _create_engine(connection_string, username, password):
+        url = sqlalchemy.engine.make_url(connection_string)
+        if username:
+            url = url.set(username=username, password=password)
+
+        # SQLite (local stand-in of the DB) does not use a QueuePool
+        if url.get_backend_name() == "sqlite":
+            return sqlalchemy.create_engine(url)
+
+        return sqlalchemy.create_engine(url,
+                                        pool_size=DbAdapter.POOL_SIZE,
+                                        max_overflow=DbAdapter.MAX_OVERFLOW,
+                                        pool_recycle=DbAdapter.POOL_RECYCLE,
+                                        pool_pre_ping=True)
+
+    def _check_record_table(self):
+        # Better to fail at startup than to lose every record later
+        schema, _, name = self.record_table.rpartition(".")
+        try:
+            exists = sqlalchemy.inspect(self._engine).has_table(name, schema=schema or None)
 
-#     def get_expected(self):
-#         self._logger.info("Got expected data from DB")
-#         pass
+        except sqlalchemy.exc.SQLAlchemyError as se:
+            raise RuntimeError(f"Could not check table {self.record_table}: {se}")
 
-#     def record_detected(self):
-#         pass
+        if not exists:
+            raise RuntimeError(f"Table {self.record_table} of the detected firmware does not exist. Create it (see data/program_detected_firmware.sql) "
+                               f"or set record_detected_table in the db section of the configuration")
+
+    def get_detected(self):
+        raise NotImplementedError
+
+    def get_expected(self, fgc_name):
+        """Expected data of a converter: board -> {"board": board, "devices": {device: Adapter.Device}}.
+
+        The returned data is shared with the index and must not be modified.
+
+        Raises:
+            KeyError     -- The converter is not in the view
+            RuntimeError -- The view could not be loaded
+        """
+        if self._loaded_at is None or self._clock() - self._loaded_at >= self.refresh_sec:
+            self._refresh_if_due()
+
+        with self._lock:
+            try:
+                return self._expected[fgc_name]
+
+            except KeyError:
+                raise KeyError(f"No expected data for {fgc_name} in {self.table}")
+
+    def refresh(self):
+        """Loads the whole view. Returns the number of converters.
+
+        Raises:
+            RuntimeError -- The query failed, the previous data is kept
+        """
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh_if_due(self):
+        # Only one thread queries, the others keep using the current data if there is any
+        if not self._refresh_lock.acquire(blocking=self._loaded_at is None):
+            return
+
+        try:
+            if self._loaded_at is None or self._clock() - self._loaded_at >= self.refresh_sec:
+                self._refresh()
+
+        except RuntimeError as rte:
+            if self._loaded_at is None:
+                raise
+
+            self._logger.warning(f"{rte}. Using data loaded {self._clock() - self._loaded_at:.0f} s ago")
+
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self):
+        # Called with _refresh_lock held
+        try:
+            with self._engine.connect() as conn:
+                rows = conn.execute(self._query).fetchall()
+
+        except sqlalchemy.exc.SQLAlchemyError as se:
+            raise RuntimeError(f"Could not load {self.table}: {se}")
+
+        expected = dict()
+        for converter, board, device, variant, var_revision, api_revision in rows:
+            board_data = expected.setdefault(converter, dict()).setdefault(board, {"board": board, "devices": dict()})
+            board_data["devices"][device] = Adapter.Device(device, variant, str(var_revision), str(api_revision))
+
+        with self._lock:
+            self._expected     = expected
+            self._loaded_at    = self._clock()
+            self.queries      += 1
+
+        self._logger.info(f"Loaded {len(rows)} rows of {self.table}, {len(expected)} converters")
+        return len(expected)
+
+    def stats(self):
+        with self._lock:
+            return {"converters" : len(self._expected),
+                    "queries"    : self.queries,
+                    "age"        : None if self._loaded_at is None else self._clock() - self._loaded_at}
+
+    def record_detected(self, records):
+        """Inserts a batch of records, one row per device, in one transaction."""
+        rows = [row for record in records for row in detected_rows(record)]
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(self._insert, rows)
+
+        except sqlalchemy.exc.SQLAlchemyError as se:
+            raise RuntimeError(f"Could not record {len(rows)} detected rows: {se}")
 
 class FileSystemAdapter(Adapter):
-    def __init__(self, fw_subfolder, db_subfolder, fw_file_loc):
-        self._db_files = os.path.join(fw_file_loc, db_subfolder)
-        self._fw_files = os.path.join(fw_file_loc, fw_subfolder)
-        
-        self._converter_last_time_updated = dict()
+    """Expected data read from one file per converter in the DB subfolder.
+
+    The converter files are found through an index of the folder, rebuilt only
+    when the folder's modification time changes (a file was added, removed or
+    renamed). Parsed files are kept in memory and parsed again only when their
+    size or modification time changes. Thread safe.
+    """
+    DETECTED_FILE_NAME = "detected.jsonl"
+
+    def __init__(self, fw_subfolder, db_subfolder, fw_file_loc, detected_file=None):
+        self._db_files      = os.path.join(fw_file_loc, db_subfolder)
+        self._fw_files      = os.path.join(fw_file_loc, fw_subfolder)
+        self._detected_file = detected_file or os.path.join(fw_file_loc, FileSystemAdapter.DETECTED_FILE_NAME)
+
+        # converter -> path; converter -> (size, mtime_ns, expected data)
+        self._index          = dict()
+        self._index_mtime_ns = None
+        self._expected       = dict()
+        self._lock           = threading.Lock()
+
+        self.index_scans = 0
+        self.parses      = 0
+        self.hits        = 0
 
         self._logger = logging.getLogger("pm_main." + __name__)
         self._logger.info(f"Adapter {type(self).__name__} created")
@@ -62,31 +245,74 @@ class FileSystemAdapter(Adapter):
         raise NotImplementedError
 
     def get_expected(self, fgc_name):
-        expected_data = None
-        expected_converters = os.listdir(self._db_files)
-
-        if fgc_name not in expected_converters:
-            raise FileNotFoundError
-                
-        expected_converter_file = os.path.join(self._db_files, fgc_name)
-        last_time_updated       = int(os.path.getmtime(expected_converter_file))
-        
+        """Expected data of a converter: slot -> {"board": board, "devices": {device: Adapter.Device}}.
+
+        The returned data is shared with the cache and must not be modified.
+
+        Raises:
+            FileNotFoundError -- The converter has no expected data file
+        """
+        self._check_index()
         try:
-            last_time = self._converter_last_time_updated[fgc_name]
-        
+            path = self._index[fgc_name]
+
         except KeyError:
-            self._converter_last_time_updated[fgc_name] = last_time_updated
-            expected_data = self._parse_expected_file(expected_converter_file)
-        
-        else:
-            if last_time_updated > last_time:
-                expected_data = self._parse_expected_file(expected_converter_file)
-        
+            raise FileNotFoundError(f"No expected data file for {fgc_name} in {self._db_files}")
+
+        stat_info = os.stat(path)
+        with self._lock:
+            cached = self._expected.get(fgc_name)
+            if cached is not None and cached[:2] == (stat_info.st_size, stat_info.st_mtime_ns):
+                self.hits += 1
+                return cached[2]
+
+        expected_data = self._parse_expected_file(path)
+        with self._lock:
+            self._expected[fgc_name] = (stat_info.st_size, stat_info.st_mtime_ns, expected_data)
+            self.parses += 1
+
         return expected_data
 
+    def invalidate(self, fgc_name=None):
+        """Forgets the cached data of a converter, of all of them if fgc_name is None."""
+        with self._lock:
+            if fgc_name is None:
+                self._expected.clear()
+                self._index_mtime_ns = None
 
-    def record_detected(self):
-        pass
+            else:
+                self._expected.pop(fgc_name, None)
+
+    def stats(self):
+        with self._lock:
+            return {"converters"  : len(self._index),
+                    "cached"      : len(self._expected),
+                    "index_scans" : self.index_scans,
+                    "parses"      : self.parses,
+                    "hits"        : self.hits}
+
+    def _check_index(self):
+        mtime_ns = os.stat(self._db_files).st_mtime_ns
+        if mtime_ns == self._index_mtime_ns:
+            return
+
+        with self._lock:
+            if mtime_ns == self._index_mtime_ns:
+                return
+
+            index = {entry.name: entry.path for entry in os.scandir(self._db_files) if entry.is_file()}
+            for removed in self._index.keys() - index.keys():
+                self._expected.pop(removed, None)
+
+            self._index          = index
+            self._index_mtime_ns = mtime_ns
+            self.index_scans    += 1
+
+        self._logger.debug(f"Expected data index of {self._db_files} rebuilt: {len(index)} converters")
+
+    def record_detected(self, records):
+        """Appends a batch of records to the detected file, one JSON line per device."""
+        _append_rows(self._detected_file, records)
 
     def _parse_expected_file(self, file_name):
         #TODO: protect access to file? One thread should only access one file, so might not be needed
@@ -135,6 +361,12 @@ class LocalFileSystemAdapter(Adapter):
         with open(self.detected, "r") as dfh:
             pass
 
-    def record_detected(self):
-        with open(self.inserted, "w") as ifh:
-            pass
+    def record_detected(self, records):
+        # Only kept if a file was given
+        if self.inserted:
+            _append_rows(self.inserted, records)
+
+def _append_rows(file_name, records):
+    lines = "".join(json.dumps(row) + "\n" for record in records for row in detected_rows(record))
+    with open(file_name, "a") as dfh:
+        dfh.write(lines)
@@ -2,107 +2,305 @@ import logging
 import queue
 import threading
 import time
+from collections import OrderedDict
+
+import pyfgc
+import program_manager.regfgc3_programmer as programmer
+from program_manager.fgc_pool import fgc_pool
+from program_manager.job_journal import JobJournal, JobProgress, set_current_progress
+from program_manager.job_queue import DEFAULT_POLICY, PRIORITY_NORMAL, Job, PriorityTaskQueue
+from program_manager.planner import Planner
+from program_manager.recorder import DetectedRecord
+from program_manager.scheduler import WorkScheduler
+from program_manager.tracing import Tracer, set_current_trace
 
 
 ITERATION_TIME_SEC = 5
 
-import random
-
-def fgc_work(logger, job_name):
-    # Get slot info
-    logger.info(f"Get SLOT_INFO from {job_name}")
-    time.sleep(random.randint(1, 5))
-    
-    # Get expected
-    logger.info(f"Get expected info from {job_name}")
-    time.sleep(random.randint(1, 5))
-    
-    # Decide whether to program or not
-    logger.info(f"Expected != Detected for {job_name}. Let's program!")
-    time.sleep(random.randint(1, 20))
-    
-    # Write what happened in log/DB
-    logger.info(f"Writing in DB")
-    time.sleep(random.randint(1, 5))
-
-class FgcWorker(threading.Thread):
-    def __init__(self, tasks, jobs, lock, name="Anonymous"):
-        super().__init__()
-        self._tasks      = tasks
-        self._jobs       = jobs
-        self._lock       = lock
-        self.name        = name
-        self._stop_event = threading.Event()
-        self._logger     = logging.getLogger("pm_main." + __name__ + ".FgcWorker")
-
-        self.start()
-
-    def run(self):
-        while not self._stop_event.is_set():
+# Outcomes of AreaProgramManager.add_job
+JOB_ACCEPTED = "accepted"
+JOB_DEFERRED = "deferred"
+JOB_REJECTED = "rejected"
+
+# Outcomes of fgc_work, as recorded
+OUTCOME_OK          = "ok"
+OUTCOME_ERROR       = "error"
+OUTCOME_FAULT       = "fault"
+OUTCOME_MISSING_FW  = "missing_fw"
+OUTCOME_NO_EXPECTED = "no_expected"
+
+def fgc_work(logger, job_name, adapter, fw_catalog, recorder=None, planner=None, snapshots=None):
+    """Reprograms the devices of converter job_name that do not run the expected firmware.
+
+    Reads REGFGC3.SLOT_INFO, plans the programming against the expected data of
+    adapter (see program_manager.planner) and programs the planned devices in
+    one crate transaction. Boards flagged by the plan are not touched. The
+    detected firmware and the outcome are submitted to recorder, and the
+    detected firmware stored in snapshots (slot_snapshot.SlotInfoStore).
+
+    Raises:
+        RuntimeError -- The converter could not be read or some devices were not reprogrammed
+    """
+    planner   = planner or Planner(fw_catalog.lookup)
+    detected  = None
+    slot_info = None
+    outcome   = OUTCOME_ERROR
+    try:
+        with fgc_pool.session(job_name) as fgc:
+            logger.info(f"Get SLOT_INFO from {job_name}")
+            detected = fgc.get("REGFGC3.SLOT_INFO").value
+
             try:
-                func, job_name = self._tasks.get(timeout=2)
+                expected = adapter.get_expected(job_name)
+
+            except (KeyError, FileNotFoundError) as e:
+                logger.error(f"No expected data for {job_name}: {e}")
+                outcome = OUTCOME_NO_EXPECTED
+                return
+
+            slot_info, plan = planner.plan_reply(job_name, detected, expected)
+            for fault in plan.faults:
+                logger.critical(f"{job_name}: board {fault.board} in slot {fault.slot} NOT reprogrammed, converter fault: {fault.reason}")
+
+            for missing in plan.missing_fw:
+                logger.error(f"{job_name}: no valid firmware file for {missing.device} {missing.variant} {missing.var_revision} {missing.api_revision}")
+
+            failed = list()
+            if plan.actions:
+                logger.info(f"Expected != Detected for {job_name}: {len(plan.actions)} devices to reprogram")
+                results, rescanned = programmer.program_crate(job_name, [action[1:] for action in plan.actions],
+                                                              fgc_session=fgc, fw_catalog=fw_catalog)
+                if rescanned:
+                    detected, slot_info = rescanned, None
+                failed   = [key for key, attempts in results.items() if attempts >= 3]
+
+            if failed:
+                raise RuntimeError(f"{job_name}: devices not reprogrammed {failed}")
+
+            outcome = OUTCOME_FAULT if plan.faults else OUTCOME_MISSING_FW if plan.missing_fw else OUTCOME_OK
 
-            except queue.Empty:
-                self._logger.debug(f"FgcWorker({self.name}): queue empty, nothing to do")
-                time.sleep(1)
-                continue
+    except pyfgc.PyFgcError as pe:
+        raise RuntimeError(f"{job_name}: {pe}")
 
+    finally:
+        now = time.time()
+        if snapshots is not None and detected:
             try:
-                func(self._logger, job_name)
-
-            except Exception:
-                #TODO: Program unsuccessful three times, converter in error if variants are different
-                self._logger.error(f"FgcWorker({self.name}): failed to reprogam {job_name}, setting the converter in error")
-                
-            finally:
-                self._tasks.task_done()
-                with self._lock:
-                    self._jobs.discard(job_name)
-                
-                self._logger.info(f"FgcWorker({self.name}): job {job_name} removed from tasks")
-
-    def stop(self):
-        self._stop_event.set()
-    
+                snapshots.update(job_name, detected if slot_info is None else slot_info, now)
+
+            except RuntimeError as e:
+                logger.warning(f"SLOT_INFO of {job_name} not stored: {e}")
+
+        # Write what happened in log/DB, without waiting for the write
+        if recorder is not None:
+            recorder.submit(DetectedRecord(job_name, now, detected, outcome))
 
 class AreaProgramManager:
     MAX_NUM_TASKS = 200
     MAX_NUM_WORKERS = 20
+    MAX_NUM_DEFERRED = 1000
+    MAX_NUM_RETRIED = 1000
+
+    def __init__(self, name="", num_workers=MAX_NUM_WORKERS, tracer=None, policy=DEFAULT_POLICY, history=None, scheduler=None, journal=None):
+        """Queue of the jobs of an area.
 
-    def __init__(self, name="", num_workers=MAX_NUM_WORKERS):
+        Jobs are run by the workers of scheduler, shared with other areas. Without
+        scheduler, the area gets its own with num_workers workers. The jobs queued,
+        deferred, started and finished are written to journal (job_journal.JobJournal).
+        """
         self.name          = name
-        self._tasks        = queue.Queue(maxsize=AreaProgramManager.MAX_NUM_TASKS)
-        self._workers      = list()
+        self._tracer       = tracer or Tracer()
+        self._journal      = journal or JobJournal()
+        self._tasks        = PriorityTaskQueue(maxsize=AreaProgramManager.MAX_NUM_TASKS, policy=policy, history=history)
         self._jobs         = set()
+        self._enqueuing    = set()
+        self._retries      = OrderedDict()
         self._job_set_lock = threading.Lock()
-        
-        for i in range(num_workers):
-            self._workers.append(FgcWorker(self._tasks, self._jobs, self._job_set_lock, name=self.name+str(i)))
+
+        # Jobs waiting for room in the queue: job_name -> (func, priority, gateway, resume)
+        self._deferred     = OrderedDict()
+        self.accepted      = 0
+        self.deferrals     = 0
+        self.rejected      = 0
+        self.coalesced     = 0
+
+        self._own_scheduler = scheduler is None
+        self._scheduler     = scheduler or WorkScheduler(num_workers, max_per_area=num_workers, name=self.name)
+        self._scheduler.register(self)
             
         self._logger = logging.getLogger("pm_main." + __name__)
         self._logger.info(f"AreaProgramManager({self.name}) created")
 
-    def add_job(self, func, job_name):
-        if not job_name in self._jobs:
-            self._logger.debug(f"{job_name} not in jobs")
+    @property
+    def tasks(self):
+        return self._tasks
+
+    def add_job(self, func, job_name, priority=PRIORITY_NORMAL, gateway=None, resume=None):
+        """Queues func(logger, job_name) unless job_name is already queued or running. Never blocks.
+
+        Jobs are served in the order of the area's SchedulingPolicy (see
+        program_manager.job_queue). Jobs with a gateway count against the
+        scheduler's per gateway limit. When the queue is full the job is
+        deferred, and queued as soon as a queued job starts; when too many jobs
+        are deferred it is rejected. resume is given to the job's JobProgress.
+
+        Returns:
+            str -- JOB_ACCEPTED, JOB_DEFERRED or JOB_REJECTED. A job already
+                   known is coalesced and its current outcome returned
+        """
+        with self._job_set_lock:
+            outcome = self._coalesce(job_name, priority, gateway)
+            if outcome is not None:
+                return outcome
+
+            self._queue_deferred()
+            if len(self._deferred) >= AreaProgramManager.MAX_NUM_DEFERRED:
+                return self._reject(job_name)
+
+            # Known from now on, a second add_job is coalesced while the job is journaled
+            self._enqueuing.add(job_name)
+
+        # Written before the job is queued, so before a worker can start it, but without the lock
+        self._journal.enqueued(self.name, job_name, priority, gateway, resume)
+
+        with self._job_set_lock:
+            self._enqueuing.discard(job_name)
+            self._queue_deferred()
+            if self._deferred or not self._queue_job(func, job_name, priority, gateway, resume):
+                if len(self._deferred) >= AreaProgramManager.MAX_NUM_DEFERRED:
+                    outcome = self._reject(job_name)
+
+                else:
+                    self._deferred[job_name] = (func, priority, gateway, resume)
+                    self.deferrals += 1
+                    outcome = JOB_DEFERRED
+
+        if outcome == JOB_REJECTED:
+            # Filled up while the job was journaled
+            self._journal.finished(job_name, JOB_REJECTED)
+            return outcome
+
+        if outcome == JOB_DEFERRED:
+            self._logger.info(f"({self.name}) queue full, job {job_name} deferred")
+            return outcome
+
+        self._scheduler.notify()
+        self._logger.info(f"({self.name}) job {job_name} added to queue")
+        return JOB_ACCEPTED
+
+    def _coalesce(self, job_name, priority, gateway):
+        # Called with _job_set_lock held. Returns the outcome of a job already known, None otherwise
+        if job_name in self._jobs or job_name in self._enqueuing:
+            self.coalesced += 1
+            return JOB_ACCEPTED
+
+        if job_name in self._deferred:
+            self.coalesced += 1
+            queued_func, queued_priority, _, queued_resume = self._deferred[job_name]
+            self._deferred[job_name] = (queued_func, max(priority, queued_priority), gateway, queued_resume)
+            return JOB_DEFERRED
+
+        return None
+
+    def _reject(self, job_name):
+        # Called with _job_set_lock held
+        self.rejected += 1
+        self._logger.warning(f"({self.name}) job {job_name} rejected, {len(self._deferred)} jobs deferred")
+        return JOB_REJECTED
+
+    def _queue_job(self, func, job_name, priority, gateway, resume=None):
+        # Called with _job_set_lock held. Returns whether the job fitted in the queue
+        if self._tasks.full():
+            return False
+
+        trace = self._tracer.new_trace(job_name, area=self.name)
+        trace.start_span("queued", area=self.name)
+        try:
+            self._tasks.put_nowait(Job(func, job_name, trace, priority, self._retries.get(job_name, 0), gateway, resume))
+
+        except queue.Full:
+            return False
+
+        # Carried by the job from now on
+        self._retries.pop(job_name, None)
+
+        self._jobs.add(job_name)
+        self.accepted += 1
+        return True
+
+    def _queue_deferred(self):
+        # Called with _job_set_lock held. Highest priority first, FIFO among equals
+        while self._deferred:
+            job_name, (func, priority, gateway, resume) = max(self._deferred.items(), key=lambda item: item[1][1])
+            if not self._queue_job(func, job_name, priority, gateway, resume):
+                break
+
+            del self._deferred[job_name]
+
+    def stats(self):
+        with self._job_set_lock:
+            return {"depth"     : self._tasks.qsize(),
+                    "deferred"  : len(self._deferred),
+                    "jobs"      : len(self._jobs),
+                    "accepted"  : self.accepted,
+                    "deferrals" : self.deferrals,
+                    "rejected"  : self.rejected,
+                    "coalesced" : self.coalesced}
+
+    def run_job(self, job, worker, logger):
+        # Taking the job made room in the queue for a deferred one
+        with self._job_set_lock:
+            queued_deferred = bool(self._deferred)
+            self._queue_deferred()
+
+        if queued_deferred:
+            self._scheduler.notify()
+
+        self._journal.started(job.job_name)
+        trace = job.trace
+        trace.end_span("queued")
+        set_current_trace(trace)
+        set_current_progress(JobProgress(self._journal, job.job_name, job.resume))
+        result = "ok"
+        start  = time.monotonic()
+        try:
+            with trace.span("job", worker=worker, priority=job.priority, retries=job.retries):
+                job.func(logger, job.job_name)
+
+        except Exception:
+            #TODO: Program unsuccessful three times, converter in error if variants are different
+            logger.error(f"FgcWorker({worker}): failed to reprogam {job.job_name}, setting the converter in error")
+            result = "error"
+
+        finally:
+            set_current_trace(None)
+            set_current_progress(None)
+            trace.finish(result=result)
+            self._journal.finished(job.job_name, result)
+            self._job_done(job, result, time.monotonic() - start)
+            self._tasks.task_done()
+
+            logger.info(f"FgcWorker({worker}): job {job.job_name} removed from tasks")
 
-            with self._job_set_lock:
-                self._jobs.add(job_name)
+    def _job_done(self, job, result, duration):
+        self._tasks.history.record(job.job_name, duration)
+        with self._job_set_lock:
+            if result != "ok":
+                # Kept until the job is queued again. Jobs never queued again are forgotten, oldest first
+                self._retries[job.job_name] = job.retries + 1
+                while len(self._retries) > AreaProgramManager.MAX_NUM_RETRIED:
+                    self._retries.popitem(last=False)
 
-            self._tasks.put((func, job_name))
-            self._logger.info(f"({self.name}) job {job_name} added to queue")
+            self._jobs.discard(job.job_name)
 
     def map(self, func, job_list):
-        for job in job_list:
-            self.add_job(func, job)
+        return [self.add_job(func, job) for job in job_list]
 
     def wait_completion(self):
         self._logger.info(f"({self.name}) waiting for pending tasks to be completed")
         self._tasks.join()
         self._logger.info(f"({self.name}) pending tasks are done")
 
-        for worker in self._workers:
-            worker.stop()
-        
-        self._logger.info(f"{self.name} workers stopped")
-        
\ No newline at end of file
+        if self._own_scheduler:
+            self._scheduler.stop()
+            self._logger.info(f"{self.name} workers stopped")
@@ -0,0 +1,193 @@
+"""asyncio driver of the programming FSM.
+
+A blocked ProgramManagerFsm holds a whole thread while it sleeps between polls.
+The FSM, the programmer and the crate transaction are written as steps
+yielding the operations they need (see pm_fsm.drive); drive_async carries them
+out on an event loop through an AsyncFgcSession, so that a single thread can
+reprogram thousands of converters with the same transitions, production boot
+handling, gateway limits, resume and progress reporting as the worker threads.
+AsyncProgrammingEngine bounds how many crates are reprogrammed at once.
+"""
+
+import asyncio
+import logging
+
+import pyfgc
+import program_manager.pm_fsm as fsm
+import program_manager.regfgc3_programmer as programmer
+from program_manager.gateway_limiter import gateway_limiter
+from program_manager.tracing import JobTrace
+
+MAX_CONCURRENCY   = 500
+TRANSFER_POLL_SEC = 0.05
+
+class AsyncFgcSession:
+    """Interface of the FGC sessions used by drive_async."""
+    async def get(self, prop):
+        raise NotImplementedError
+
+    async def set(self, prop, value):
+        raise NotImplementedError
+
+    async def disconnect(self):
+        pass
+
+class PyFgcAsyncSession(AsyncFgcSession):
+    """Thin adapter running the calls of a blocking pyfgc session in an executor.
+
+    Only the network round trips use the executor; waiting between polls is
+    done by the event loop.
+    """
+    def __init__(self, fgc_session, executor=None):
+        self._fgc_session = fgc_session
+        self._executor    = executor
+
+    @classmethod
+    async def connect(cls, converter, executor=None):
+        loop = asyncio.get_running_loop()
+        try:
+            fgc_session = await loop.run_in_executor(executor, pyfgc.connect, converter)
+
+        except pyfgc.PyFgcError as pe:
+            raise RuntimeError(pe)
+
+        return cls(fgc_session, executor)
+
+    async def get(self, prop):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._fgc_session.get, prop)
+
+    async def set(self, prop, value):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._fgc_session.set, prop, value)
+
+    async def disconnect(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._fgc_session.disconnect)
+
+async def drive_async(steps, fgc_session):
+    """Carries out the operations yielded by steps with an AsyncFgcSession.
+
+    Counterpart of pm_fsm.drive. Returns the value returned by steps.
+    """
+    reply, error = None, None
+    try:
+        while True:
+            try:
+                op = steps.send(reply) if error is None else steps.throw(error)
+
+            except StopIteration as stop:
+                return stop.value
+
+            try:
+                reply, error = await _execute(op, fgc_session), None
+
+            except Exception as e:
+                reply, error = None, e
+
+    finally:
+        steps.close()
+
+async def _execute(op, fgc_session):
+    kind, *args = op
+    if kind == fsm.OP_GET:
+        return await fgc_session.get(*args)
+
+    if kind == fsm.OP_SET:
+        return await fgc_session.set(*args)
+
+    if kind == fsm.OP_SLEEP:
+        await asyncio.sleep(*args)
+        return None
+
+    if kind == fsm.OP_TRANSFER:
+        return await _acquire_transfer(*args)
+
+    raise RuntimeError(f"Unknown FSM operation {kind}")
+
+async def _acquire_transfer(gateway):
+    # Waiting on the limiter would block the event loop, its slots are polled instead
+    since = gateway_limiter.now()
+    while True:
+        transfer = gateway_limiter.acquire(gateway, blocking=False, since=since)
+        if transfer is not None:
+            return transfer
+
+        await asyncio.sleep(TRANSFER_POLL_SEC)
+
+class AsyncProgramManagerFsm(fsm.ProgramManagerFsm):
+    """ProgramManagerFsm run from an event loop, through an AsyncFgcSession.
+
+    The transitions and states are those of ProgramManagerFsm; only process()
+    differs. The session must be given, it is not created here.
+    """
+    async def process(self):
+        await drive_async(self.steps(), self._fgc_session)
+
+    def _set_valid_fgc_connection(self):
+        if not self._fgc_session:
+            raise RuntimeError(f"No FGC session given for {self.prog_data_dict['converter']}")
+
+    def __str__(self):
+        return f"<AsyncProgramManagerFsm: {self.mode}, {self.state}>"
+
+class AsyncProgrammingEngine:
+    """Reprograms crates on one event loop, at most max_concurrency at a time.
+
+    Arguments:
+        session_factory -- Coroutine function returning an AsyncFgcSession for a converter
+        max_concurrency -- Maximum number of crates in flight
+        tracer          -- Tracer the trace of every crate is written to, None not to write them
+    """
+    def __init__(self, session_factory=PyFgcAsyncSession.connect, max_concurrency=MAX_CONCURRENCY, fw_catalog=None, poll_schedules=None,
+                 tracer=None, logger=None):
+        self._session_factory = session_factory
+        self._max_concurrency = max_concurrency
+        self._fw_catalog      = fw_catalog
+        self._poll_schedules  = poll_schedules
+        self._tracer          = tracer
+        self._logger          = logger or logging.getLogger("pm_main." + __name__)
+
+    async def program_crate(self, converter, jobs, progress=None):
+        """Async counterpart of regfgc3_programmer.program_crate, with the same arguments and result.
+
+        progress is the JobProgress of the crate (states reached and resume), a detached one if None.
+        """
+        trace = JobTrace(converter, self._tracer)
+        try:
+            with trace.span("connect", converter=converter):
+                fgc_session = await self._session_factory(converter)
+
+        except RuntimeError as e:
+            self._logger.error(f"{converter}: could not connect ({e})")
+            trace.finish(result="error")
+            return {(job[0], job[2]): 3 for job in jobs}, None
+
+        try:
+            results, slot_info = await drive_async(programmer.program_crate_steps(converter, jobs, fgc_session,
+                                                                                 fw_catalog=self._fw_catalog,
+                                                                                 trace=trace,
+                                                                                 poll_schedules=self._poll_schedules,
+                                                                                 progress=progress),
+                                                   fgc_session)
+
+        finally:
+            await fgc_session.disconnect()
+
+        trace.finish(result="ok" if all(attempts < 3 for attempts in results.values()) else "error")
+        return results, slot_info
+
+    async def run(self, crates, progress_of=None):
+        """Reprograms crates, a converter -> program_crate jobs dict.
+
+        Arguments:
+            progress_of -- Function returning the JobProgress of a converter, None for detached ones
+
+        Returns:
+            dict -- converter -> program_crate result
+        """
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async def bounded_program_crate(converter, jobs):
+            async with semaphore:
+                return await self.program_crate(converter, jobs, progress_of(converter) if progress_of else None)
+
+        results = await asyncio.gather(*(bounded_program_crate(converter, jobs) for converter, jobs in crates.items()))
+        return dict(zip(crates, results))
@@ -0,0 +1,251 @@
+"""Pool of pyfgc sessions shared by workers, programming attempts and scripts.
+
+Sessions are kept per converter and handed to one user at a time. Idle
+sessions are health checked before being reused and closed after
+idle_timeout seconds. The number of sessions open through one gateway is
+capped; when the cap is reached idle sessions of that gateway are closed, or
+the caller waits for one to be released.
+
+The gateway of a converter is looked up by gateway_of(), which the
+gateway_limiter also uses. ProgramManagerServer points it to its name index,
+so that all the per gateway limits agree after a name file reload.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import pyfgc
+import pyfgc_name
+from program_manager.scheduler import MAX_PER_GATEWAY
+from program_manager.tracing import current_trace
+
+IDLE_TIMEOUT_SEC         = 300
+HEALTH_CHECK_AFTER_SEC   = 30
+# Every job running through a gateway holds one session
+MAX_SESSIONS_PER_GATEWAY = MAX_PER_GATEWAY
+ACQUIRE_TIMEOUT_SEC      = 60
+
+def name_file_gateway_of(converter):
+    """Gateway of a converter according to the name file loaded by pyfgc_name, None if unknown."""
+    try:
+        return pyfgc_name.devices[converter]["gateway"]
+
+    except (KeyError, TypeError):
+        return None
+
+def check_session_health(fgc_session):
+    _ = fgc_session.get("REGFGC3.PROG.FSM.STATE")
+
+class _PooledSession:
+    __slots__ = ("fgc_session", "converter", "gateway", "last_used")
+
+    def __init__(self, fgc_session, converter, gateway):
+        self.fgc_session = fgc_session
+        self.converter   = converter
+        self.gateway     = gateway
+        self.last_used   = time.monotonic()
+
+class FgcSessionPool:
+    def __init__(self, connect=pyfgc.connect, gateway_of=name_file_gateway_of, health_check=check_session_health,
+                 max_per_gateway=MAX_SESSIONS_PER_GATEWAY, idle_timeout=IDLE_TIMEOUT_SEC,
+                 health_check_after=HEALTH_CHECK_AFTER_SEC):
+        self._connect            = connect
+        self.gateway_lookup      = gateway_of
+        self._health_check       = health_check
+        self.max_per_gateway     = max_per_gateway
+        self.idle_timeout        = idle_timeout
+        self.health_check_after  = health_check_after
+
+        # converter -> idle _PooledSession list; gateway -> number of open sessions
+        self._idle               = dict()
+        self._open_per_gateway   = dict()
+        self._cond               = threading.Condition()
+        self._logger             = logging.getLogger("pm_main." + __name__)
+
+        self.connects            = 0
+        self.reuses              = 0
+        self.failures            = 0
+        self.evictions           = 0
+
+    @contextmanager
+    def session(self, converter, timeout=ACQUIRE_TIMEOUT_SEC):
+        """Context manager lending a session to the converter.
+
+        The session goes back to the pool unless a pyfgc error was raised while
+        it was in use, in which case it is closed.
+        """
+        pooled = self.acquire(converter, timeout)
+        try:
+            yield pooled.fgc_session
+
+        except pyfgc.PyFgcError:
+            self._close(pooled)
+            raise
+
+        except BaseException:
+            self.release(pooled)
+            raise
+
+        else:
+            self.release(pooled)
+
+    def acquire(self, converter, timeout=ACQUIRE_TIMEOUT_SEC):
+        # Getting a working session is the connect span of the job's trace, be it new or reused
+        with current_trace().span("connect", converter=converter) as span:
+            return self._acquire(converter, timeout, span)
+
+    def gateway_of(self, converter):
+        """Gateway of a converter, the converter itself if unknown."""
+        return self.gateway_lookup(converter) or converter
+
+    def _acquire(self, converter, timeout, span):
+        gateway  = self.gateway_of(converter)
+        deadline = time.monotonic() + timeout
+
+        while True:
+            victim = None
+            with self._cond:
+                pooled = self._pop_idle(converter)
+                if pooled is None:
+                    reserved, victim = self._reserve(gateway)
+                    if not reserved:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise RuntimeError(f"Timeout waiting for a connection to {converter} through gateway {gateway}")
+
+                        self._cond.wait(remaining)
+                        continue
+
+            if victim is not None:
+                self._disconnect(victim)
+
+            if pooled is None:
+                span.attrs["reused"] = False
+                return self._new_session(converter, gateway)
+
+            if time.monotonic() - pooled.last_used >= self.health_check_after:
+                span.attrs["health_checked"] = True
+                try:
+                    self._health_check(pooled.fgc_session)
+
+                except Exception as e:
+                    self._logger.warning(f"Pooled connection to {converter} failed its health check: {e}")
+                    self._count("failures")
+                    self._close(pooled)
+                    continue
+
+            self._count("reuses")
+            span.attrs["reused"] = True
+            return pooled
+
+    def release(self, pooled):
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.setdefault(pooled.converter, list()).append(pooled)
+            self._cond.notify_all()
+
+    def evict_idle(self):
+        """Closes the sessions idle for longer than idle_timeout."""
+        limit = time.monotonic() - self.idle_timeout
+        expired = list()
+        with self._cond:
+            for converter, idle in list(self._idle.items()):
+                expired.extend(p for p in idle if p.last_used < limit)
+                idle[:] = [p for p in idle if p.last_used >= limit]
+                if not idle:
+                    del self._idle[converter]
+
+        for pooled in expired:
+            self._count("evictions")
+            self._close(pooled)
+
+    def close_all(self):
+        with self._cond:
+            idle = [p for sessions in self._idle.values() for p in sessions]
+            self._idle.clear()
+
+        for pooled in idle:
+            self._close(pooled)
+
+    def stats(self):
+        with self._cond:
+            return {"connects"          : self.connects,
+                    "reuses"            : self.reuses,
+                    "failures"          : self.failures,
+                    "evictions"         : self.evictions,
+                    "idle"              : sum(len(idle) for idle in self._idle.values()),
+                    "open_per_gateway"  : dict(self._open_per_gateway)}
+
+    def _pop_idle(self, converter):
+        idle = self._idle.get(converter)
+        if not idle:
+            return None
+
+        pooled = idle.pop()
+        if not idle:
+            del self._idle[converter]
+
+        return pooled
+
+    def _reserve(self, gateway):
+        # Called with the lock held. Returns whether a session can be opened
+        # and, if an idle one had to make room for it, the session to close
+        victim = None
+        if self._open_per_gateway.get(gateway, 0) >= self.max_per_gateway:
+            victim = self._oldest_idle_of_gateway(gateway)
+            if victim is None:
+                return False, None
+
+            self._idle[victim.converter].remove(victim)
+            if not self._idle[victim.converter]:
+                del self._idle[victim.converter]
+
+            self.evictions += 1
+            self._open_per_gateway[gateway] -= 1
+
+        self._open_per_gateway[gateway] = self._open_per_gateway.get(gateway, 0) + 1
+        return True, victim
+
+    def _oldest_idle_of_gateway(self, gateway):
+        candidates = [p for idle in self._idle.values() for p in idle if p.gateway == gateway]
+        return min(candidates, key=lambda p: p.last_used, default=None)
+
+    def _new_session(self, converter, gateway):
+        try:
+            fgc_session = self._connect(converter)
+
+        except Exception:
+            with self._cond:
+                self.failures += 1
+                self._open_per_gateway[gateway] -= 1
+                self._cond.notify_all()
+
+            raise
+
+        self._count("connects")
+        return _PooledSession(fgc_session, converter, gateway)
+
+    def _count(self, counter):
+        with self._cond:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _close(self, pooled):
+        self._disconnect(pooled)
+        with self._cond:
+            self._open_per_gateway[pooled.gateway] -= 1
+            self._cond.notify_all()
+
+    def _disconnect(self, pooled):
+        try:
+            pooled.fgc_session.disconnect()
+
+        except pyfgc.PyFgcError as pe:
+            self._logger.warning(f"Could not close connection to {pooled.converter}: {pe}")
+
+fgc_pool = FgcSessionPool()
+
+def gateway_of(converter):
+    """Gateway of a converter for the per gateway limits, as looked up by fgc_pool."""
+    return fgc_pool.gateway_of(converter)
@@ -0,0 +1,481 @@
+"""Simulated FGCs, status server and name index, to run the program manager
+without hardware.
+
+SimulatedFgc answers the properties the program manager uses (REGFGC3.SLOT_INFO,
+REGFGC3.PROG.* and the programming FSM) like an FGC: each time
+REGFGC3.PROG.FSM.MODE is set, the FSM moves one interim state forward after a
+configurable latency. The binary transferred is checked against
+REGFGC3.PROG.BIN_SIZE_BYTES and REGFGC3.PROG.BIN_CRC, and a successfully
+programmed device shows its new variant in REGFGC3.SLOT_INFO. Failures can be
+injected per state (the FSM goes to ERROR) and on every get/set (PyFgcError).
+
+SimulatedFleet is a set of converters spread over gateways and areas. It
+provides the connect function of the FGCs (for FgcSessionPool or direct use;
+connect_async for AsyncProgrammingEngine), a SimulatedStatusServer flagging
+SYNC_REGFGC3 on converters whose firmware is not the expected one, a
+SimulatedNameIndex and the job reprogramming a converter, which is all
+ProgramManagerServer needs to run end to end.
+"""
+
+import os
+import random
+import struct
+import threading
+import time
+import types
+
+import pyfgc
+import program_manager.regfgc3_programmer as programmer
+from program_manager.async_fsm import AsyncFgcSession
+from program_manager.fw_catalog import crc16_ccitt
+from program_manager.pm_fsm import DEFAULT_POLL_SCHEDULE, STATE_POLL_SCHEDULES, PollSchedule, ProgramManagerFsm
+from program_manager.status_ingest import SYNC_FLAG
+
+# Seconds an FGC needs to reach each state
+STATE_LATENCIES = {
+    "WAITING"      : 0.3,
+    "TRANSFERRING" : 1.5,
+    "TRANSFERRED"  : 0.2,
+    "GET_PROG_INFO": 0.3,
+    "PROGRAMMING"  : 8.0,
+    "PROG_CHK"     : 1.5,
+    "PROGRAMMED"   : 0.2,
+    "SET_PB_PARS"  : 0.3,
+    "TO_PROD_BOOT" : 5.0,
+    "CLEAN_UP"     : 0.3,
+}
+
+# (slot, board, [(device, variant, var_revision, api_revision)]) of a simulated crate
+DEFAULT_CRATE = (("5", "VS_STATE_CTRL", (("DB", "3", "208", "200"), ("MF", "0", "0", "0"))),
+                 ("6", "VS_REG_DSP",    (("DB", "3", "205", "200"), ("MF", "0", "0", "0"))))
+
+# (board, device) -> (variant, var_revision, api_revision) expected in a simulated crate
+DEFAULT_EXPECTED = {("VS_STATE_CTRL", "MF") : ("IGBT_34", "208", "208"),
+                    ("VS_REG_DSP", "MF")    : ("DSP_2", "105", "208")}
+
+CONVERTERS_PER_GATEWAY = 30
+GATEWAYS_PER_AREA      = 8
+FW_FILE_SIZE_BYTES     = 4096
+SIMULATED_CLASS_ID     = 63
+
+# The FSM can be cleaned up from any state, as the program manager does after an error
+_TRANSITIONS = dict(ProgramManagerFsm.STATE_TO_MODE_TO_INTERIM_STATES)
+_TRANSITIONS["PROGRAMMED"] = dict(_TRANSITIONS["PROGRAMMED"], **ProgramManagerFsm.STATE_TO_MODE_TO_INTERIM_STATES_NO_PROD_BOOT["PROGRAMMED"])
+_TRANSITION_NAMES = {state: {mode: [interim_state(None).name for interim_state in interim_states]
+                             for mode, interim_states in modes.items()}
+                     for state, modes in _TRANSITIONS.items()}
+
+_BIN_PROPERTY_PREFIX = "REGFGC3.PROG.BIN["
+
+def scaled_poll_schedules(scale):
+    """Poll schedules of every state, for FGCs whose latencies are multiplied by scale."""
+    return {state: PollSchedule(schedule.first_delay * scale, schedule.initial * scale, schedule.factor, schedule.maximum * scale)
+            for state, schedule in ((state, STATE_POLL_SCHEDULES.get(state, DEFAULT_POLL_SCHEDULE)) for state in STATE_LATENCIES)}
+
+class SimulatedFgc:
+    """One FGC with a REGFGC3 crate and its programming FSM.
+
+    Arguments:
+        name              -- Converter name
+        crate             -- (slot, board, [(device, variant, var_revision, api_revision)]) tuples
+        latencies         -- Seconds to reach each state, STATE_LATENCIES by default
+        latency_scale     -- Factor applied to all the latencies
+        state_failures    -- State -> probability of going to ERROR instead of reaching it
+        comm_failure_rate -- Probability of a get/set raising pyfgc.PyFgcError
+        clock             -- Returns the current time in seconds (a virtual clock in tests)
+        rng               -- random.Random used for the failures
+    """
+    def __init__(self, name, crate=DEFAULT_CRATE, latencies=None, latency_scale=1.0, state_failures=None,
+                 comm_failure_rate=0.0, clock=time.monotonic, rng=None):
+        self.name              = name
+        self.latencies         = dict(STATE_LATENCIES, **(latencies or dict()))
+        self.latency_scale     = latency_scale
+        self.state_failures    = state_failures or dict()
+        self.comm_failure_rate = comm_failure_rate
+        self._clock            = clock
+        self._rng              = rng or random.Random()
+        self._lock             = threading.Lock()
+
+        # slot -> [board, state, {device: [variant, var_revision, api_revision]}]
+        self._slots = {slot: [board, "DownloadBoot", {dev[0]: list(dev[1:]) for dev in devices}] for slot, board, devices in crate}
+
+        self._mode        = None
+        self._path        = list()
+        self._state       = "UNINITIALIZED"
+        self._last_state  = "UNINITIALIZED"
+        self._board_error = ""
+        self._transition  = None
+        self._prog        = dict()
+        self._bin_words   = dict()
+
+        self.connected          = True
+        self.sets               = 0
+        self.gets               = 0
+        self.devices_programmed = 0
+        self.errors             = 0
+
+    def get(self, prop):
+        with self._lock:
+            self._check_comm(prop)
+            self.gets += 1
+            return types.SimpleNamespace(value=self._get(prop))
+
+    def set(self, prop, value):
+        with self._lock:
+            self._check_comm(prop)
+            self.sets += 1
+            self._set(prop, value)
+            return types.SimpleNamespace(value="")
+
+    def disconnect(self):
+        self.connected = False
+
+    def slot_info(self):
+        """REGFGC3.SLOT_INFO, formatted as the FGC does."""
+        with self._lock:
+            return self._slot_info()
+
+    def devices(self):
+        """(slot, board, device, variant, var_revision, api_revision) of every device of the crate."""
+        with self._lock:
+            return [(slot, board, device, *versions)
+                    for slot, (board, _, devices) in self._slots.items()
+                    for device, versions in devices.items()]
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _check_comm(self, prop):
+        # Called with the lock held
+        if not self.connected:
+            raise pyfgc.PyFgcError(f"{self.name}: not connected")
+
+        if self.comm_failure_rate and self._rng.random() < self.comm_failure_rate:
+            raise pyfgc.PyFgcError(f"{self.name}: simulated communication error accessing {prop}")
+
+    def _get(self, prop):
+        if prop == "REGFGC3.PROG.FSM.STATE":
+            return self._current_state()
+
+        if prop == "REGFGC3.PROG.FSM.LAST_STATE":
+            self._current_state()
+            return self._last_state
+
+        if prop == "REGFGC3.PROG.DEBUG.BOARD_ERROR":
+            self._current_state()
+            return self._board_error
+
+        if prop == "REGFGC3.PROG.FSM.MODE":
+            return self._mode or ""
+
+        if prop == "REGFGC3.SLOT_INFO":
+            return self._slot_info()
+
+        if prop.startswith("REGFGC3.PROG."):
+            return self._prog.get(prop, "")
+
+        raise pyfgc.PyFgcError(f"{self.name}: unknown property {prop}")
+
+    def _set(self, prop, value):
+        if prop == "REGFGC3.PROG.FSM.MODE":
+            self._set_mode(value)
+
+        elif prop.startswith(_BIN_PROPERTY_PREFIX):
+            index = int(prop[len(_BIN_PROPERTY_PREFIX):].split(",")[0])
+            for i, word in enumerate(value.split(",")):
+                self._bin_words[index + i] = int(word, 16)
+
+        elif prop == "REGFGC3.SLOT_INFO":
+            # Crate rescan, the crate does not change by itself
+            pass
+
+        elif prop.startswith("REGFGC3.PROG."):
+            self._prog[prop] = str(value)
+
+        else:
+            raise pyfgc.PyFgcError(f"{self.name}: unknown property {prop}")
+
+    def _set_mode(self, mode):
+        state = self._current_state()
+        if mode == state:
+            return
+
+        # A new mode, or the same one again after the FSM went to ERROR
+        if mode != self._mode or not (self._path or self._transition):
+            try:
+                self._path = list(_TRANSITION_NAMES[state][mode])
+
+            except KeyError:
+                if mode != "CLEAN_UP":
+                    raise pyfgc.PyFgcError(f"{self.name}: mode {mode} not allowed in state {state}")
+
+                self._path = ["CLEAN_UP"]
+
+            self._mode = mode
+
+        if self._path and not self._transition:
+            next_state = self._path.pop(0)
+            if next_state == "WAITING":
+                self._bin_words.clear()
+
+            self._transition = (self._clock() + self.latencies[next_state] * self.latency_scale, next_state)
+
+    def _current_state(self):
+        # Called with the lock held. Completes the transition in progress if it is due
+        if self._transition and self._transition[0] <= self._clock():
+            _, next_state    = self._transition
+            self._transition = None
+            self._enter(next_state)
+
+        return self._state
+
+    def _enter(self, next_state):
+        error = self._check_state(next_state)
+        if error:
+            self._last_state  = next_state
+            self._board_error = error
+            self._state       = "ERROR"
+            self._path        = list()
+            self.errors      += 1
+            return
+
+        self._last_state = self._state
+        self._state      = next_state
+        if next_state == "CLEAN_UP":
+            self._board_error = ""
+
+        elif next_state == "PROGRAMMED":
+            self._program_device()
+
+        elif next_state == "TO_PROD_BOOT":
+            self._slots[self._prog.get("REGFGC3.PROG.SLOT")][1] = "ProductionBoot"
+
+    def _check_state(self, next_state):
+        if next_state == "TRANSFERRED":
+            return self._check_binary()
+
+        if next_state in ("GET_PROG_INFO", "SET_PB_PARS") and self._prog.get("REGFGC3.PROG.SLOT") not in self._slots:
+            return "SLOT_NOT_FOUND"
+
+        failure_rate = self.state_failures.get(next_state)
+        if failure_rate and self._rng.random() < failure_rate:
+            return "SIMULATED_FAILURE"
+
+        return ""
+
+    def _check_binary(self):
+        try:
+            size = int(self._prog["REGFGC3.PROG.BIN_SIZE_BYTES"])
+            crc  = int(self._prog["REGFGC3.PROG.BIN_CRC"])
+
+        except (KeyError, ValueError):
+            return "BIN_INFO_MISSING"
+
+        num_words = (size + 3) // 4
+        if any(i not in self._bin_words for i in range(num_words)):
+            return "BIN_INCOMPLETE"
+
+        fw_bin = struct.pack(f">{num_words}I", *(self._bin_words[i] for i in range(num_words)))[:size]
+        if crc16_ccitt(fw_bin) != crc:
+            return "BIN_CRC_MISMATCH"
+
+        return ""
+
+    def _program_device(self):
+        _, _, devices = self._slots[self._prog["REGFGC3.PROG.SLOT"]]
+        devices[self._prog["REGFGC3.PROG.DEVICE"]] = [self._prog["REGFGC3.PROG.VARIANT"],
+                                                      self._prog["REGFGC3.PROG.VARIANT_REVISION"],
+                                                      self._prog["REGFGC3.PROG.API_REVISION"]]
+        self.devices_programmed += 1
+
+    def _slot_info(self):
+        fields = list()
+        for slot, (board, state, devices) in self._slots.items():
+            fields += ["------------------------------", f"SLOT       {slot}", f"BOARD       {board}", f"STATE      {state}"]
+            for device, (variant, var_revision, api_revision) in devices.items():
+                fields += [f"Device     {device}", f"Variant    {variant}", f"Var_Rev    {var_revision}", f"API_Rev    {api_revision}", ""]
+
+        return ",".join(fields)
+
+class SimulatedAsyncFgc(AsyncFgcSession):
+    """A SimulatedFgc behind the AsyncFgcSession interface. The simulated FGC answers at once."""
+    def __init__(self, fgc):
+        self.fgc = fgc
+
+    async def get(self, prop):
+        return self.fgc.get(prop)
+
+    async def set(self, prop, value):
+        return self.fgc.set(prop, value)
+
+    async def disconnect(self):
+        self.fgc.disconnect()
+
+class SimulatedStatusServer:
+    """Publishes the status of a SimulatedFleet as pyfgc_statussrv.get_status_all does."""
+    def __init__(self, fleet, clock=time.time):
+        self._fleet = fleet
+        self._clock = clock
+
+    def get_status_all(self):
+        now    = self._clock()
+        status = dict()
+        for gateway, converters in self._fleet.gateways.items():
+            status[gateway] = {"recv_time_sec": now,
+                               "devices": {name: {"ST_UNLATCHED": SYNC_FLAG if self._fleet.needs_sync(name) else ""}
+                                           for name in converters}}
+
+        return status
+
+class SimulatedNameIndex:
+    """Name index of a SimulatedFleet, with the lookups of program_manager.name_index.NameIndex."""
+    def __init__(self, fleet):
+        self._fleet = fleet
+
+    def load(self):
+        return set(self.areas)
+
+    def refresh(self):
+        return set()
+
+    def area_of(self, device):
+        return self._fleet.areas.get(device)
+
+    def gateway_of(self, device):
+        return self._fleet.converter_gateway.get(device)
+
+    def devices_of_class(self, class_id):
+        return frozenset(self._fleet.fgcs) if class_id == SIMULATED_CLASS_ID else frozenset()
+
+    @property
+    def areas(self):
+        return frozenset(self._fleet.areas.values())
+
+    def __len__(self):
+        return len(self._fleet.fgcs)
+
+class SimulatedFleet:
+    """Converters with simulated FGCs, spread over gateways and areas.
+
+    A converter needs to be synchronised (and flags SYNC_REGFGC3) once it was
+    released, until all its devices have the expected firmware. Converters
+    are released at creation unless release=False, in which case a load
+    generator releases them with release_converter().
+
+    Keyword arguments not listed are given to every SimulatedFgc.
+    """
+    def __init__(self, num_converters, converters_per_gateway=CONVERTERS_PER_GATEWAY, gateways_per_area=GATEWAYS_PER_AREA,
+                 crate=DEFAULT_CRATE, expected=None, release=True, seed=None, clock=time.monotonic, **fgc_kwargs):
+        self.expected = expected or DEFAULT_EXPECTED
+        self.fw_files = dict()
+        self._clock   = clock
+        self._rng     = random.Random(seed)
+        self._lock    = threading.Lock()
+
+        self.fgcs              = dict()
+        self.gateways          = dict()
+        self.converter_gateway = dict()
+        self.areas             = dict()
+        for i in range(num_converters):
+            gateway_index   = i // converters_per_gateway
+            gateway         = f"cfc-sim-{gateway_index:04d}"
+            name            = f"RPSIM.{gateway_index:04d}.{i % converters_per_gateway:02d}"
+            self.fgcs[name] = SimulatedFgc(name, crate=crate, clock=clock, rng=random.Random(self._rng.random()), **fgc_kwargs)
+            self.gateways.setdefault(gateway, list()).append(name)
+            self.converter_gateway[name] = gateway
+            self.areas[name]             = f"SIM{gateway_index // gateways_per_area:03d}"
+
+        # converter -> time it was released, time it got the expected firmware
+        self.released_at = dict()
+        self.synced_at   = dict()
+        self.connects    = 0
+        if release:
+            for name in self.fgcs:
+                self.release_converter(name)
+
+    def connect(self, converter):
+        """Connects to the simulated FGC of a converter, as pyfgc.connect does."""
+        try:
+            fgc = self.fgcs[converter]
+
+        except KeyError:
+            raise pyfgc.PyFgcError(f"Unknown device {converter}")
+
+        with self._lock:
+            self.connects += 1
+
+        fgc.connected = True
+        return fgc
+
+    async def connect_async(self, converter):
+        """Connects to the simulated FGC of a converter, as the session factory of AsyncProgrammingEngine."""
+        try:
+            return SimulatedAsyncFgc(self.connect(converter))
+
+        except pyfgc.PyFgcError as pe:
+            raise RuntimeError(pe)
+
+    def release_converter(self, converter):
+        with self._lock:
+            self.released_at.setdefault(converter, self._clock())
+
+    def needs_sync(self, converter):
+        return converter in self.released_at and converter not in self.synced_at
+
+    def pending_devices(self, converter):
+        """Devices of a converter without the expected firmware, as program_crate jobs."""
+        jobs = list()
+        for slot, board, device, variant, var_revision, api_revision in self.fgcs[converter].devices():
+            try:
+                exp_variant, exp_var_revision, exp_api_revision = self.expected[(board, device)]
+
+            except KeyError:
+                continue
+
+            if (variant, var_revision, api_revision) != (exp_variant, exp_var_revision, exp_api_revision):
+                bin_crc, fw_file_loc = self.fw_files[(device, exp_variant, exp_var_revision, exp_api_revision)]
+                jobs.append((slot, board, device, exp_variant, exp_var_revision, exp_api_revision, bin_crc, fw_file_loc))
+
+        return jobs
+
+    def write_firmware(self, fw_folder, size=FW_FILE_SIZE_BYTES):
+        """Writes a binary, named as in the FW repository, for every expected firmware."""
+        os.makedirs(fw_folder, exist_ok=True)
+        for i, ((_, device), (variant, var_revision, api_revision)) in enumerate(sorted(self.expected.items())):
+            fw_bin  = bytes(self._rng.getrandbits(8) for _ in range(size))
+            bin_crc = f"{crc16_ccitt(fw_bin):04X}"
+            path    = os.path.join(fw_folder, f"EDA_{9000 + i}-{device}-{variant}-{var_revision}-{api_revision}-{bin_crc}.bin")
+            with open(path, "wb") as fwh:
+                fwh.write(fw_bin)
+
+            self.fw_files[(device, variant, var_revision, api_revision)] = (bin_crc, path)
+
+        return dict(self.fw_files)
+
+    def job(self, poll_schedules=None):
+        """Returns the job func(logger, converter) reprogramming the pending devices of a converter."""
+        def reprogram(logger, converter):
+            jobs = self.pending_devices(converter)
+            logger.info(f"{converter}: {len(jobs)} devices to reprogram")
+            results, _ = programmer.program_crate(converter, jobs, fgc_session=self.connect(converter), poll_schedules=poll_schedules)
+
+            if self.pending_devices(converter):
+                raise RuntimeError(f"{converter}: devices not reprogrammed {[key for key, attempts in results.items() if attempts >= 3]}")
+
+            with self._lock:
+                self.synced_at.setdefault(converter, self._clock())
+
+        return reprogram
+
+    def stats(self):
+        fgcs = self.fgcs.values()
+        return {"converters"         : len(self.fgcs),
+                "released"           : len(self.released_at),
+                "synced"             : len(self.synced_at),
+                "connects"           : self.connects,
+                "gets"               : sum(fgc.gets for fgc in fgcs),
+                "sets"               : sum(fgc.sets for fgc in fgcs),
+                "devices_programmed" : sum(fgc.devices_programmed for fgc in fgcs),
+                "fgc_errors"         : sum(fgc.errors for fgc in fgcs)}
@@ -0,0 +1,145 @@
+"""Index of the firmware binaries available in the FW repository.
+
+The repository folder is scanned once and every binary following the naming
+convention (see FW_FILE_REGEX) is indexed by (device, variant, var_revision,
+api_revision). Later scans only re-check the files whose size or modification
+time changed.
+
+The contents are also checked against the CRC in the file name, with one of
+CRC_FUNCTIONS: CRC-16/CCITT by default, the CRC the FGC checks the binary
+against once it is transferred (REGFGC3.PROG.BIN_CRC).
+"""
+
+import binascii
+import logging
+import os
+import threading
+from collections import namedtuple
+
+from program_manager.fw_payload import FW_FILE_REGEX
+
+FirmwareEntry = namedtuple("FirmwareEntry", "device, variant, var_revision, api_revision, bin_crc, path, size, mtime_ns")
+
+def crc16_ccitt(fw_bin):
+    """CRC-16/CCITT (polynomial 0x1021, initial value 0xFFFF) of a binary."""
+    return binascii.crc_hqx(fw_bin, 0xFFFF)
+
+# Name in the configuration file (fs_fw_crc_check) -> CRC function
+CRC_FUNCTIONS        = {"crc16_ccitt": crc16_ccitt}
+DEFAULT_FW_CRC_CHECK = "crc16_ccitt"
+
+class FirmwareCatalog:
+    def __init__(self, fw_folder, crc_func=crc16_ccitt, verify_crc=True):
+        self.fw_folder   = os.path.abspath(fw_folder)
+        self.crc_func    = crc_func
+        self.verify_crc  = verify_crc
+
+        # path -> (size, mtime_ns, FirmwareEntry or None, error)
+        self._files      = dict()
+        self._index      = dict()
+        self._lock       = threading.Lock()
+        self._scan_lock  = threading.Lock()
+        self._logger     = logging.getLogger("pm_main." + __name__)
+
+    def scan(self):
+        """Updates the catalog with the current contents of the FW folder.
+
+        Returns:
+            set -- Paths of the files added, modified or removed since last scan
+        """
+        with self._scan_lock:
+            return self._scan()
+
+    def _scan(self):
+        changed = set()
+        files   = dict()
+
+        try:
+            dir_entries = list(os.scandir(self.fw_folder))
+
+        except FileNotFoundError:
+            self._logger.error(f"Firmware folder {self.fw_folder} not found")
+            dir_entries = list()
+
+        for dir_entry in dir_entries:
+            if not dir_entry.is_file():
+                continue
+
+            stat_info = dir_entry.stat()
+            previous  = self._files.get(dir_entry.path)
+            if previous and previous[:2] == (stat_info.st_size, stat_info.st_mtime_ns):
+                files[dir_entry.path] = previous
+                continue
+
+            entry, error = self._check_file(dir_entry.path, stat_info)
+            if error:
+                self._logger.warning(f"Firmware file {dir_entry.path} rejected: {error}")
+
+            files[dir_entry.path] = (stat_info.st_size, stat_info.st_mtime_ns, entry, error)
+            changed.add(dir_entry.path)
+
+        changed.update(set(self._files) - set(files))
+
+        index = dict()
+        for _, _, entry, _ in files.values():
+            if entry:
+                index[entry[:4]] = entry
+
+        with self._lock:
+            self._files = files
+            self._index = index
+
+        if changed:
+            self._logger.info(f"Firmware catalog {self.fw_folder}: {len(index)} valid files, {len(changed)} changed")
+
+        return changed
+
+    def _check_file(self, path, stat_info):
+        m = FW_FILE_REGEX.fullmatch(os.path.basename(path))
+        if not m:
+            return None, "file name does not conform to naming standards"
+
+        if not stat_info.st_size:
+            return None, "file is empty"
+
+        device, variant, var_revision, api_revision, bin_crc = m.groups()
+        if self.verify_crc:
+            try:
+                with open(path, "rb") as fwh:
+                    crc = self.crc_func(fwh.read())
+
+            except OSError as e:
+                return None, f"{e}"
+
+            try:
+                crc_in_name = int(bin_crc, 16)
+
+            except ValueError:
+                return None, f"CRC {bin_crc} in name is not hexadecimal"
+
+            if crc != crc_in_name:
+                return None, f"CRC {crc:04X} does not match CRC {bin_crc} in name"
+
+        return FirmwareEntry(device, variant, var_revision, api_revision, bin_crc,
+                             path, stat_info.st_size, stat_info.st_mtime_ns), None
+
+    def lookup(self, device, variant, var_revision, api_revision):
+        """Returns the FirmwareEntry for the given firmware, None if unavailable."""
+        return self._index.get((device, variant, str(var_revision), str(api_revision)))
+
+    def check(self, fw_file_loc):
+        """Returns None if the file is a valid catalogued binary, otherwise the reason why not."""
+        try:
+            _, _, entry, error = self._files[os.path.abspath(fw_file_loc)]
+
+        except KeyError:
+            return f"file not found in firmware catalog {self.fw_folder}"
+
+        return error
+
+    @property
+    def entries(self):
+        return list(self._index.values())
+
+    def __len__(self):
+        return len(self._index)
@@ -0,0 +1,241 @@
+"""Encoding of firmware binaries into REGFGC3.PROG.BIN payloads.
+
+The FGC expects the binary as comma separated hexadecimal 32 bit words, sent in
+chunks of at most LIMIT_GW_CMD_WORDS words per command (REGFGC3.PROG.BIN[i,]).
+"""
+
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import OrderedDict
+
+BYTES_PER_WORD       = 4
+CHARS_PER_WORD       = 8
+FW_FILE_LIMIT_BYTES  = 4194304
+LIMIT_GW_CMD_WORDS   = 66100
+FW_FILE_REGEX        = re.compile(r"EDA_\d{1,5}-([A-Z]{2,6}_*\d*)-([A-Z]+_\d+)-(\d*)-(\d*)-([0-9A-Z]{4}).bin")
+
+PAYLOAD_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Longest encoding of a word: "0x" + 8 hex chars + ","
+MAX_ENCODED_WORD_CHARS  = 11
+# Words converted per unpack call when streaming, keeps temporaries small
+_STREAM_BLOCK_WORDS     = 4096
+_STREAM_BLOCK_STRUCT    = struct.Struct(f">{_STREAM_BLOCK_WORDS}I")
+# Approximate per object overhead of a compact ASCII str
+_STR_OVERHEAD_BYTES     = 49
+
+def _pad_to_word(fw_bin):
+    # A short last word is right-padded with zeros, as the FGC expects full words
+    padding = -len(fw_bin) % BYTES_PER_WORD
+    if padding:
+        fw_bin = bytes(fw_bin) + b"\x00" * padding
+
+    return fw_bin
+
+def encode_fw_bin(fw_bin, chunk_words=LIMIT_GW_CMD_WORDS):
+    """Encodes a firmware binary into the REGFGC3.PROG.BIN chunk strings.
+
+    All the words are unpacked in one go and converted to hex in bulk, instead
+    of converting them one by one.
+
+    Arguments:
+        fw_bin {bytes}      -- Firmware binary contents
+        chunk_words {int}   -- Maximum number of words per chunk
+
+    Returns:
+        list -- Tuples (first word index, chunk string), in transfer order
+    """
+    fw_bin = _pad_to_word(fw_bin)
+    words  = struct.unpack(f">{len(fw_bin) // BYTES_PER_WORD}I", fw_bin)
+
+    return [(i, ",".join(map(hex, words[i:i + chunk_words]))) for i in range(0, len(words), chunk_words)]
+
+def _encode_words(fw_buffer, offset, num_words):
+    pieces = list()
+    end    = offset + num_words * BYTES_PER_WORD
+
+    while offset < end:
+        block_words = min(_STREAM_BLOCK_WORDS, (end - offset) // BYTES_PER_WORD)
+        if block_words == _STREAM_BLOCK_WORDS:
+            block_struct = _STREAM_BLOCK_STRUCT
+
+        else:
+            block_struct = struct.Struct(f">{block_words}I")
+
+        pieces.append(",".join(map(hex, block_struct.unpack_from(fw_buffer, offset))))
+        offset += block_words * BYTES_PER_WORD
+
+    return ",".join(pieces)
+
+def iter_fw_chunks(fw_file_loc, chunk_words=LIMIT_GW_CMD_WORDS):
+    """Memory-maps a firmware file and encodes it one chunk at a time.
+
+    Yields the same (first word index, chunk string) tuples as encode_fw_bin,
+    but only one chunk string is alive at a time.
+    """
+    with open(fw_file_loc, "rb") as fwh:
+        if not os.fstat(fwh.fileno()).st_size:
+            return
+
+        with mmap.mmap(fwh.fileno(), 0, access=mmap.ACCESS_READ) as fw_map:
+            full_words  = len(fw_map) // BYTES_PER_WORD
+            tail        = fw_map[full_words * BYTES_PER_WORD:]
+            total_words = full_words + (1 if tail else 0)
+
+            for i in range(0, total_words, chunk_words):
+                num_words = min(chunk_words, total_words - i)
+                num_full  = min(num_words, full_words - i)
+
+                # The chunk is not bound to a local so it is freed as soon as the consumer drops it
+                if num_full == num_words:
+                    yield i, _encode_words(fw_map, i * BYTES_PER_WORD, num_full)
+
+                else:
+                    tail_word = hex(struct.unpack(">I", _pad_to_word(tail))[0])
+                    yield i, ",".join(filter(None, (_encode_words(fw_map, i * BYTES_PER_WORD, num_full), tail_word)))
+
+def encode_fw_file(fw_file_loc, chunk_words=LIMIT_GW_CMD_WORDS):
+    """Encodes a whole firmware file. See encode_fw_bin."""
+    return list(iter_fw_chunks(fw_file_loc, chunk_words))
+
+def get_fw_chunks(fw_file_loc, cache=None):
+    """Returns the payload chunks to transfer for a firmware file.
+
+    The payload is served from the shared cache when it can hold it, otherwise
+    it is streamed from the file so that only one chunk is kept per job.
+    """
+    cache = cache or payload_cache
+    fw_file_size = os.stat(fw_file_loc).st_size
+
+    if fw_file_size // BYTES_PER_WORD * MAX_ENCODED_WORD_CHARS > cache.max_bytes:
+        return iter_fw_chunks(fw_file_loc)
+
+    return cache.get(fw_file_loc)
+
+def _crc_from_name(fw_file_loc):
+    m = FW_FILE_REGEX.search(os.path.basename(fw_file_loc))
+    return m and m.group(5)
+
+def _payload_size(chunks):
+    return sum(len(chunk) + _STR_OVERHEAD_BYTES for _, chunk in chunks)
+
+class _PendingEncode:
+    def __init__(self):
+        self.done   = threading.Event()
+        self.chunks = None
+        self.error  = None
+
+class PayloadCache:
+    """Process-wide LRU cache of encoded firmware payloads.
+
+    Entries are keyed by file path, size, modification time and the CRC in the
+    file's name, so a replaced file is never served from the cache. The total
+    size of the cached chunk strings is kept under max_bytes. Workers missing
+    the same entry at the same time wait for a single encoding.
+    """
+    def __init__(self, max_bytes=PAYLOAD_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+
+        self._entries  = OrderedDict()
+        self._pending  = dict()
+        self._size     = 0
+        self._lock     = threading.Lock()
+        self._logger   = logging.getLogger("pm_main." + __name__)
+
+        self.hits      = 0
+        self.misses    = 0
+        self.waits     = 0
+        self.evictions = 0
+
+    def get(self, fw_file_loc):
+        """Returns the encoded chunks of a firmware file (see encode_fw_bin).
+
+        Raises FileNotFoundError if the file does not exist.
+        """
+        fw_file_info = os.stat(fw_file_loc)
+        key = (os.path.abspath(fw_file_loc), fw_file_info.st_size, fw_file_info.st_mtime_ns, _crc_from_name(fw_file_loc))
+
+        with self._lock:
+            try:
+                chunks = self._entries[key][0]
+
+            except KeyError:
+                pending = self._pending.get(key)
+                owner   = pending is None
+                if owner:
+                    pending = self._pending[key] = _PendingEncode()
+                    self.misses += 1
+
+                else:
+                    self.waits += 1
+
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return chunks
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+
+            return pending.chunks
+
+        try:
+            pending.chunks = encode_fw_file(fw_file_loc)
+
+        except Exception as e:
+            pending.error = e
+            raise
+
+        else:
+            self._store(key, pending.chunks)
+            return pending.chunks
+
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+            pending.done.set()
+
+    def _store(self, key, chunks):
+        size = _payload_size(chunks)
+        if size > self.max_bytes:
+            self._logger.debug(f"Payload of {key[0]} ({size} bytes) exceeds cache budget {self.max_bytes}, not cached")
+            return
+
+        with self._lock:
+            # Older versions of the same file will not be requested any more
+            for old_key in [k for k in self._entries if k[0] == key[0]]:
+                self._evict(old_key)
+
+            self._entries[key] = (chunks, size)
+            self._size += size
+
+            while self._size > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        _, size = self._entries.pop(key)
+        self._size -= size
+        self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits"      : self.hits,
+                    "misses"    : self.misses,
+                    "waits"     : self.waits,
+                    "evictions" : self.evictions,
+                    "entries"   : len(self._entries),
+                    "size_bytes": self._size,
+                    "max_bytes" : self.max_bytes}
+
+payload_cache = PayloadCache()
@@ -0,0 +1,159 @@
+"""Per gateway limits on firmware transfers.
+
+Every REGFGC3.PROG.BIN set goes through the gateway of the converter. Too many
+binaries pushed at once through one gateway make all of them time out and be
+retried, so GatewayLimiter caps the number of concurrent transfers per
+gateway and, optionally, the bytes per second sent through it (token bucket
+with one second of burst). It keeps per gateway statistics: transfers, time
+waited for a transfer slot and utilisation of the slots.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from program_manager.scheduler import MAX_PER_GATEWAY
+
+def max_transfers_for(max_jobs_per_gateway):
+    """Transfers allowed at once through a gateway: half of the jobs running through it, the others wait for their FGC to program."""
+    return max(1, max_jobs_per_gateway // 2)
+
+MAX_TRANSFERS_PER_GATEWAY = max_transfers_for(MAX_PER_GATEWAY)
+
+class _GatewayState:
+    __slots__ = ("active", "max_active", "transfers", "bytes_sent", "wait_total", "wait_max",
+                 "busy_total", "first_use", "tokens", "tokens_t", "slot_freed")
+
+    def __init__(self, now, burst, lock):
+        # Only the transfers waiting for this gateway are woken when one of its slots is freed
+        self.slot_freed = threading.Condition(lock)
+        self.active     = 0
+        self.max_active = 0
+        self.transfers  = 0
+        self.bytes_sent = 0
+        self.wait_total = 0.0
+        self.wait_max   = 0.0
+        self.busy_total = 0.0
+        self.first_use  = now
+        self.tokens     = burst
+        self.tokens_t   = now
+
+class _Transfer:
+    def __init__(self, limiter, gateway, wait, granted):
+        self.gateway  = gateway
+        self.wait     = wait
+        self.granted  = granted
+        self._limiter = limiter
+
+    def throttle(self, nbytes):
+        """Accounts nbytes about to be sent, sleeping if over the gateway's bandwidth."""
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            self._limiter._sleep(delay)
+
+    def reserve(self, nbytes):
+        """Accounts nbytes about to be sent. Returns the seconds to wait before sending them."""
+        return self._limiter._consume(self.gateway, nbytes)
+
+    def release(self):
+        """Gives the transfer slot back to the gateway."""
+        self._limiter._release(self)
+
+class GatewayLimiter:
+    def __init__(self, max_transfers=MAX_TRANSFERS_PER_GATEWAY, bytes_per_sec=None, clock=time.monotonic, sleep=time.sleep):
+        self.max_transfers = max_transfers
+        self.bytes_per_sec = bytes_per_sec
+        self._clock        = clock
+        self._sleep        = sleep
+        self._gateways     = dict()
+        self._lock         = threading.Lock()
+        self._logger       = logging.getLogger("pm_main." + __name__)
+
+    @contextmanager
+    def transfer(self, gateway):
+        """Context manager holding one of the transfer slots of gateway."""
+        transfer = self.acquire(gateway)
+        try:
+            yield transfer
+
+        finally:
+            transfer.release()
+
+    def acquire(self, gateway, blocking=True, since=None):
+        """Takes one of the transfer slots of gateway, to be given back with release().
+
+        Arguments:
+            blocking    -- Whether to wait for a slot to be freed if all of them are taken
+            since       -- Time (of the limiter's clock) the caller started waiting, for the statistics
+
+        Returns:
+            _Transfer -- The transfer holding the slot, None if not blocking and no slot was free
+        """
+        start = self._clock() if since is None else since
+        with self._lock:
+            state = self._state(gateway, start)
+            while state.active >= self.max_transfers:
+                if not blocking:
+                    return None
+
+                state.slot_freed.wait()
+
+            granted = self._clock()
+            state.active     += 1
+            state.max_active  = max(state.max_active, state.active)
+            state.transfers  += 1
+            state.wait_total += granted - start
+            state.wait_max    = max(state.wait_max, granted - start)
+
+        if granted - start > 1:
+            self._logger.info(f"Transfer through {gateway} waited {granted - start:.1f} s for a slot")
+
+        return _Transfer(self, gateway, granted - start, granted)
+
+    def now(self):
+        return self._clock()
+
+    def stats(self):
+        now = self._clock()
+        with self._lock:
+            return {gateway: {"active"      : state.active,
+                              "max_active"  : state.max_active,
+                              "transfers"   : state.transfers,
+                              "bytes_sent"  : state.bytes_sent,
+                              "wait_mean"   : state.wait_total / state.transfers if state.transfers else 0.0,
+                              "wait_max"    : state.wait_max,
+                              "utilisation" : state.busy_total / (self.max_transfers * max(now - state.first_use, 1e-9))}
+                    for gateway, state in self._gateways.items()}
+
+    def _state(self, gateway, now):
+        # Called with the lock held
+        try:
+            return self._gateways[gateway]
+
+        except KeyError:
+            state = _GatewayState(now, self.bytes_per_sec or 0, self._lock)
+            self._gateways[gateway] = state
+            return state
+
+    def _release(self, transfer):
+        with self._lock:
+            state = self._gateways[transfer.gateway]
+            state.active     -= 1
+            state.busy_total += self._clock() - transfer.granted
+            state.slot_freed.notify()
+
+    def _consume(self, gateway, nbytes):
+        # Returns the seconds the bytes sent on credit are to be paid for
+        with self._lock:
+            state = self._gateways[gateway]
+            state.bytes_sent += nbytes
+            if not self.bytes_per_sec:
+                return 0
+
+            now = self._clock()
+            state.tokens   = min(self.bytes_per_sec, state.tokens + (now - state.tokens_t) * self.bytes_per_sec) - nbytes
+            state.tokens_t = now
+            return -state.tokens / self.bytes_per_sec
+
+gateway_limiter = GatewayLimiter()
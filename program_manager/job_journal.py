@@ -0,0 +1,244 @@
+"""Crash-safe journal of the programming jobs.
+
+The area program managers append one JSON line per event to the journal: a
+job is enqueued (or deferred), started, reaches an FSM state while one of its
+devices is programmed, and finishes. Every line is flushed as it is written,
+so the journal survives the server being killed. On start, replay() returns
+the jobs enqueued but not finished, with the last FSM state reached by each
+of their devices, so that they can be queued again and resume their work
+(see regfgc3_programmer.program).
+
+The journal is compacted, rewritten with only the events of the unfinished
+jobs, when it is replayed, closed, and every compact_after events.
+
+While a job runs, its JobProgress is set for the worker thread, as the trace
+is (see tracing.current_trace): the programmer and FSM report the states
+reached and get the states to resume from through current_progress().
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+EVENT_ENQUEUE = "enqueue"
+EVENT_START   = "start"
+EVENT_STATE   = "state"
+EVENT_FINISH  = "finish"
+
+# States reported once a device is reprogrammed and its FSM is back in WAITING,
+# with or without its board switched to production boot
+STATE_DONE       = "DONE"
+STATE_DONE_NO_PB = "DONE_NO_PB"
+
+COMPACT_AFTER_EVENTS = 10000
+
+# states: (slot, device) -> last state reached
+JournaledJob = namedtuple("JournaledJob", "area, job_name, priority, gateway, started, states")
+
+_local = threading.local()
+
+class JobJournal:
+    def __init__(self, path=None, compact_after=COMPACT_AFTER_EVENTS, fsync=False):
+        """Arguments:
+            path {str}      -- Journal file. If None, nothing is journaled
+            fsync {bool}    -- Also fsync every event, to survive a crash of the host and not only of the server
+        """
+        self.path          = path
+        self.compact_after = compact_after
+        self.fsync         = fsync
+
+        # job_name -> JournaledJob of the unfinished jobs, in enqueue order
+        self._jobs   = dict()
+        self._fh     = None
+        self._lock   = threading.Lock()
+        self._logger = logging.getLogger("pm_main." + __name__)
+
+        self.events_since_compaction = 0
+        self.events                  = 0
+        self.compactions             = 0
+
+    def replay(self):
+        """Reads the journal left by the previous run and compacts it.
+
+        Returns:
+            list -- JournaledJobs enqueued but not finished, in enqueue order
+        """
+        if self.path is None:
+            return list()
+
+        jobs    = dict()
+        ignored = 0
+        try:
+            with open(self.path, "r") as fh:
+                for line in fh:
+                    try:
+                        self._apply(jobs, json.loads(line))
+
+                    except (ValueError, KeyError, TypeError):
+                        # A line torn by the crash, or not an event
+                        ignored += 1
+
+        except FileNotFoundError:
+            pass
+
+        if ignored:
+            self._logger.warning(f"Job journal {self.path}: {ignored} lines ignored")
+
+        with self._lock:
+            self._jobs = jobs
+            self._compact()
+
+        if jobs:
+            self._logger.info(f"Job journal {self.path}: {len(jobs)} unfinished jobs, {sum(job.started for job in jobs.values())} started")
+
+        return list(jobs.values())
+
+    def enqueued(self, area, job_name, priority, gateway=None, states=None):
+        self._write({"event": EVENT_ENQUEUE, "area": area, "job": job_name, "priority": priority, "gateway": gateway,
+                     "states": [[slot, device, state] for (slot, device), state in (states or dict()).items()]})
+
+    def started(self, job_name):
+        self._write({"event": EVENT_START, "job": job_name})
+
+    def state_reached(self, job_name, slot, device, state):
+        self._write({"event": EVENT_STATE, "job": job_name, "slot": slot, "device": device, "state": state})
+
+    def finished(self, job_name, result):
+        self._write({"event": EVENT_FINISH, "job": job_name, "result": result})
+
+    def unfinished(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def close(self):
+        with self._lock:
+            self._compact()
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+    def stats(self):
+        with self._lock:
+            return {"unfinished"  : len(self._jobs),
+                    "events"      : self.events,
+                    "compactions" : self.compactions}
+
+    def _write(self, event):
+        if self.path is None:
+            return
+
+        event["t"] = time.time()
+        with self._lock:
+            self._apply(self._jobs, event)
+            self.events += 1
+            if self._fh is None:
+                self._open()
+
+            try:
+                self._fh.write(json.dumps(event) + "\n")
+                self._fh.flush()
+                if self.fsync:
+                    os.fsync(self._fh.fileno())
+
+            except OSError as e:
+                self._logger.error(f"Could not write to job journal {self.path}: {e}")
+                return
+
+            self.events_since_compaction += 1
+            if self.events_since_compaction >= self.compact_after:
+                self._compact()
+
+    def _open(self):
+        # Called with the lock held
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._fh = open(self.path, "a")
+
+    @staticmethod
+    def _apply(jobs, event):
+        job_name = event["job"]
+        kind     = event["event"]
+        if kind == EVENT_ENQUEUE:
+            states = {(slot, device): state for slot, device, state in event.get("states", ())}
+            jobs[job_name] = JournaledJob(event["area"], job_name, event["priority"], event["gateway"], False, states)
+
+        elif kind == EVENT_FINISH:
+            jobs.pop(job_name, None)
+
+        elif job_name in jobs:
+            job = jobs[job_name]
+            if kind == EVENT_START:
+                jobs[job_name] = job._replace(started=True)
+
+            elif kind == EVENT_STATE:
+                job.states[(event["slot"], event["device"])] = event["state"]
+
+    def _compact(self):
+        # Called with the lock held. The unfinished jobs are written as if enqueued with their states
+        if self.path is None:
+            return
+
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as fh:
+                for job in self._jobs.values():
+                    fh.write(json.dumps({"event": EVENT_ENQUEUE, "area": job.area, "job": job.job_name, "priority": job.priority,
+                                         "gateway": job.gateway, "t": time.time(),
+                                         "states": [[slot, device, state] for (slot, device), state in job.states.items()]}) + "\n")
+                    if job.started:
+                        fh.write(json.dumps({"event": EVENT_START, "job": job.job_name}) + "\n")
+
+                fh.flush()
+                os.fsync(fh.fileno())
+
+            os.replace(tmp_path, self.path)
+
+        except OSError as e:
+            self._logger.error(f"Could not compact job journal {self.path}: {e}")
+            return
+
+        self.events_since_compaction = 0
+        self.compactions            += 1
+
+class JobProgress:
+    """Progress of the job running in a worker thread.
+
+    Arguments:
+        journal         -- JobJournal the states reached are written to, None to only keep them
+        resume {dict}   -- (slot, device) -> last state reached by a previous run of the job
+    """
+    def __init__(self, journal=None, job_name="", resume=None):
+        self.journal  = journal
+        self.job_name = job_name
+        self.resume   = dict(resume or dict())
+
+    def state_reached(self, slot, device, state):
+        if self.journal is not None:
+            self.journal.state_reached(self.job_name, slot, device, state)
+
+    def resume_state(self, slot, device):
+        """Returns the last state a previous run reached in this device, None if none."""
+        return self.resume.get((slot, device))
+
+def set_current_progress(progress):
+    """Sets the progress of the job running in the calling thread."""
+    _local.progress = progress
+
+def current_progress():
+    """Returns the progress of the job running in the calling thread.
+
+    Outside of a journaled job a detached progress is returned, so callers can
+    report states unconditionally.
+    """
+    return getattr(_local, "progress", None) or JobProgress()
@@ -0,0 +1,120 @@
+"""Priority queue of programming jobs.
+
+Jobs are ranked by a SchedulingPolicy combining their explicit priority, the
+number of times they already failed and their expected duration (learnt from
+previous runs of the same job). To prevent starvation, the rank of a waiting
+job grows with the time it has been queued (aging). As every job ages at the
+same rate, a job's position only depends on
+
+    key = aging_per_sec * enqueue_time - base_rank
+
+which is computed once at enqueue time and kept in a heap.
+"""
+
+import heapq
+import itertools
+import queue
+import threading
+import time
+from collections import namedtuple
+
+PRIORITY_SYNC          = 10
+PRIORITY_NORMAL        = 0
+PRIORITY_COMMISSIONING = -10
+
+class Job:
+    __slots__ = ("func", "job_name", "trace", "priority", "retries", "gateway", "resume", "enqueue_time", "key")
+
+    def __init__(self, func, job_name, trace=None, priority=PRIORITY_NORMAL, retries=0, gateway=None, resume=None):
+        """resume: (slot, device) -> last FSM state reached before a restart (see job_journal)."""
+        self.func         = func
+        self.job_name     = job_name
+        self.trace        = trace
+        self.priority     = priority
+        self.retries      = retries
+        self.gateway      = gateway
+        self.resume       = resume
+        self.enqueue_time = None
+        self.key          = None
+
+    def __repr__(self):
+        return f"Job({self.job_name}, priority={self.priority}, retries={self.retries})"
+
+class SchedulingPolicy(namedtuple("SchedulingPolicy", "priority_weight, retry_weight, duration_weight, aging_per_sec")):
+    """Weights of the job ranking.
+
+    A job waiting 1/aging_per_sec seconds gains one unit of rank, as much as
+    one step of explicit priority with the default weights.
+    """
+    def base_rank(self, job, expected_duration):
+        return (self.priority_weight * job.priority
+                - self.retry_weight * job.retries
+                - self.duration_weight * expected_duration)
+
+    def key(self, job, expected_duration, now):
+        return self.aging_per_sec * now - self.base_rank(job, expected_duration)
+
+DEFAULT_POLICY = SchedulingPolicy(priority_weight=1.0, retry_weight=2.0, duration_weight=0.01, aging_per_sec=0.1)
+
+class DurationHistory:
+    """Exponentially weighted average of the duration of every job name."""
+    def __init__(self, alpha=0.3, default=60.0):
+        self.alpha    = alpha
+        self.default  = default
+        self._average = dict()
+        self._lock    = threading.Lock()
+
+    def record(self, job_name, duration):
+        with self._lock:
+            previous = self._average.get(job_name)
+            self._average[job_name] = duration if previous is None else self.alpha * duration + (1 - self.alpha) * previous
+
+    def expected(self, job_name):
+        return self._average.get(job_name, self.default)
+
+class PriorityTaskQueue(queue.Queue):
+    """queue.Queue of Jobs served in SchedulingPolicy order, FIFO among equal keys."""
+    def __init__(self, maxsize=0, policy=DEFAULT_POLICY, history=None, clock=time.monotonic):
+        self.policy  = policy
+        self.history = history or DurationHistory()
+        self._clock  = clock
+        self._seq    = itertools.count()
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self.queue = list()
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, job):
+        job.enqueue_time = self._clock()
+        job.key          = self.policy.key(job, self.history.expected(job.job_name), job.enqueue_time)
+        heapq.heappush(self.queue, (job.key, next(self._seq), job))
+
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
+
+    def get_first(self, accept):
+        """Removes and returns the first job in order accepted by accept(job), None if there is none.
+
+        Never blocks. Used by schedulers that skip jobs they cannot run yet.
+        """
+        with self.not_empty:
+            if not self.queue:
+                return None
+
+            if accept(self.queue[0][2]):
+                job = self._get()
+
+            else:
+                entry = next((entry for entry in sorted(self.queue) if accept(entry[2])), None)
+                if entry is None:
+                    return None
+
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+                job = entry[2]
+
+            self.not_full.notify()
+            return job
@@ -0,0 +1,216 @@
+"""Local, precomputed index of the FGC name and group files.
+
+The name and group files are copied to a snapshot folder, so that a restart
+can build the index without downloading them. The index maps every device to
+its gateway and area (first group of its gateway), and every class to its
+devices. refresh() only downloads the files when the source reports a change
+(ETag/Last-Modified for URLs, size/mtime for local files), and only rebuilds
+the index when their contents changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import urllib.error
+import urllib.request
+from collections import namedtuple
+
+import pyfgc_name
+
+NAME_FILE_CHECK_SEC = 300
+SNAPSHOT_META_FILE  = "snapshot.json"
+URL_TIMEOUT_SEC     = 30
+
+_NameMaps = namedtuple("_NameMaps", "device_gateway, device_area, device_class, class_devices, areas")
+
+_EMPTY_MAPS = _NameMaps(dict(), dict(), dict(), dict(), frozenset())
+
+def _is_url(location):
+    return location.startswith(("http://", "https://", "file://"))
+
+def default_group_file(name_file):
+    """The group file is published next to the name file."""
+    location_join = posixpath.join if _is_url(name_file) else os.path.join
+    location_dir  = posixpath.dirname if _is_url(name_file) else os.path.dirname
+    return location_join(location_dir(name_file), "group")
+
+class NameIndex:
+    def __init__(self, name_file, snapshot_dir, group_file=None):
+        self.name_file    = name_file
+        self.group_file   = group_file or default_group_file(name_file)
+        self.snapshot_dir = snapshot_dir
+
+        self._maps        = _EMPTY_MAPS
+        self._meta        = dict()
+        self._stale       = False
+        self._logger      = logging.getLogger("pm_main." + __name__)
+
+    def load(self):
+        """Builds the index from the local snapshot, then refreshes it from the source.
+
+        Returns:
+            set -- Areas whose devices changed with respect to the snapshot
+        """
+        if self._read_snapshot_meta():
+            try:
+                self._rebuild()
+
+            except Exception as e:
+                self._logger.warning(f"Could not load name file snapshot from {self.snapshot_dir}: {e}")
+                self._meta = dict()
+
+        try:
+            return self.refresh()
+
+        except (OSError, RuntimeError) as e:
+            if not self._meta:
+                raise RuntimeError(f"No name file snapshot and source unavailable: {e}")
+
+            self._logger.warning(f"Could not refresh name file, using snapshot: {e}")
+            return set()
+
+    def refresh(self):
+        """Re-reads the name and group files if they changed.
+
+        Returns:
+            set -- Areas with devices added, removed or moved
+        """
+        # A file changed in a refresh that failed later is still pending
+        for key, location in (("name", self.name_file), ("group", self.group_file)):
+            self._stale |= self._fetch(key, location)
+
+        if not self._stale:
+            return set()
+
+        old_maps = self._maps
+        self._rebuild()
+        self._write_snapshot_meta()
+        self._stale = False
+
+        affected = self._affected_areas(old_maps, self._maps)
+        self._logger.info(f"Name index rebuilt: {len(self._maps.device_area)} devices, areas affected: {sorted(affected)}")
+        return affected
+
+    def area_of(self, device):
+        return self._maps.device_area.get(device)
+
+    def gateway_of(self, device):
+        return self._maps.device_gateway.get(device)
+
+    def devices_of_class(self, class_id):
+        return self._maps.class_devices.get(class_id, frozenset())
+
+    @property
+    def areas(self):
+        return self._maps.areas
+
+    def __len__(self):
+        return len(self._maps.device_area)
+
+    def _snapshot_path(self, key):
+        return os.path.join(self.snapshot_dir, key)
+
+    def _fetch(self, key, location):
+        # Returns whether the snapshot of the file changed
+        meta = self._meta.get(key, dict())
+        if meta.get("location") != location:
+            meta = dict()
+
+        if _is_url(location):
+            request = urllib.request.Request(location)
+            if meta.get("etag"):
+                request.add_header("If-None-Match", meta["etag"])
+
+            if meta.get("last_modified"):
+                request.add_header("If-Modified-Since", meta["last_modified"])
+
+            try:
+                with urllib.request.urlopen(request, timeout=URL_TIMEOUT_SEC) as rsp:
+                    contents = rsp.read()
+                    version  = {"etag": rsp.headers.get("ETag"), "last_modified": rsp.headers.get("Last-Modified")}
+
+            except urllib.error.HTTPError as e:
+                if e.code == 304:
+                    return False
+
+                raise RuntimeError(f"Could not download {location}: {e}")
+
+        else:
+            stat_info = os.stat(location)
+            version   = {"size": stat_info.st_size, "mtime_ns": stat_info.st_mtime_ns}
+            if all(meta.get(k) == v for k, v in version.items()):
+                return False
+
+            with open(location, "rb") as fh:
+                contents = fh.read()
+
+        digest  = hashlib.sha1(contents).hexdigest()
+        changed = digest != meta.get("sha1")
+        if changed:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            tmp_path = self._snapshot_path(key) + ".tmp"
+            with open(tmp_path, "wb") as fh:
+                fh.write(contents)
+
+            os.replace(tmp_path, self._snapshot_path(key))
+
+        self._meta[key] = dict(version, location=location, sha1=digest)
+        return changed
+
+    def _rebuild(self):
+        pyfgc_name.read_name_file(self._snapshot_path("name"))
+        pyfgc_name.read_group_file(self._snapshot_path("group"))
+
+        device_gateway = dict()
+        device_area    = dict()
+        device_class   = dict()
+        class_devices  = dict()
+        for name, device in pyfgc_name.devices.items():
+            gateway = device["gateway"]
+            device_gateway[name] = gateway
+            device_class[name]   = device["class_id"]
+            class_devices.setdefault(device["class_id"], set()).add(name)
+
+            try:
+                device_area[name] = pyfgc_name.gateways[gateway]["groups"][0]
+
+            except (KeyError, IndexError):
+                pass
+
+        self._maps = _NameMaps(device_gateway,
+                               device_area,
+                               device_class,
+                               {class_id: frozenset(devices) for class_id, devices in class_devices.items()},
+                               frozenset(pyfgc_name.groups))
+
+    @staticmethod
+    def _affected_areas(old_maps, new_maps):
+        old_devices = {dev: (old_maps.device_gateway.get(dev), area, old_maps.device_class.get(dev)) for dev, area in old_maps.device_area.items()}
+        new_devices = {dev: (new_maps.device_gateway.get(dev), area, new_maps.device_class.get(dev)) for dev, area in new_maps.device_area.items()}
+
+        changed = set(old_devices.items()) ^ set(new_devices.items())
+        return {area for _, (_, area, _) in changed} | (old_maps.areas ^ new_maps.areas)
+
+    def _read_snapshot_meta(self):
+        try:
+            with open(self._snapshot_path(SNAPSHOT_META_FILE)) as fh:
+                self._meta = json.load(fh)
+
+        except (OSError, ValueError):
+            self._meta = dict()
+            return False
+
+        if not all(os.path.exists(self._snapshot_path(key)) for key in ("name", "group")):
+            self._meta = dict()
+            return False
+
+        return True
+
+    def _write_snapshot_meta(self):
+        tmp_path = self._snapshot_path(SNAPSHOT_META_FILE) + ".tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump(self._meta, fh)
+
+        os.replace(tmp_path, self._snapshot_path(SNAPSHOT_META_FILE))
@@ -0,0 +1,210 @@
+"""Programming plans from the detected and expected firmware.
+
+The parsed REGFGC3.SLOT_INFO of every converter is joined with its expected
+data (as returned by the adapters, keyed by slot or by board name) on
+(slot, device). A device is programmed only if its variant, variant revision
+or API revision differ from the expected ones, and only if the firmware file is
+in the catalog. A board that is not the expected one, or whose devices run
+another variant than expected, is reported as a BoardFault and none of its
+devices is programmed. Blank devices (variant and revision 0) can be
+programmed with any variant.
+
+Planner keeps the plan of every converter and only plans again the converters
+whose SlotInfo or expected data object changed, so the whole fleet can be
+planned on every status cycle. Raw SLOT_INFO replies are compared by value
+and only parsed when they changed.
+"""
+
+import logging
+import threading
+from collections import namedtuple
+
+from program_manager.regfgc3_programmer import DEVICES_LIST, parse_slot_info
+
+# program_crate takes ProgramAction[1:] as job
+ProgramAction  = namedtuple("ProgramAction", "converter, slot, board, device, variant, var_revision, api_revision, bin_crc, fw_file_loc")
+BoardFault     = namedtuple("BoardFault", "converter, slot, board, reason")
+MissingFw      = namedtuple("MissingFw", "converter, slot, board, device, variant, var_revision, api_revision")
+ConverterPlan  = namedtuple("ConverterPlan", "converter, actions, faults, missing_fw")
+
+BLANK_VARIANT  = "0"
+BLANK_REVISION = "0"
+
+_DEVICE_ORDER = {device: i for i, device in enumerate(DEVICES_LIST)}
+
+def _slot_order(slot):
+    try:
+        return (0, int(slot))
+
+    except ValueError:
+        return (1, slot)
+
+def _is_blank(device):
+    return device.Variant == BLANK_VARIANT and device.Var_Rev == BLANK_REVISION
+
+def plan_converter(converter, slot_info, expected, fw_lookup):
+    """Plans the programming of one converter.
+
+    Arguments:
+        converter {str}     -- Converter name
+        slot_info           -- SlotInfo of the converter
+        expected {dict}     -- Slot or board -> {"board": board, "devices": {device: Adapter.Device}}
+        fw_lookup           -- fw_lookup(device, variant, var_revision, api_revision) returns
+                               an object with bin_crc and path (FirmwareEntry), None if unavailable
+
+    Returns:
+        ConverterPlan -- Actions in slot and device order
+    """
+    board_slots = dict()
+    for board in slot_info:
+        board_slots.setdefault(board.BOARD, list()).append(board.SLOT)
+
+    actions    = list()
+    faults     = list()
+    missing_fw = list()
+    for key, exp_board in expected.items():
+        board_name = exp_board["board"]
+
+        # Expected data of the DB adapter is keyed by board name, of the file system adapter by slot
+        slots = board_slots.get(board_name, [None]) if key == board_name else [str(key)]
+        for slot in slots:
+            board = None if slot is None else slot_info.get(slot)
+            if board is None:
+                faults.append(BoardFault(converter, slot, board_name, "board not detected"))
+                continue
+
+            if board.BOARD != board_name:
+                faults.append(BoardFault(converter, slot, board.BOARD, f"board {board.BOARD} detected, {board_name} expected"))
+                continue
+
+            pending = list()
+            fault   = None
+            for exp_device in exp_board["devices"].values():
+                device = slot_info.device(slot, exp_device.Device)
+                if device is None:
+                    fault = f"device {exp_device.Device} not detected"
+                    break
+
+                if (device.Variant, device.Var_Rev, device.API_Rev) == (exp_device.Variant, exp_device.Var_Rev, exp_device.API_Rev):
+                    continue
+
+                if device.Variant != exp_device.Variant and not _is_blank(device):
+                    fault = f"device {device.Device} runs variant {device.Variant}, {exp_device.Variant} expected"
+                    break
+
+                pending.append(exp_device)
+
+            if fault:
+                faults.append(BoardFault(converter, slot, board_name, fault))
+                continue
+
+            for exp_device in pending:
+                fw = fw_lookup(exp_device.Device, exp_device.Variant, exp_device.Var_Rev, exp_device.API_Rev)
+                if fw is None:
+                    missing_fw.append(MissingFw(converter, slot, board_name, *exp_device))
+                    continue
+
+                actions.append(ProgramAction(converter, slot, board_name, *exp_device, fw.bin_crc, fw.path))
+
+    actions.sort(key=lambda action: (_slot_order(action.slot), _DEVICE_ORDER.get(action.device, len(_DEVICE_ORDER)), action.device))
+    return ConverterPlan(converter, actions, faults, missing_fw)
+
+class FleetPlan(namedtuple("FleetPlan", "plans")):
+    """Plans of several converters, converter -> ConverterPlan."""
+    @property
+    def actions(self):
+        return [action for plan in self.plans.values() for action in plan.actions]
+
+    @property
+    def faults(self):
+        return [fault for plan in self.plans.values() for fault in plan.faults]
+
+    @property
+    def missing_fw(self):
+        return [missing for plan in self.plans.values() for missing in plan.missing_fw]
+
+    def converters_to_program(self):
+        return [converter for converter, plan in self.plans.items() if plan.actions]
+
+class Planner:
+    def __init__(self, fw_lookup):
+        self._fw_lookup = fw_lookup
+
+        # converter -> (SlotInfo, expected data, ConverterPlan)
+        self._plans   = dict()
+        # converter -> (raw SLOT_INFO reply, SlotInfo)
+        self._replies = dict()
+        self._lock    = threading.Lock()
+        self._logger  = logging.getLogger("pm_main." + __name__)
+
+        self.planned = 0
+        self.reused  = 0
+
+    def plan(self, slot_infos, expected_of):
+        """Plans the programming of several converters.
+
+        Arguments:
+            slot_infos {dict}   -- Converter -> SlotInfo
+            expected_of         -- expected_of(converter) returns the expected data of a converter
+                                   (Adapter.get_expected), raising KeyError or FileNotFoundError if unknown
+
+        Returns:
+            FleetPlan -- Plans in the order of slot_infos
+        """
+        plans = dict()
+        for converter, slot_info in slot_infos.items():
+            try:
+                expected = expected_of(converter)
+
+            except (KeyError, FileNotFoundError):
+                plans[converter] = ConverterPlan(converter, [], [BoardFault(converter, None, None, "no expected data")], [])
+                continue
+
+            plans[converter] = self.plan_converter(converter, slot_info, expected)
+
+        return FleetPlan(plans)
+
+    def plan_converter(self, converter, slot_info, expected):
+        with self._lock:
+            cached = self._plans.get(converter)
+            if cached is not None and cached[0] is slot_info and cached[1] is expected:
+                self.reused += 1
+                return cached[2]
+
+        plan = plan_converter(converter, slot_info, expected, self._fw_lookup)
+        with self._lock:
+            self._plans[converter] = (slot_info, expected, plan)
+            self.planned += 1
+
+        return plan
+
+    def plan_reply(self, converter, reply, expected):
+        """Plans a converter from its raw REGFGC3.SLOT_INFO reply.
+
+        The reply is only parsed if it differs from the last one of the converter,
+        so that an unchanged converter reuses its SlotInfo and its plan.
+
+        Returns:
+            tuple -- (SlotInfo, ConverterPlan)
+        """
+        with self._lock:
+            cached = self._replies.get(converter)
+
+        if cached is not None and cached[0] == reply:
+            slot_info = cached[1]
+
+        else:
+            slot_info = parse_slot_info(reply)
+            with self._lock:
+                self._replies[converter] = (reply, slot_info)
+
+        return slot_info, self.plan_converter(converter, slot_info, expected)
+
+    def invalidate(self, converter=None):
+        """Forgets the plan of a converter, of all of them if None (e.g. when the firmware catalog changed)."""
+        with self._lock:
+            if converter is None:
+                self._plans.clear()
+
+            else:
+                self._plans.pop(converter, None)
@@ -2,39 +2,134 @@ import logging
 import os
 import time
 
-from binascii     import hexlify
 from collections  import namedtuple
-from functools    import partial
 
 import pyfgc
+from program_manager.fw_payload import CHARS_PER_WORD, FW_FILE_LIMIT_BYTES, LIMIT_GW_CMD_WORDS
+from program_manager.fw_payload import get_fw_chunks
+from program_manager.fgc_pool import gateway_of
+from program_manager.gateway_limiter import gateway_limiter
+from program_manager.job_journal import current_progress
+from program_manager.tracing import current_trace
+
+class PollSchedule(namedtuple("PollSchedule", "first_delay, initial, factor, maximum")):
+    """Delays between polls of REGFGC3.PROG.FSM.STATE.
+
+    The state is first polled after first_delay seconds, then after initial
+    seconds, each following delay being multiplied by factor up to maximum.
+    """
+    def delays(self):
+        yield self.first_delay
+        delay = self.initial
+        while True:
+            yield delay
+            delay = min(delay * self.factor, self.maximum)
+
+DEFAULT_POLL_SCHEDULE = PollSchedule(first_delay=0, initial=0.1, factor=2, maximum=3)
+STATE_POLL_SCHEDULES  = {
+    # The FGC needs some time to digest the binary before it reports the state
+    "TRANSFERRING"    : PollSchedule(first_delay=0.5, initial=0.25, factor=2, maximum=3),
+    "PROGRAMMING"     : PollSchedule(first_delay=0.5, initial=0.5, factor=1.5, maximum=3),
+    "PROG_CHK"        : PollSchedule(first_delay=0.2, initial=0.5, factor=1.5, maximum=3),
+    "TO_PROD_BOOT"    : PollSchedule(first_delay=1, initial=0.5, factor=1.5, maximum=3),
+}
+
+# Operations yielded by the steps of the states and of ProgramManagerFsm. They
+# are carried out by a driver: drive() with a blocking FGC session, or
+# async_fsm.drive_async() on an event loop, so both run the same FSM
+OP_GET      = "get"         # (OP_GET, prop) -> reply of the FGC
+OP_SET      = "set"         # (OP_SET, prop, value) -> reply of the FGC
+OP_SLEEP    = "sleep"       # (OP_SLEEP, seconds)
+OP_TRANSFER = "transfer"    # (OP_TRANSFER, gateway) -> transfer slot taken from gateway_limiter
+
+def drive(steps, fgc_session):
+    """Carries out the operations yielded by steps with a blocking FGC session.
+
+    An exception raised by an operation is thrown into steps, where the
+    operation was yielded. Returns the value returned by steps.
+    """
+    reply, error = None, None
+    try:
+        while True:
+            try:
+                op = steps.send(reply) if error is None else steps.throw(error)
+
+            except StopIteration as stop:
+                return stop.value
+
+            try:
+                reply, error = _execute(op, fgc_session), None
+
+            except Exception as e:
+                reply, error = None, e
+
+    finally:
+        steps.close()
+
+def _execute(op, fgc_session):
+    kind, *args = op
+    if kind == OP_GET:
+        return fgc_session.get(*args)
+
+    if kind == OP_SET:
+        return fgc_session.set(*args)
+
+    if kind == OP_SLEEP:
+        time.sleep(*args)
+        return None
 
-CHARS_PER_WORD       = 8
-FW_FILE_LIMIT_BYTES  = 4194304
-LIMIT_GW_CMD_WORDS   = 66100
+    if kind == OP_TRANSFER:
+        return gateway_limiter.acquire(*args)
+
+    raise RuntimeError(f"Unknown FSM operation {kind}")
+
+def read_fsm_status():
+    """Steps reading STATE, LAST_STATE and BOARD_ERROR of the FGC programming FSM."""
+    return ((yield (OP_GET, "REGFGC3.PROG.FSM.STATE")).value,
+            (yield (OP_GET, "REGFGC3.PROG.FSM.LAST_STATE")).value,
+            (yield (OP_GET, "REGFGC3.PROG.DEBUG.BOARD_ERROR")).value)
 
 class PmState:
+    # Whether an FGC in ERROR means this state cannot be reached any more
+    fail_on_fgc_error = True
+
     def __init__(self, logger, name="", timeout=30):
         self.name = name
         self.timeout = timeout
+        self.poll_schedule = STATE_POLL_SCHEDULES.get(name, DEFAULT_POLL_SCHEDULE)
+        self.polls = 0
         self._logger = logger
 
     def run(self, fgc_session, **kwargs):
-        while self.timeout:
-            fgc_state = fgc_session.get("REGFGC3.PROG.FSM.STATE")
+        drive(self.steps(**kwargs), fgc_session)
+
+    def steps(self, **kwargs):
+        """Steps of run(): polls the FGC until it reaches this state."""
+        deadline = time.monotonic() + self.timeout
+
+        for delay in self.poll_schedule.delays():
+            yield (OP_SLEEP, max(0, min(delay, deadline - time.monotonic())))
+
+            fgc_state = yield (OP_GET, "REGFGC3.PROG.FSM.STATE")
+            self.polls += 1
             self._logger.debug(f"FGC PM FSM state after polling: {fgc_state.value}")
 
             if fgc_state.value == self.name:
                 break
 
-            time.sleep(3)
-            self.timeout -= 3
-        
-        else:
-            board_error = fgc_session.get("REGFGC3.PROG.DEBUG.BOARD_ERROR")
-            last_state  = fgc_session.get("REGFGC3.PROG.FSM.LAST_STATE")
-            raise RuntimeError(f"Timeout: FGC did not reach state {self.name} (last state: {last_state.value}, board error: {board_error.value})")
+            # No point in waiting for the timeout if the FGC already gave up
+            if fgc_state.value == "ERROR" and self.fail_on_fgc_error:
+                _, last_state, board_error = yield from read_fsm_status()
+                raise RuntimeError(f"FGC went to ERROR while waiting for state {self.name} (last state: {last_state}, board error: {board_error})")
+
+            if time.monotonic() >= deadline:
+                state, last_state, board_error = yield from read_fsm_status()
+                raise RuntimeError(f"Timeout: FGC did not reach state {self.name} (state: {state}, last state: {last_state}, board error: {board_error})")
             
-        self._logger.info(f"FGC PM FSM state {self.name} processed successfully")
+        self._logger.info(f"FGC PM FSM state {self.name} processed successfully after {self.polls} polls")
+
+    def trace_attrs(self):
+        return {"polls": self.polls}
 
     def __repr__(self):
         return f"PmState('{self.name}')"
@@ -46,15 +141,44 @@ class PmStateUninitialized(PmState):
 class PmStateWaiting(PmState):
     def __init__(self, logger):
         super().__init__(logger, name="WAITING")
-    
-    def run(self, fgc_session, **kwargs):
-        super().run(fgc_session, **kwargs)
 
 class PmStateTransferring(PmState):
     def __init__(self, logger):
         super().__init__(logger, name="TRANSFERRING")
+        self.bytes_sent   = 0
+        self.chunks_sent  = 0
+        self.gateway_wait = 0.0
     
-    def run(self, fgc_session, **kwargs):
+    def steps(self, **kwargs):
+        settings, packet = self.prepare_transfer(**kwargs)
+
+        # The binary goes through the gateway, the FGC digests it on its own
+        transfer = yield (OP_TRANSFER, gateway_of(kwargs["converter"]))
+        try:
+            self.gateway_wait = transfer.wait
+            for prop, value in settings:
+                _ = yield (OP_SET, prop, value)
+
+            for i, chunk in packet:
+                delay = transfer.reserve(len(chunk))
+                if delay > 0:
+                    yield (OP_SLEEP, delay)
+
+                yield (OP_SET, f"REGFGC3.PROG.BIN[{i},]", chunk)
+                self.bytes_sent  += len(chunk)
+                self.chunks_sent += 1
+
+        finally:
+            transfer.release()
+
+        yield from super().steps(**kwargs)
+
+    def trace_attrs(self):
+        return dict(super().trace_attrs(), bytes_sent=self.bytes_sent, chunks_sent=self.chunks_sent, gateway_wait=self.gateway_wait)
+
+    @staticmethod
+    def prepare_transfer(**kwargs):
+        """Validates the firmware file and returns the properties to set and the payload chunks."""
         slot, device, variant, var_revision, api_revision, bin_crc, fw_file_loc = (
             kwargs["slot"],
             kwargs["device"],
@@ -76,92 +200,56 @@ class PmStateTransferring(PmState):
         if fw_file_info.st_size > FW_FILE_LIMIT_BYTES:
             raise RuntimeError(f"File's {fw_file_loc} size {fw_file_info.st_size} over limit {FW_FILE_LIMIT_BYTES}")
 
-        packet = list()
-        with open(fw_file_loc, "r+b") as fwh:
-            for word in iter(partial(fwh.read, 4), b""):
-                # Bin into hex and decode
-                ascii_word = hexlify(word).decode()
-                # Add padding
-                ascii_word += "".join(["0"] * (CHARS_PER_WORD - len(ascii_word)))
-                packet.append(hex(int(ascii_word, 16)))
-                
-        _ = fgc_session.set("REGFGC3.PROG.SLOT"             ,slot)
-        _ = fgc_session.set("REGFGC3.PROG.DEVICE"           ,device)
-        _ = fgc_session.set("REGFGC3.PROG.VARIANT"          ,variant)
-        _ = fgc_session.set("REGFGC3.PROG.VARIANT_REVISION" ,var_revision)
-        _ = fgc_session.set("REGFGC3.PROG.API_REVISION"     ,api_revision)
-        _ = fgc_session.set("REGFGC3.PROG.BIN_SIZE_BYTES"   ,fw_file_info.st_size)
-        _ = fgc_session.set("REGFGC3.PROG.BIN_CRC"          ,int(bin_crc, 16))
-        for i in range(0, len(packet), LIMIT_GW_CMD_WORDS):
-            fgc_session.set(f"REGFGC3.PROG.BIN[{i},]", ",".join(packet[i:i + LIMIT_GW_CMD_WORDS]))
-
-        # Leave FGC time to digest
-        time.sleep(5)
-        super().run(fgc_session, **kwargs)
+        settings = [("REGFGC3.PROG.SLOT"             ,slot),
+                    ("REGFGC3.PROG.DEVICE"           ,device),
+                    ("REGFGC3.PROG.VARIANT"          ,variant),
+                    ("REGFGC3.PROG.VARIANT_REVISION" ,var_revision),
+                    ("REGFGC3.PROG.API_REVISION"     ,api_revision),
+                    ("REGFGC3.PROG.BIN_SIZE_BYTES"   ,fw_file_info.st_size),
+                    ("REGFGC3.PROG.BIN_CRC"          ,int(bin_crc, 16))]
+
+        return settings, get_fw_chunks(fw_file_loc)
 
 class PmStateTransferred(PmState):
     def __init__(self, logger):
         super().__init__(logger, name="TRANSFERRED")
 
-    def run(self, fgc_session, **kwargs):
-        super().run(fgc_session, **kwargs)
-
 class PmStateGetProgInfo(PmState):
     def __init__(self, logger):
         super().__init__(logger, name="GET_PROG_INFO")
 
-    def run(self, fgc_session, **kwargs):
-        super().run(fgc_session, **kwargs)
-
 class PmStateProgramming(PmState):
     def __init__(self, logger):
         super().__init__(logger, name="PROGRAMMING")
 
-    def run(self, fgc_session, **kwargs):
-        super().run(fgc_session, **kwargs)
-
 class PmStateProgramCheck(PmState):
     def __init__(self, logger):
         super().__init__(logger, name="PROG_CHK")
 
-    def run(self, fgc_session, **kwargs):
-        super().run(fgc_session, **kwargs)
-
 class PmStateProgrammed(PmState):
     def __init__(self, logger):
         super().__init__(logger, name="PROGRAMMED")
 
-    def run(self, fgc_session, **kwargs):
-        super().run(fgc_session, **kwargs)
-
 class PmStateSetProdBootPars(PmState):
     def __init__(self, logger):
         super().__init__(logger, name="SET_PB_PARS")
 
-    def run(self, fgc_session, **kwargs):
-        super().run(fgc_session, **kwargs)
-
 class PmStateToProdBoot(PmState):
     def __init__(self, logger):
         super().__init__(logger, name="TO_PROD_BOOT")
 
-    def run(self, fgc_session, **kwargs):
-        super().run(fgc_session, **kwargs)
-
 class PmStateCleanUp(PmState):
+    fail_on_fgc_error = False
+
     def __init__(self, logger):
         super().__init__(logger, name="CLEAN_UP")
 
-    def run(self, fgc_session, **kwargs):
-        super().run(fgc_session, **kwargs)
-
 class PmStateError(PmState):
+    fail_on_fgc_error = False
+
     def __init__(self, logger):
         super().__init__(logger, name="ERROR")
 
-    def run(self, fgc_session, **kwargs):
-        super().run(fgc_session, **kwargs)
-
 class ProgramManagerFsm:
     STATE_TO_MODE_TO_INTERIM_STATES = {
         "UNINITIALIZED"       : {"WAITING"             : [PmStateWaiting]},
@@ -174,11 +262,33 @@ class ProgramManagerFsm:
         "ERROR"               : {"CLEAN_UP"            : [PmStateCleanUp]}
     }
 
+    # Used when several devices of a board are reprogrammed in a row: the board
+    # is only switched to production boot once, after the last device
+    STATE_TO_MODE_TO_INTERIM_STATES_NO_PROD_BOOT = {
+        "UNINITIALIZED"       : {"WAITING"             : [PmStateWaiting]},
+        "WAITING"             : {"TRANSFERRED"         : [PmStateTransferring, PmStateTransferred]},
+        "TRANSFERRED"         : {"PROGRAMMED"          : [PmStateGetProgInfo, PmStateProgramming, PmStateProgramCheck, PmStateProgrammed]},
+        "PROGRAMMED"          : {"CLEAN_UP"            : [PmStateCleanUp]},
+        "CLEAN_UP"            : {"WAITING"             : [PmStateWaiting]},
+        "ERROR"               : {"CLEAN_UP"            : [PmStateCleanUp]}
+    }
+
     VALID_MODES = set()
     for _, mode_to_inter_states_dict in STATE_TO_MODE_TO_INTERIM_STATES.items():
         VALID_MODES.add(list(mode_to_inter_states_dict.keys())[0])
 
-    def __init__(self, prog_data, fgc_session, init_state=PmStateUninitialized, logger=None):
+    VALID_MODES_NO_PROD_BOOT = set()
+    for _, mode_to_inter_states_dict in STATE_TO_MODE_TO_INTERIM_STATES_NO_PROD_BOOT.items():
+        VALID_MODES_NO_PROD_BOOT.add(list(mode_to_inter_states_dict.keys())[0])
+
+    # States reached once the device is programmed and checked: an FSM interrupted
+    # in one of them (e.g. by a restart) can go on from there
+    RESUMABLE_STATES = {"PROGRAMMED"   : PmStateProgrammed,
+                        "SET_PB_PARS"  : PmStateSetProdBootPars,
+                        "TO_PROD_BOOT" : PmStateToProdBoot}
+
+    def __init__(self, prog_data, fgc_session, init_state=PmStateUninitialized, logger=None, poll_schedules=None, trace=None, skip_prod_boot=False,
+                 progress=None):
         self.prog_data_dict = dict(zip(("converter",
                                 "slot",
                                 "board",
@@ -194,26 +304,48 @@ class ProgramManagerFsm:
         self._mode                = "UNINITIALIZED"
         self._logger              = logger or logging.getLogger("pm_main." + __name__)
         self._current_state       = init_state(self._logger)
+        self._poll_schedules      = poll_schedules or dict()
+        self._trace               = trace or current_trace()
+        self._progress            = progress or current_progress()
+
+        self._skip_prod_boot      = skip_prod_boot
+        if skip_prod_boot:
+            self._transitions = ProgramManagerFsm.STATE_TO_MODE_TO_INTERIM_STATES_NO_PROD_BOOT
+            self._valid_modes = ProgramManagerFsm.VALID_MODES_NO_PROD_BOOT
+
+        else:
+            self._transitions = ProgramManagerFsm.STATE_TO_MODE_TO_INTERIM_STATES
+            self._valid_modes = ProgramManagerFsm.VALID_MODES
         
         self._set_valid_fgc_connection()
 
+    @classmethod
+    def can_resume(cls, state, skip_prod_boot=False):
+        """Whether an FSM can be started in state, instead of UNINITIALIZED."""
+        transitions = cls.STATE_TO_MODE_TO_INTERIM_STATES_NO_PROD_BOOT if skip_prod_boot else cls.STATE_TO_MODE_TO_INTERIM_STATES
+        return state in cls.RESUMABLE_STATES and state in transitions
+
     def process(self):
+        drive(self.steps(), self._fgc_session)
+
+    def steps(self):
+        """Steps of process(), to be carried out by a driver (see drive)."""
         try:
-            assert isinstance(self._current_state, PmStateUninitialized)
+            assert isinstance(self._current_state, PmStateUninitialized) or self.can_resume(self.state, self._skip_prod_boot)
         
         except AssertionError:
             self._logger.exception(f"Initial FSM state '{self.state}' should be 'UNINITIALIZED'")
             return
         
-        mode_sequence          = list(ProgramManagerFsm.VALID_MODES)
+        mode_sequence          = self._remaining_modes()
         error_during_reprogram = False
         
         while mode_sequence:
-            mode = list(ProgramManagerFsm.STATE_TO_MODE_TO_INTERIM_STATES[self.state].keys())[0]
+            mode = list(self._transitions[self.state].keys())[0]
             self._logger.info(f"processing mode {mode} in state {self.state}")
 
             try:
-                self._process_mode(mode, self._fgc_session)
+                yield from self._mode_steps(mode)
 
             except (RuntimeError, KeyError) as e:
                 self._logger.error(f"{e}")
@@ -232,7 +364,7 @@ class ProgramManagerFsm:
 
         # Try to leave the FGC FSM in its initial state
         try:
-            self._process_mode("WAITING", self._fgc_session)
+            yield from self._mode_steps("WAITING")
 
         except KeyError as e:
             raise RuntimeError(e)
@@ -240,13 +372,24 @@ class ProgramManagerFsm:
         if error_during_reprogram:
             raise RuntimeError("Error during reprogramming after recovery attempt")
 
+    def _remaining_modes(self):
+        # Modes from the current state to CLEAN_UP
+        modes = list()
+        state = self.state
+        while state != "CLEAN_UP":
+            state = list(self._transitions[state].keys())[0]
+            modes.append(state)
+
+        return modes
+
     def _set_valid_fgc_connection(self):
         # Create connection if the client did not do it
         if self._fgc_session:
             return
 
         try:
-            self._fgc_session = pyfgc.connect(self.prog_data_dict["converter"])
+            with self._trace.span("connect", converter=self.prog_data_dict["converter"]):
+                self._fgc_session = pyfgc.connect(self.prog_data_dict["converter"])
 
         except pyfgc.PyFgcError as pe:
             raise RuntimeError(pe)
@@ -268,18 +411,29 @@ class ProgramManagerFsm:
                 self._logger.exception(f"Could not close connection to the FGC: {pe}")
 
     def _process_mode(self, target_mode, fgc_session):
+        drive(self._mode_steps(target_mode), fgc_session)
+
+    def _mode_steps(self, target_mode):
         self._mode = target_mode
-        interim_states = ProgramManagerFsm.STATE_TO_MODE_TO_INTERIM_STATES[self.state][target_mode]
+        interim_states = self._transitions[self.state][target_mode]
 
         for interim_state in interim_states:
-            _ = fgc_session.set("REGFGC3.PROG.FSM.MODE", target_mode)
+            _ = yield (OP_SET, "REGFGC3.PROG.FSM.MODE", target_mode)
             next_state = interim_state(self._logger)
+            next_state.poll_schedule = self._poll_schedules.get(next_state.name, next_state.poll_schedule)
             if self._current_state.name == next_state.name:
                 pass
 
             else:
-                next_state.run(fgc_session, **self.prog_data_dict)
+                with self._trace.span(f"state.{next_state.name}", mode=target_mode) as span:
+                    try:
+                        yield from next_state.steps(**self.prog_data_dict)
+
+                    finally:
+                        span.attrs.update(next_state.trace_attrs())
+
                 self._current_state = next_state
+                self._progress.state_reached(self.prog_data_dict["slot"], self.prog_data_dict["device"], next_state.name)
 
     @property
     def state(self):
@@ -292,7 +446,7 @@ class ProgramManagerFsm:
     #TODO: the setter is only valid for commissioning/testing.
     @mode.setter
     def mode(self, new_mode):
-        mode_for_current_state = list(ProgramManagerFsm.STATE_TO_MODE_TO_INTERIM_STATES[self.state].keys())[0]
+        mode_for_current_state = list(self._transitions[self.state].keys())[0]
         try:
             assert new_mode == mode_for_current_state
         
@@ -41,8 +41,16 @@ def start_pm(log, config_info):
     try:
         pms = ProgramManagerServer(name_file     = config_info["name_file"],
                                    fw_repo_loc   = config_info["fw_repo_loc"],
+                                   fw_subfolder  = config_info["fw_subfolder"],
+                                   fw_crc_check  = config_info["fw_crc_check"],
+                                   db_subfolder  = config_info["db_subfolder"],
                                    expected_data = config_info["expected_data"],
-                                   db_data       = config_info["db_data"])
+                                   db_data       = config_info["db_data"],
+                                   trace_file    = config_info["trace_file"],
+                                   slot_snapshot_file = config_info["slot_snapshot_file"],
+                                   journal_file  = config_info["journal_file"],
+                                   name_snapshot_dir = config_info["name_snapshot_dir"],
+                                   max_jobs_per_gateway = config_info["max_jobs_per_gateway"])
         pms.start()
     
     except ProgramManagerTermError:
@@ -86,19 +94,33 @@ def read_config_file(config_file_name:str) -> None:
     config = SafeConfigParser()
     config.read(args["--config-file"])
     name_file     = config.get("BASIC", "name_file_location")
-    fw_repo_loc   = config.get("BASIC", "fw_repo_location")
+    fw_repo_loc   = config.get("BASIC", "fs_fw_repo_location")
     expected_data = config.get("BASIC", "expected_data_location")
     log_file_name = config.get("BASIC", "pm_log_file_name")
+    fw_subfolder  = config.get("fs", "fw_subfolder")
+    db_subfolder  = config.get("fs", "db_subfolder", fallback="DB")
+    fw_crc_check  = config.get("fs", "fw_crc_check", fallback=None)
+    trace_file    = config.get("BASIC", "pm_trace_file_name", fallback=None)
+    trace_file    = trace_file and os.path.expanduser(os.path.join("~", trace_file))
+    name_snapshot = config.get("BASIC", "pm_name_snapshot_dir", fallback="pm_test/name_snapshot")
+    name_snapshot = os.path.expanduser(os.path.join("~", name_snapshot))
+    slot_snapshot = config.get("BASIC", "pm_slot_snapshot_file", fallback="pm_test/slot_info.snapshot")
+    slot_snapshot = os.path.expanduser(os.path.join("~", slot_snapshot))
+    journal_file  = config.get("BASIC", "pm_job_journal_file", fallback="pm_test/job_journal.jsonl")
+    journal_file  = os.path.expanduser(os.path.join("~", journal_file))
+    max_jobs_gw   = config.getint("BASIC", "max_jobs_per_gateway", fallback=None)
     conn_string, username, password = [""] * 3
+    record_table  = None
 
     if expected_data == "db":
-        conn_string = config.get("db", "connection_string")
-        username    = config.get("db", "username")
-        password    = config.get("db", "password")
+        conn_string  = config.get("db", "connection_string")
+        username     = config.get("db", "username")
+        password     = config.get("db", "password")
+        record_table = config.get("db", "record_detected_table", fallback=None)
 
     config_file_dict = dict(zip(
-                                ("name_file", "fw_repo_loc", "log_file_name", "expected_data", "db_data"),
-                                (name_file,    fw_repo_loc,   log_file_name,   expected_data,  (conn_string,username,password))
+                                ("name_file", "name_snapshot_dir", "slot_snapshot_file", "journal_file", "max_jobs_per_gateway", "fw_repo_loc", "fw_subfolder", "fw_crc_check", "db_subfolder", "log_file_name", "trace_file", "expected_data", "db_data"),
+                                (name_file,    name_snapshot,       slot_snapshot,        journal_file,   max_jobs_gw,            fw_repo_loc,   fw_subfolder,   fw_crc_check,   db_subfolder,   log_file_name,   trace_file,   expected_data,  (conn_string,username,password,record_table))
                                 )
                             )
     
@@ -1,84 +1,222 @@
 """Summary
 """
 
+import functools
 import logging
+import os
 import threading
 import time
 
 import pyfgc
-import pyfgc_name
 import pyfgc_statussrv
-from program_manager.area_worker import AreaProgramManager
+from program_manager.adapters import getAdapter
+from program_manager.area_worker import JOB_REJECTED, AreaProgramManager
 from program_manager.area_worker import fgc_work
+from program_manager.fgc_pool import fgc_pool, gateway_of
+from program_manager.fw_catalog import CRC_FUNCTIONS, DEFAULT_FW_CRC_CHECK, FirmwareCatalog
+from program_manager.gateway_limiter import gateway_limiter, max_transfers_for
+from program_manager.job_journal import JobJournal
+from program_manager.job_queue import PRIORITY_SYNC
+from program_manager.name_index import NAME_FILE_CHECK_SEC, NameIndex
+from program_manager.planner import Planner
+from program_manager.recorder import WriteBehindRecorder
+from program_manager.scheduler import MAX_PER_GATEWAY, WorkScheduler
+from program_manager.slot_snapshot import SAVE_EVERY_SEC, SlotInfoStore
+from program_manager.status_ingest import StatusIngester
+from program_manager.tracing import Tracer
 
 ITERATION_STATUS_SRV_SEC = 5
 STATUS_SRV_REFRESH_SEC = 5
+FW_CATALOG_SCAN_SEC = 60
 
-def _gen_fgc_jobs_for_groups_class(groups, class_id):
-    pyfgc_name.read_name_file()
-    pyfgc_name.read_group_file()
-
-    for name, device in pyfgc_name.devices.items():
-        if device["class_id"] != class_id:
-            continue
-
-        gr = pyfgc_name.gateways[device["gateway"]]["groups"][0]
+def _gen_fgc_jobs_for_groups_class(name_index, groups, class_id):
+    for name in name_index.devices_of_class(class_id):
+        gr = name_index.area_of(name)
         if gr not in groups:
             continue
 
         yield name, gr
 
-def filter_jobs(status_rsp):
-    for gw in status_rsp.keys():
-        if status_rsp[gw]["recv_time_sec"] >= (time.time() - (STATUS_SRV_REFRESH_SEC * 2)):
-            for dev in status_rsp[gw]["devices"].keys():
-                try:
-                    if "SYNC_REGFGC3" in status_rsp[gw]["devices"][dev]["ST_UNLATCHED"]:
-                        # res.append(dev)
-                        device_obj = pyfgc_name.devices[dev]
-                        yield dev, pyfgc_name.gateways[device_obj["gateway"]]["groups"][0]
-                
-                except KeyError:
-                    pass
-
 class ProgramManagerServer():
     def __init__(self, **kwargs):
         self.name_file      = kwargs["name_file"]
         self.fw_repo_loc    = kwargs["fw_repo_loc"]
         self.expected_data  = kwargs["expected_data"]
         self.db_data        = kwargs["db_data"]
+        self.fw_subfolder   = kwargs.get("fw_subfolder", "FW")
+        self.db_subfolder   = kwargs.get("db_subfolder", "DB")
+        self.tracer         = Tracer(kwargs.get("trace_file"))
+        self.journal        = JobJournal(kwargs.get("journal_file"))
         
         self._run           = threading.Event()
         self._area_pms      = dict()
+        self._scheduler     = None
+
+        # Firmware files are checked against the CRC in their name, unless the check is configured empty
+        fw_crc_check            = kwargs.get("fw_crc_check")
+        if fw_crc_check is None:
+            fw_crc_check        = DEFAULT_FW_CRC_CHECK
+
+        if fw_crc_check and fw_crc_check not in CRC_FUNCTIONS:
+            raise RuntimeError(f"Unknown firmware CRC check {fw_crc_check}, expected one of {sorted(CRC_FUNCTIONS)}")
+
+        self.fw_catalog         = FirmwareCatalog(os.path.join(self.fw_repo_loc, self.fw_subfolder),
+                                                  crc_func=CRC_FUNCTIONS.get(fw_crc_check),
+                                                  verify_crc=bool(fw_crc_check))
+        self._fw_catalog_scan_t = None
         
+        # A name index, status source and job func can be given to run against simulated FGCs (see fgc_simulator)
+        self.names              = kwargs.get("name_index") or NameIndex(self.name_file, kwargs["name_snapshot_dir"], kwargs.get("group_file"))
+        self._names_check_t     = None
+
+        # All the per gateway limits (running jobs, pooled sessions, binary transfers) derive from one value,
+        # and the gateway of a converter always comes from the name index
+        self.max_jobs_per_gateway     = kwargs.get("max_jobs_per_gateway") or MAX_PER_GATEWAY
+        fgc_pool.gateway_lookup       = self.names.gateway_of
+        fgc_pool.max_per_gateway      = self.max_jobs_per_gateway
+        gateway_limiter.max_transfers = max_transfers_for(self.max_jobs_per_gateway)
+
         self._status_srv_conn = None
+        self._status_source   = kwargs.get("status_source")
+        self._status_period   = kwargs.get("status_period", ITERATION_STATUS_SRV_SEC)
+
+        # Detected firmware and outcomes are written in the background, through the adapter
+        self.adapter  = kwargs.get("adapter") or self._create_adapter()
+        self.recorder = WriteBehindRecorder(self.adapter.record_detected)
+
+        # Last SLOT_INFO read from every converter, kept across restarts
+        self.snapshots          = SlotInfoStore(kwargs.get("slot_snapshot_file"))
+        self._snapshots_saved_t = None
+
+        # Plans are kept per converter and dropped when the firmware catalog changes
+        self.planner   = Planner(self.fw_catalog.lookup)
+        self._job_func = kwargs.get("job_func") or functools.partial(fgc_work,
+                                                                     adapter=self.adapter,
+                                                                     fw_catalog=self.fw_catalog,
+                                                                     recorder=self.recorder,
+                                                                     planner=self.planner,
+                                                                     snapshots=self.snapshots)
+        self._ingester = StatusIngester(area_of=self.names.area_of, refresh_sec=STATUS_SRV_REFRESH_SEC)
 
         self._logger = logging.getLogger("pm_main." + __name__ + type(self).__name__)
 
     def start(self):
         self._logger.info("Starting Program Manager Server")
-        pyfgc_name.read_name_file()
-        pyfgc_name.read_group_file()
+        self.names.load()
+        self._names_check_t = time.monotonic()
+        self.snapshots.load()
+        self._snapshots_saved_t = time.monotonic()
+        self._scheduler     = WorkScheduler(max_per_gateway=self.max_jobs_per_gateway)
+        self._start_area_pms(self.names.areas)
 
-        for area in pyfgc_name.groups.keys():
-            self._logger.info(f"Starting AreaProgramManager({area})")
-            self._area_pms[area] = AreaProgramManager(area)
+        # The restored jobs are planned against the firmware catalog
+        self.fw_catalog.scan()
+        self.planner.invalidate()
+        self._fw_catalog_scan_t = time.monotonic()
+        self._restore_jobs()
                 
         while not self._run.is_set():
-            if not self._status_srv_conn:
-                self._get_status_srv_connection()
+            if time.monotonic() - self._names_check_t >= NAME_FILE_CHECK_SEC:
+                self._refresh_names()
+                self._names_check_t = time.monotonic()
+
+            if self._fw_catalog_scan_t is None or time.monotonic() - self._fw_catalog_scan_t >= FW_CATALOG_SCAN_SEC:
+                if self.fw_catalog.scan():
+                    self.planner.invalidate()
+
+                self._fw_catalog_scan_t = time.monotonic()
+
+            if time.monotonic() - self._snapshots_saved_t >= SAVE_EVERY_SEC:
+                self._save_snapshots()
+                self._snapshots_saved_t = time.monotonic()
+
+            fgc_pool.evict_idle()
 
             try:
-                fgcds = pyfgc_statussrv.get_status_all(fgc_session=self._status_srv_conn)
-                for dev, area in filter_jobs(fgcds):
-                    self._area_pms[area].add_job(fgc_work, dev)
+                fgcds = self._get_status()
+                for dev, area in self._ingester.ingest(fgcds):
+                    self._area_pms[area].add_job(self._job_func, dev, priority=PRIORITY_SYNC, gateway=gateway_of(dev))
 
-                time.sleep(ITERATION_STATUS_SRV_SEC)
+                self._run.wait(self._status_period)
 
             except pyfgc.PyFgcError as e:
                 self._logger.warning(f"Error in ProgramManagerServer: {e}")
                 self._clean_status_srv_connection()
                 
+    def fleet_plan(self):
+        """Plans the programming of every converter from the stored SLOT_INFO, without querying them.
+
+        Returns:
+            planner.FleetPlan
+        """
+        return self.planner.plan(self.snapshots.slot_infos(), self.adapter.get_expected)
+
+    def _save_snapshots(self):
+        try:
+            self.snapshots.save()
+
+        except OSError as e:
+            self._logger.warning(f"Could not save SLOT_INFO snapshot: {e}")
+
+    def _create_adapter(self):
+        if self.expected_data == "db":
+            adapter_data = self.db_data
+
+        else:
+            adapter_data = (self.fw_subfolder, self.db_subfolder, self.fw_repo_loc)
+
+        adapter = getAdapter(self.expected_data, adapter_data)
+        if adapter is None:
+            raise RuntimeError(f"Unknown expected data location {self.expected_data}")
+
+        return adapter
+
+    def _start_area_pms(self, areas):
+        for area in areas:
+            if area not in self._area_pms:
+                self._logger.info(f"Starting AreaProgramManager({area})")
+                self._area_pms[area] = AreaProgramManager(area, tracer=self.tracer, scheduler=self._scheduler, journal=self.journal)
+
+    def _restore_jobs(self):
+        # Jobs queued or running when the previous run stopped, resumed from the last FSM states they reached
+        for job in self.journal.replay():
+            area = self.names.area_of(job.job_name) or job.area
+            try:
+                outcome = self._area_pms[area].add_job(self._job_func, job.job_name, priority=job.priority, gateway=gateway_of(job.job_name),
+                                                       resume=job.states)
+
+            except KeyError:
+                outcome = JOB_REJECTED
+
+            if outcome == JOB_REJECTED:
+                self._logger.warning(f"Job {job.job_name} of the previous run not restored")
+                self.journal.finished(job.job_name, "not restored")
+
+            else:
+                self._logger.info(f"Job {job.job_name} of the previous run restored ({'started' if job.started else 'queued'})")
+
+    def _refresh_names(self):
+        try:
+            affected = self.names.refresh()
+
+        except (OSError, RuntimeError) as e:
+            self._logger.warning(f"Could not refresh name index: {e}")
+            return
+
+        if affected:
+            self._logger.info(f"Name file changed, areas affected: {sorted(affected)}")
+            self._start_area_pms(affected & self.names.areas)
+            self._ingester.reload_names()
+
+    def _get_status(self):
+        if self._status_source:
+            return self._status_source()
+
+        if not self._status_srv_conn:
+            self._get_status_srv_connection()
+
+        return pyfgc_statussrv.get_status_all(fgc_session=self._status_srv_conn)
+
     def _get_status_srv_connection(self):
         try:
             #TODO: delay throwing exceptions in pyfgc, but throw them
@@ -98,9 +236,25 @@ class ProgramManagerServer():
         self._run.set()
         for area in self._area_pms.keys():
             self._area_pms[area].wait_completion()
+            self._logger.info(f"AreaProgramManager({area}) stats: {self._area_pms[area].stats()}")
+
+        if self._scheduler:
+            self._logger.info(f"Scheduler stats: {self._scheduler.stats()}")
+            self._logger.info(f"Gateway transfer stats: {gateway_limiter.stats()}")
+            self._scheduler.stop()
+
+        # Every job is done, write what they recorded
+        self.recorder.close()
+        self._logger.info(f"Recorder stats: {self.recorder.stats()}")
+        self._save_snapshots()
+        self.snapshots.close()
+        self._logger.info(f"SLOT_INFO snapshot stats: {self.snapshots.stats()}")
         
         if self._status_srv_conn:
             self._status_srv_conn.disconnect()
             self._status_srv_conn = None
-        
+
+        fgc_pool.close_all()
+        self.journal.close()
+        self.tracer.close()
         self._logger.info("Program Manager Server stopped")
@@ -0,0 +1,209 @@
+"""Write-behind recording of the detected firmware and programming outcomes.
+
+Workers submit a DetectedRecord per job without waiting for the file or DB
+write. A flusher thread hands the records to the backend (the record_detected
+method of an adapter) in batches, when batch_size records are pending or
+flush_interval seconds after the oldest one was submitted. A failed batch is
+retried with exponential backoff. At most max_pending records are kept: past
+that, the oldest ones are dropped and counted.
+"""
+
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+from program_manager.regfgc3_programmer import parse_slot_info
+
+BATCH_SIZE          = 200
+FLUSH_INTERVAL_SEC  = 5
+MAX_PENDING         = 20000
+RETRY_DELAY_SEC     = 1
+MAX_RETRY_DELAY_SEC = 60
+CLOSE_ATTEMPTS      = 3
+
+# slot_info is the raw REGFGC3.SLOT_INFO reply, None if it could not be read
+DetectedRecord = namedtuple("DetectedRecord", "converter, timestamp, slot_info, outcome")
+
+ROW_FIELDS = ("converter", "recorded_at", "slot", "board", "state", "device", "variant", "var_revision", "api_revision", "outcome")
+
+def detected_rows(record):
+    """Flattens a DetectedRecord into one dict per device, with the ROW_FIELDS keys."""
+    row = dict.fromkeys(ROW_FIELDS)
+    row.update(converter=record.converter, recorded_at=record.timestamp, outcome=record.outcome)
+    if not record.slot_info:
+        return [row]
+
+    try:
+        slot_info = parse_slot_info(record.slot_info)
+
+    except RuntimeError:
+        return [row]
+
+    rows = list()
+    for board in slot_info:
+        for device in board.devices:
+            rows.append(dict(row, slot=board.SLOT, board=board.BOARD, state=board.STATE, device=device.Device,
+                             variant=device.Variant, var_revision=device.Var_Rev, api_revision=device.API_Rev))
+
+    return rows or [row]
+
+class WriteBehindRecorder:
+    def __init__(self, backend, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL_SEC, max_pending=MAX_PENDING,
+                 retry_delay=RETRY_DELAY_SEC, max_retry_delay=MAX_RETRY_DELAY_SEC, name="recorder"):
+        """Arguments:
+            backend -- Called with a list of DetectedRecords, raises on failure
+        """
+        self.batch_size      = batch_size
+        self.flush_interval  = flush_interval
+        self.max_pending     = max_pending
+        self.retry_delay     = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._backend        = backend
+        self._pending        = deque()
+        self._in_flight      = 0
+        self._cond           = threading.Condition()
+        self._closing        = False
+        self._flush_requests = 0
+        self._next_warning   = 1
+        self._retry_at       = 0.0
+        self._logger         = logging.getLogger("pm_main." + __name__)
+
+        self.submitted = 0
+        self.written   = 0
+        self.dropped   = 0
+        self.failures  = 0
+        self.batches   = 0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        """Queues a record without blocking. Returns False if the recorder is closed."""
+        with self._cond:
+            if self._closing:
+                return False
+
+            self._pending.append((time.monotonic(), record))
+            self.submitted += 1
+            self._drop_oldest()
+            # The flusher starts the flush_interval timer on the first record
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+        return True
+
+    def flush(self, timeout=None):
+        """Writes all the pending records now. Returns whether they were all written within timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_requests += 1
+            self._cond.notify_all()
+            try:
+                while self._pending or self._in_flight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+
+                    self._cond.wait(remaining)
+
+            finally:
+                self._flush_requests -= 1
+
+        return True
+
+    def close(self, timeout=None):
+        """Flushes the pending records and stops the flusher thread."""
+        with self._cond:
+            self._closing  = True
+            self._retry_at = min(self._retry_at, time.monotonic())
+            self._cond.notify_all()
+
+        self._thread.join(timeout)
+        if self._pending:
+            self._logger.error(f"{len(self._pending)} records could not be written before closing")
+
+    def stats(self):
+        with self._cond:
+            return {"pending"   : len(self._pending) + self._in_flight,
+                    "submitted" : self.submitted,
+                    "written"   : self.written,
+                    "dropped"   : self.dropped,
+                    "failures"  : self.failures,
+                    "batches"   : self.batches}
+
+    def _drop_oldest(self):
+        # Called with the lock held
+        excess = len(self._pending) + self._in_flight - self.max_pending
+        while excess > 0 and self._pending:
+            self._pending.popleft()
+            self.dropped += 1
+            excess       -= 1
+
+        if self.dropped >= self._next_warning:
+            self._logger.warning(f"Too many records pending, {self.dropped} dropped so far")
+            self._next_warning = self.dropped + 1000
+
+    def _next_batch(self):
+        # Called with the lock held. Waits until a batch is due, returns None when closed and empty
+        while True:
+            now = time.monotonic()
+            if self._pending and now < self._retry_at:
+                timeout = self._retry_at - now
+
+            elif self._pending:
+                oldest = self._pending[0][0]
+                if (len(self._pending) >= self.batch_size or self._closing or self._flush_requests
+                        or now - oldest >= self.flush_interval):
+                    batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                    self._in_flight = len(batch)
+                    return batch
+
+                timeout = oldest + self.flush_interval - now
+
+            elif self._closing:
+                return None
+
+            else:
+                timeout = None
+
+            self._cond.wait(timeout)
+
+    def _run(self):
+        delay         = self.retry_delay
+        close_retries = 0
+        while True:
+            with self._cond:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+
+            try:
+                self._backend([record for _, record in batch])
+
+            except Exception as e:
+                self._logger.warning(f"Could not write {len(batch)} records: {e}. Retrying in {delay} s")
+                with self._cond:
+                    self.failures += 1
+                    self._in_flight = 0
+                    self._pending.extendleft(reversed(batch))
+                    self._drop_oldest()
+                    self._cond.notify_all()
+
+                    if self._closing:
+                        close_retries += 1
+                        if close_retries >= CLOSE_ATTEMPTS:
+                            return
+
+                    self._retry_at = time.monotonic() + (self.retry_delay if self._closing else delay)
+
+                delay = min(delay * 2, self.max_retry_delay)
+
+            else:
+                delay = self.retry_delay
+                with self._cond:
+                    self._in_flight  = 0
+                    self.written    += len(batch)
+                    self.batches    += 1
+                    self._cond.notify_all()
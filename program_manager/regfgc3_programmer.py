@@ -12,7 +12,6 @@ Options:
 
 import logging
 import os
-import re
 import sys
 from collections import namedtuple
 from logging import handlers
@@ -22,11 +21,20 @@ import termcolor
 
 import program_manager.pm_fsm as fsm
 import pyfgc
+from program_manager.fgc_pool import fgc_pool
+from program_manager.fw_payload import FW_FILE_REGEX
+from program_manager.job_journal import STATE_DONE, STATE_DONE_NO_PB, current_progress
+from program_manager.tracing import current_trace
 
 DEVICES_LIST  = ["DB", "MF"] + ["DEVICE_" + str(i) for i in range(2, 6)]
-FW_FILE_REGEX = re.compile(r"EDA_\d{1,5}-([A-Z]{2,6}_*\d*)-([A-Z]+_\d+)-(\d*)-(\d*)-([0-9A-Z]{4}).bin")
 LOG_FILE_NAME = "program_manager.log"
 
+Board  = namedtuple("Board", "SLOT, BOARD, STATE, devices")
+Device = namedtuple("Device", "Device, Variant, Var_Rev, API_Rev")
+
+_BOARD_FIELDS  = frozenset(Board._fields)
+_DEVICE_FIELDS = frozenset(Device._fields)
+
 _module_logger = logging.getLogger("pm_main." + __name__)
 
 def _configure_logger(verbosity):
@@ -140,46 +148,101 @@ def _get_fgc_detected(converter, slot, device):
         _module_logger.error(re)
         sys.exit(2)
 
-    boards = parse_slot_info(slot_info)
-    board, dev, variant, var_rev, api_rev = [""] * 5
-    for b in boards:
-        if b.SLOT == slot:
-            if not check_board_in_download_boot(b):
-                _module_logger.error(f"Board {b.BOARD} is not running in DownloadBoot!")
-                sys.exit(1)
+    slot_info = parse_slot_info(slot_info)
+    try:
+        b = slot_info[slot]
 
-            board = b.BOARD
-            break
+    except KeyError:
+        return "", "", "", "", ""
 
-    for d in b.devices:
-        if d.Device == device:
-            dev, variant, var_rev, api_rev = d.Device, d.Variant, d.Var_Rev, d.API_Rev
-            break
+    if not check_board_in_download_boot(b):
+        _module_logger.error(f"Board {b.BOARD} is not running in DownloadBoot!")
+        sys.exit(1)
 
-    return board, dev, variant, var_rev, api_rev
+    d = slot_info.device(slot, device)
+    if d is None:
+        return b.BOARD, "", "", "", ""
 
-def _parse_single_slot(single_slot):
-    Board   = namedtuple("Board", "SLOT, BOARD, STATE, devices")
-    Device  = namedtuple("Device", "Device, Variant, Var_Rev, API_Rev")
+    return b.BOARD, d.Device, d.Variant, d.Var_Rev, d.API_Rev
 
-    single_slot.pop()
-    devices          = list()
-    board_info_dict  = dict()
+def _iter_boards(elements):
+    # One pass over the comma separated elements of a SLOT_INFO reply, each of
+    # them either a 'KEY   value' pair, empty (end of device) or a separator
+    board   = None
+    devices = None
+    device  = None
 
-    dev_pos = [i for i, element in enumerate(single_slot) if element.startswith("Device")]
-    for i in range(len(dev_pos)):
-        idx_tuple = dev_pos[i:i+2]
-        if len(idx_tuple) == 1:
-            single_device_info = single_slot[idx_tuple[0]:]
-        else:
-            single_device_info = single_slot[idx_tuple[0]:idx_tuple[1]]
+    for element in elements:
+        key, _, value = element.strip().partition(" ")
+        if key in _DEVICE_FIELDS:
+            if key == "Device":
+                device = dict()
+                devices.append(device)
+
+            device[key] = value.strip()
+
+        elif key in _BOARD_FIELDS:
+            if key == "SLOT":
+                if board is not None:
+                    yield board, devices
+
+                board   = dict()
+                devices = list()
+
+            board[key] = value.strip()
+
+    if board is not None:
+        yield board, devices
+
+def _make_boards(elements):
+    try:
+        for board, devices in _iter_boards(elements):
+            yield Board(devices=tuple(Device(**device) for device in devices), **board)
+
+    except (TypeError, AttributeError) as e:
+        raise RuntimeError(f"Malformed REGFGC3.SLOT_INFO reply: {e}")
+
+class SlotInfo:
+    """Parsed REGFGC3.SLOT_INFO reply.
+
+    Iterates over the boards in slot order. Boards are indexed by slot and
+    devices by (slot, device name); slots may be given as int or str.
+    """
+    __slots__ = ("_boards", "_devices")
+
+    def __init__(self, boards):
+        self._boards  = {board.SLOT: board for board in boards}
+        self._devices = {(board.SLOT, device.Device): device for board in self._boards.values() for device in board.devices}
 
-        device_dict = dict([el.split() for el in single_device_info if el.strip()])
-        devices.append(Device(**device_dict))
+    def __getitem__(self, slot):
+        return self._boards[str(slot)]
 
-    board_info_dict = dict([el.split() for el in single_slot[0:3]])
-    board_info_dict["devices"] = devices
-    return Board(**board_info_dict)
+    def __contains__(self, slot):
+        return str(slot) in self._boards
+
+    def __iter__(self):
+        return iter(self._boards.values())
+
+    def __len__(self):
+        return len(self._boards)
+
+    def get(self, slot, default=None):
+        return self._boards.get(str(slot), default)
+
+    def device(self, slot, device):
+        """Returns the Device named device in the given slot, None if not present."""
+        return self._devices.get((str(slot), device))
+
+    def __repr__(self):
+        return f"SlotInfo({list(self._boards.values())})"
+
+def parse_single_slot(single_slot):
+    """Parses the elements of a single slot of a SLOT_INFO reply into a Board."""
+    boards = list(_make_boards(single_slot))
+    if len(boards) != 1:
+        raise RuntimeError(f"Expected the information of one slot, found {len(boards)}")
+
+    return boards[0]
 
 def _check_file_consistency(cmd_variant, cmd_device, cmd_var_revision, fw_file_loc):
     """Checks file's name against naming convention.
@@ -239,40 +302,73 @@ def check_board_in_download_boot(board):
         return False
 
 def parse_slot_info(slot_info_reply):
-    si_list = slot_info_reply.split(",")
-    slot_start_pos = [idx for idx, element in enumerate(si_list) if element.startswith("SLOT")]
-    boards = list()
-    for i in range(len(slot_start_pos)):
-        idx_tuple = slot_start_pos[i : i+2]
-        if len(idx_tuple) == 1:
-            single_slot_info = si_list[idx_tuple[0]:]
-        else:
-            single_slot_info = si_list[idx_tuple[0]:idx_tuple[1]]
+    """Parses a REGFGC3.SLOT_INFO reply into a SlotInfo."""
+    return SlotInfo(_make_boards(slot_info_reply.split(",")))
 
-        boards.append(_parse_single_slot(single_slot_info))
-    
-    return boards
+def program(converter, slot, board, device, variant, var_revision, api_revision, bin_crc, fw_file_loc, fgc_session=None, fw_catalog=None, trace=None, skip_prod_boot=False,
+            poll_schedules=None, progress=None):
+    # All attempts share one pooled connection, unless the caller gave one
+    if fgc_session is None:
+        try:
+            with fgc_pool.session(converter) as pooled_session:
+                return program(converter, slot, board, device, variant, var_revision, api_revision, bin_crc, fw_file_loc,
+                               pooled_session, fw_catalog, trace, skip_prod_boot, poll_schedules, progress)
+
+        except pyfgc.PyFgcError as pe:
+            raise RuntimeError(pe)
+
+    return fsm.drive(program_steps(converter, slot, board, device, variant, var_revision, api_revision, bin_crc, fw_file_loc,
+                                   fgc_session, fw_catalog, trace, skip_prod_boot, poll_schedules, progress),
+                     fgc_session)
+
+def program_steps(converter, slot, board, device, variant, var_revision, api_revision, bin_crc, fw_file_loc, fgc_session, fw_catalog=None, trace=None,
+                  skip_prod_boot=False, poll_schedules=None, progress=None):
+    """Steps of program(), to be carried out by a driver (see pm_fsm.drive).
 
-def program(converter, slot, board, device, variant, var_revision, api_revision, bin_crc, fw_file_loc, fgc_session=None):
+    fgc_session is the session the driver uses, given to the FSMs.
+    """
     global _module_logger
     max_attempts = 3
     #TODO: temporary for programming in loop
     attempts = 0
+    trace = trace or current_trace()
+    progress = progress or current_progress()
+
+    # Do not spend the programming attempts on a file known to be corrupt or misnamed
+    if fw_catalog is not None:
+        fw_file_error = fw_catalog.check(fw_file_loc)
+        if fw_file_error:
+            _module_logger.critical(f"{converter}: firmware file {fw_file_loc} not valid ({fw_file_error}). Device {device} on {board} was NOT reprogrammed")
+            return max_attempts
+
+    # A run interrupted by a restart is not done again
+    init_state = yield from _resume_state(converter, slot, board, device, skip_prod_boot, progress)
+    if init_state == STATE_DONE:
+        return attempts
 
     for n in range(max_attempts):
+        trace.start_span("attempt", attempt=n + 1, slot=slot, device=device)
         pm_fsm = fsm.ProgramManagerFsm((converter, slot, board, device, variant, var_revision, api_revision, bin_crc, fw_file_loc),
                                         fgc_session,
-                                        logger=_module_logger)
+                                        init_state=init_state if n == 0 else fsm.PmStateUninitialized,
+                                        logger=_module_logger,
+                                        trace=trace,
+                                        skip_prod_boot=skip_prod_boot,
+                                        poll_schedules=poll_schedules,
+                                        progress=progress)
         try:
-            pm_fsm.process()
+            yield from pm_fsm.steps()
 
         except RuntimeError:
             _module_logger.error(f"Error in {converter} while reprogramming {device} in board {board} (attempt {n+1})")
+            trace.end_span("attempt", result="error")
             pm_fsm.reset()
             del pm_fsm
         
         else:
             _module_logger.info(f"{converter}: device {device} on board {board} successfully reprogrammed")
+            trace.end_span("attempt", result="ok")
+            progress.state_reached(slot, device, STATE_DONE_NO_PB if skip_prod_boot else STATE_DONE)
             attempts = n
             break
     
@@ -285,6 +381,136 @@ def program(converter, slot, board, device, variant, var_revision, api_revision,
 
     return attempts
 
+def _resume_state(converter, slot, board, device, skip_prod_boot, progress):
+    """Steps returning STATE_DONE, the FSM state class to start programming from, or PmStateUninitialized."""
+    state = progress.resume_state(slot, device)
+    if state == STATE_DONE or (state == STATE_DONE_NO_PB and skip_prod_boot):
+        _module_logger.info(f"{converter}: device {device} on board {board} already reprogrammed before restart")
+        return STATE_DONE
+
+    # The board must now be switched to production boot, which the FGC only does after programming
+    if state == STATE_DONE_NO_PB:
+        _module_logger.info(f"{converter}: device {device} on board {board} reprogrammed again to switch the board to production boot")
+        return fsm.PmStateUninitialized
+
+    if not fsm.ProgramManagerFsm.can_resume(state, skip_prod_boot):
+        return fsm.PmStateUninitialized
+
+    # Only if the FGC is still where it was left
+    try:
+        fgc_state = (yield (fsm.OP_GET, "REGFGC3.PROG.FSM.STATE")).value
+
+    except pyfgc.PyFgcError as pe:
+        _module_logger.warning(f"{converter}: could not read the FSM state to resume {device} on board {board}: {pe}")
+        return fsm.PmStateUninitialized
+
+    if fgc_state != state:
+        _module_logger.info(f"{converter}: FSM in {fgc_state}, not {state}. Device {device} on board {board} reprogrammed from scratch")
+        return fsm.PmStateUninitialized
+
+    _module_logger.info(f"{converter}: resuming device {device} on board {board} from {state}")
+    return fsm.ProgramManagerFsm.RESUMABLE_STATES[state]
+
+def program_crate(converter, jobs, fgc_session=None, fw_catalog=None, trace=None, poll_schedules=None, progress=None):
+    """Reprograms all the pending devices of a converter's crate in one transaction.
+
+    All the devices are programmed over one connection. The boot parameters are
+    set and the board switched to production boot only once per slot, after all
+    its devices were attempted (see switch_to_production_boot), and the crate is
+    rescanned once at the end.
+
+    Arguments:
+        converter {str}     -- Converter name
+        jobs {list}         -- (slot, board, device, variant, var_revision, api_revision, bin_crc, fw_file_loc) tuples
+        fgc_session         -- Connection to the converter. If None, one is taken from the pool
+        poll_schedules      -- State name -> PollSchedule overriding the default ones
+
+    Returns:
+        tuple -- ({(slot, device): attempts}, REGFGC3.SLOT_INFO after the rescan, None if it failed)
+    """
+    if fgc_session is None:
+        try:
+            with fgc_pool.session(converter) as pooled_session:
+                return program_crate(converter, jobs, pooled_session, fw_catalog, trace, poll_schedules, progress)
+
+        except pyfgc.PyFgcError as pe:
+            raise RuntimeError(pe)
+
+    return fsm.drive(program_crate_steps(converter, jobs, fgc_session, fw_catalog, trace, poll_schedules, progress), fgc_session)
+
+def program_crate_steps(converter, jobs, fgc_session, fw_catalog=None, trace=None, poll_schedules=None, progress=None):
+    """Steps of program_crate(), to be carried out by a driver (see pm_fsm.drive)."""
+    global _module_logger
+    jobs_per_slot = dict()
+    for job in jobs:
+        jobs_per_slot.setdefault(job[0], list()).append(job)
+
+    results   = dict()
+    slot_info = None
+    for slot_jobs in jobs_per_slot.values():
+        for i, (slot, board, device, variant, var_revision, api_revision, bin_crc, fw_file_loc) in enumerate(slot_jobs):
+            is_last_device = i == len(slot_jobs) - 1
+            results[(slot, device)] = yield from program_steps(converter, slot, board, device, variant, var_revision, api_revision, bin_crc, fw_file_loc,
+                                                               fgc_session=fgc_session,
+                                                               fw_catalog=fw_catalog,
+                                                               trace=trace,
+                                                               skip_prod_boot=not is_last_device,
+                                                               poll_schedules=poll_schedules,
+                                                               progress=progress)
+
+        yield from switch_to_production_boot_steps(converter, slot_jobs, results, fgc_session, fw_catalog, trace, poll_schedules, progress)
+
+    try:
+        _ = yield (fsm.OP_SET, "REGFGC3.SLOT_INFO", "")
+        slot_info = (yield (fsm.OP_GET, "REGFGC3.SLOT_INFO")).value
+
+    except pyfgc.PyFgcError as pe:
+        _module_logger.error(f"{converter}: could not rescan the crate: {pe}")
+
+    return results, slot_info
+
+def switch_to_production_boot(converter, slot_jobs, results, fgc_session, fw_catalog=None, trace=None, poll_schedules=None, progress=None):
+    """Makes sure a slot's board is back in production boot once all its devices were attempted.
+
+    The FSM of the slot's last device switches the board. The FGC only sets the
+    boot parameters from PROGRAMMED, so if that device failed, the last device
+    of the slot successfully reprogrammed is programmed again through production
+    boot.
+
+    Arguments:
+        slot_jobs {list}    -- program_crate jobs of one slot, in the order they were programmed
+        results {dict}      -- (slot, device) -> attempts used by each job
+
+    Returns:
+        bool -- Whether the board is in production boot
+    """
+    return fsm.drive(switch_to_production_boot_steps(converter, slot_jobs, results, fgc_session, fw_catalog, trace, poll_schedules, progress), fgc_session)
+
+def switch_to_production_boot_steps(converter, slot_jobs, results, fgc_session, fw_catalog=None, trace=None, poll_schedules=None, progress=None):
+    """Steps of switch_to_production_boot(), to be carried out by a driver (see pm_fsm.drive)."""
+    slot, board, device, *_ = slot_jobs[-1]
+    if results[(slot, device)] < 3:
+        return True
+
+    programmed = [job for job in slot_jobs if results[(job[0], job[2])] < 3]
+    if not programmed:
+        _module_logger.critical(f"{converter}: no device reprogrammed in slot {slot}. Board {board} was NOT switched to production boot")
+        return False
+
+    _module_logger.warning(f"{converter}: device {device} failed. Device {programmed[-1][2]} reprogrammed again to switch board {board} to production boot")
+    attempts = yield from program_steps(converter, *programmed[-1],
+                                        fgc_session=fgc_session,
+                                        fw_catalog=fw_catalog,
+                                        trace=trace,
+                                        poll_schedules=poll_schedules,
+                                        progress=progress)
+
+    if attempts >= 3:
+        _module_logger.critical(f"{converter}: board {board} in slot {slot} was NOT switched to production boot")
+        return False
+
+    return True
+
 def main():
     args = docopt.docopt(__doc__)
     _configure_logger(args["--verbosity"])
@@ -0,0 +1,199 @@
+"""Worker threads shared by the AreaProgramManagers.
+
+A WorkScheduler owns a global budget of FgcWorkers. Workers are started when
+a job is queued and no worker is idle, up to max_workers, and retire after
+idle_timeout seconds without work, down to min_workers. Every worker has a home
+area, taken round robin among the registered areas, and serves its queue
+first. When the home area has nothing runnable, the worker steals from the
+other areas, longest queue first. At most max_per_area jobs of an area and
+max_per_gateway jobs through a gateway run at the same time; a job whose
+gateway is saturated is left queued and the next job of the area is taken.
+
+Registered areas must provide:
+    name                          -- Area name
+    tasks                         -- PriorityTaskQueue of Jobs
+    run_job(job, worker, logger)  -- Runs a job taken from tasks
+"""
+
+import itertools
+import logging
+import threading
+from collections import Counter, OrderedDict
+
+MAX_WORKERS             = 200
+MIN_WORKERS             = 0
+WORKER_IDLE_TIMEOUT_SEC = 60
+MAX_PER_AREA            = 60
+# Also the default of the other per gateway limits: the pooled sessions
+# (fgc_pool) and the concurrent binary transfers (gateway_limiter)
+MAX_PER_GATEWAY         = 8
+
+class FgcWorker(threading.Thread):
+    def __init__(self, scheduler, index, name="Anonymous"):
+        super().__init__()
+        self.index       = index
+        self.name        = name
+        self._scheduler  = scheduler
+        self._logger     = logging.getLogger("pm_main." + __name__ + ".FgcWorker")
+
+        self.start()
+
+    def run(self):
+        while True:
+            area, job = self._scheduler.next_job(self)
+            if job is None:
+                break
+
+            try:
+                area.run_job(job, self.name, self._logger)
+
+            finally:
+                self._scheduler.job_finished(area, job)
+
+class WorkScheduler:
+    def __init__(self, max_workers=MAX_WORKERS, max_per_area=MAX_PER_AREA, max_per_gateway=MAX_PER_GATEWAY, name="scheduler",
+                 min_workers=MIN_WORKERS, idle_timeout=WORKER_IDLE_TIMEOUT_SEC):
+        self.name            = name
+        self.max_workers     = max_workers
+        self.min_workers     = min_workers
+        self.idle_timeout    = idle_timeout
+        self.max_per_area    = max_per_area
+        self.max_per_gateway = max_per_gateway
+
+        self._areas               = list()
+        self._running_per_area    = Counter()
+        self._running_per_gateway = Counter()
+        self._lock                = threading.Lock()
+        self._cond                = threading.Condition(self._lock)
+        self._stopped             = False
+        self._logger              = logging.getLogger("pm_main." + __name__)
+
+        # Idle workers, each waiting on its own condition until notify() takes it
+        self._workers             = list()
+        self._worker_index        = itertools.count()
+        self._idle                = OrderedDict()
+        self._cap_blocked         = False
+
+        self.jobs_started    = 0
+        self.steals          = 0
+        self.workers_started = 0
+        self.workers_retired = 0
+
+        with self._cond:
+            for _ in range(min_workers):
+                self._start_worker()
+
+    def register(self, area):
+        with self._cond:
+            self._areas.append(area)
+
+    def notify(self):
+        """Wakes up or starts a worker, to be called after queueing a job (not holding the queue's lock)."""
+        with self._cond:
+            if self._idle:
+                # The most recently idle worker: the others can retire
+                _, wakeup = self._idle.popitem()
+                wakeup.notify()
+
+            elif len(self._workers) < self.max_workers and not self._stopped:
+                self._start_worker()
+
+    def next_job(self, worker):
+        """Blocks until a job can run. Returns (area, job), (None, None) when the worker must exit."""
+        timed_out = False
+        wakeup    = threading.Condition(self._lock)
+        with self._cond:
+            while not self._stopped:
+                area, job = self._pick(worker)
+                if job is not None:
+                    self._running_per_area[area.name] += 1
+                    if job.gateway is not None:
+                        self._running_per_gateway[job.gateway] += 1
+
+                    self.jobs_started += 1
+                    return area, job
+
+                if timed_out and len(self._workers) > self.min_workers:
+                    self._workers.remove(worker)
+                    self.workers_retired += 1
+                    return None, None
+
+                self._idle[worker] = wakeup
+                wakeup.wait(self.idle_timeout)
+                # Taken by notify() even if the wait timed out at the same time
+                timed_out = self._idle.pop(worker, None) is not None
+
+        return None, None
+
+    def job_finished(self, area, job):
+        with self._cond:
+            self._running_per_area[area.name] -= 1
+            if job.gateway is not None:
+                self._running_per_gateway[job.gateway] -= 1
+
+            # A job held back by the caps of this job may run now
+            if self._cap_blocked:
+                self._cap_blocked = False
+                self._wake_all()
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._wake_all()
+
+        if wait:
+            with self._cond:
+                workers = list(self._workers)
+
+            for worker in workers:
+                worker.join()
+
+    def stats(self):
+        with self._cond:
+            return {"workers"             : len(self._workers),
+                    "idle_workers"        : len(self._idle),
+                    "workers_started"     : self.workers_started,
+                    "workers_retired"     : self.workers_retired,
+                    "jobs_started"        : self.jobs_started,
+                    "steals"              : self.steals,
+                    "running_per_area"    : {k: v for k, v in self._running_per_area.items() if v},
+                    "running_per_gateway" : {k: v for k, v in self._running_per_gateway.items() if v},
+                    "queued_per_area"     : {area.name: area.tasks.qsize() for area in self._areas}}
+
+    def _gateway_available(self, job):
+        return job.gateway is None or self._running_per_gateway[job.gateway] < self.max_per_gateway
+
+    def _pick(self, worker):
+        # Called with the lock held
+        if not self._areas:
+            return None, None
+
+        home   = self._areas[worker.index % len(self._areas)]
+        others = sorted((area for area in self._areas if area is not home), key=lambda area: area.tasks.qsize(), reverse=True)
+        for area in [home] + others:
+            if self._running_per_area[area.name] >= self.max_per_area:
+                self._cap_blocked |= area.tasks.qsize() > 0
+                continue
+
+            job = area.tasks.get_first(self._gateway_available)
+            if job is not None:
+                if area is not home:
+                    self.steals += 1
+
+                return area, job
+
+            self._cap_blocked |= area.tasks.qsize() > 0
+
+        return None, None
+
+    def _wake_all(self):
+        # Called with the lock held
+        while self._idle:
+            _, wakeup = self._idle.popitem()
+            wakeup.notify()
+
+    def _start_worker(self):
+        # Called with the lock held
+        index = next(self._worker_index)
+        self._workers.append(FgcWorker(self, index, name=f"{self.name}{index}"))
+        self.workers_started += 1
@@ -0,0 +1,432 @@
+"""On-disk snapshot of the REGFGC3.SLOT_INFO detected in every converter.
+
+The snapshot lets a restarted server know which firmware every converter runs
+without querying them. It is one binary file, memory mapped when loaded:
+
+    header      magic, format version, generation, CRC32 of the body and the
+                number of strings, converters and rows
+    strings     offsets (uint32) and UTF-8 blob of every distinct string
+    converters  timestamp (float64), name (string id) and first row of every
+                converter, plus the end of the last one
+    rows        one row per device (per board if it has none), as seven
+                uint32 columns of string ids: slot, board, state, device,
+                variant, var_revision, api_revision
+
+All the integers are little endian and every section starts on 8 bytes. A
+converter's SlotInfo is only decoded from the mapped columns when asked for.
+Workers update converters in memory, and save() writes the whole snapshot
+to a new file that replaces the previous one. The generation is incremented
+on every save.
+"""
+
+import itertools
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+
+from program_manager.regfgc3_programmer import Board, Device, SlotInfo, parse_slot_info
+
+MAGIC          = b"PMSLOTS\x00"
+FORMAT_VERSION = 1
+SAVE_EVERY_SEC = 60
+
+_HEADER    = struct.Struct("<8sIQIIII")
+_ALIGNMENT = 8
+
+# Row columns, in file order
+ROW_COLUMNS = ("slot", "board", "state", "device", "variant", "var_revision", "api_revision")
+
+# String id 0 is the empty string: the device columns of a board without devices
+_EMPTY = 0
+
+_module_logger = logging.getLogger("pm_main." + __name__)
+
+def _padding(length):
+    return -length % _ALIGNMENT
+
+def _column(buf, offset, typecode, count):
+    """Returns a column of the mapped file, without copying it if the host is little endian."""
+    size   = count * array(typecode).itemsize
+    column = buf[offset:offset + size]
+    if sys.byteorder == "little":
+        return column.cast(typecode), offset + size + _padding(size)
+
+    column = array(typecode, column)
+    column.byteswap()
+    return column, offset + size + _padding(size)
+
+def _to_bytes(column):
+    if sys.byteorder != "little":
+        column = array(column.typecode, column)
+        column.byteswap()
+
+    data = column.tobytes()
+    return data + bytes(_padding(len(data)))
+
+class _MappedSnapshot:
+    """Columns of a snapshot file, read through a memory map."""
+    def __init__(self, path):
+        with open(path, "rb") as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self._map()
+
+        except Exception:
+            self.close()
+            raise
+
+    def _map(self):
+        with memoryview(self._mm) as buf:
+            self._map_columns(buf)
+
+    def _map_columns(self, buf):
+        if len(buf) < _HEADER.size:
+            raise RuntimeError("file too short")
+
+        magic, version, self.generation, crc, n_strings, n_converters, n_rows = _HEADER.unpack_from(buf)
+        if magic != MAGIC:
+            raise RuntimeError("not a SLOT_INFO snapshot")
+
+        if version != FORMAT_VERSION:
+            raise RuntimeError(f"format version {version}, {FORMAT_VERSION} supported")
+
+        offset = _HEADER.size + _padding(_HEADER.size)
+        if zlib.crc32(buf[offset:]) != crc:
+            raise RuntimeError("CRC mismatch")
+
+        string_offsets, offset = _column(buf, offset, "I", n_strings + 1)
+        blob                   = bytes(buf[offset:offset + string_offsets[-1]])
+        offset                += string_offsets[-1] + _padding(string_offsets[-1])
+        self.strings           = [blob[string_offsets[i]:string_offsets[i + 1]].decode() for i in range(n_strings)]
+
+        self.timestamps, offset  = _column(buf, offset, "d", n_converters)
+        names, offset            = _column(buf, offset, "I", n_converters)
+        self.row_offsets, offset = _column(buf, offset, "I", n_converters + 1)
+
+        self.columns = list()
+        for _ in ROW_COLUMNS:
+            column, offset = _column(buf, offset, "I", n_rows)
+            self.columns.append(column)
+
+        self.converters = {self.strings[name]: i for i, name in enumerate(names)}
+        self._devices   = dict()
+
+    def slot_info(self, i):
+        start, end = self.row_offsets[i], self.row_offsets[i + 1]
+        rows       = zip(*[column[start:end].tolist() for column in self.columns])
+
+        # Most devices run the same firmware: their Device is decoded once and shared
+        strings = self.strings
+        boards  = list()
+        for board_ids, board_rows in itertools.groupby(rows, key=lambda row: row[:3]):
+            devices = list()
+            for row in board_rows:
+                device_ids = row[3:]
+                if device_ids[0] == _EMPTY:
+                    continue
+
+                try:
+                    devices.append(self._devices[device_ids])
+
+                except KeyError:
+                    device = self._devices[device_ids] = Device(*map(strings.__getitem__, device_ids))
+                    devices.append(device)
+
+            boards.append(Board(*map(strings.__getitem__, board_ids), tuple(devices)))
+
+        return SlotInfo(boards)
+
+    def close(self):
+        # The columns are views of the map: they must be released before closing it
+        self.columns     = list()
+        self.timestamps  = None
+        self.row_offsets = None
+        try:
+            self._mm.close()
+
+        except BufferError:
+            _module_logger.warning("SLOT_INFO snapshot still in use, left mapped")
+
+class SlotInfoStore:
+    def __init__(self, path=None):
+        """Arguments:
+            path {str} -- Snapshot file. If None, the store is only kept in memory
+        """
+        self.path = path
+
+        # Converters of the mapped file, converters updated or removed since
+        self._mapped  = None
+        self._updated = dict()
+        self._removed = set()
+
+        # converter -> SlotInfo decoded from the mapped file, kept so that a converter
+        # always gets the same object until it is updated (see planner.Planner)
+        self._decoded = dict()
+
+        self.generation = 0
+        self._lock      = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._logger    = logging.getLogger("pm_main." + __name__)
+
+        self.updates = 0
+        self.saves   = 0
+
+    def load(self):
+        """Maps the snapshot file. A missing or unreadable snapshot leaves the store empty.
+
+        Returns:
+            int -- Number of converters loaded
+        """
+        if self.path is None:
+            return 0
+
+        try:
+            mapped = _MappedSnapshot(self.path)
+
+        except FileNotFoundError:
+            self._logger.info(f"No SLOT_INFO snapshot {self.path}, starting empty")
+            return 0
+
+        except (OSError, ValueError, RuntimeError) as e:
+            self._logger.warning(f"SLOT_INFO snapshot {self.path} ignored: {e}")
+            return 0
+
+        with self._lock:
+            self._replace_mapped(mapped)
+            self._updated   = dict()
+            self._removed   = set()
+            self._decoded   = dict()
+            self.generation = mapped.generation
+
+        self._logger.info(f"SLOT_INFO snapshot {self.path} loaded: {len(mapped.converters)} converters, generation {self.generation}")
+        return len(mapped.converters)
+
+    def update(self, converter, slot_info, timestamp=None):
+        """Stores the SLOT_INFO detected in a converter.
+
+        Arguments:
+            slot_info       -- SlotInfo or raw REGFGC3.SLOT_INFO reply
+            timestamp       -- When slot_info was read, now if None. Older readings than the stored one are ignored
+
+        Returns:
+            bool -- Whether the store was updated
+        """
+        if isinstance(slot_info, str):
+            slot_info = parse_slot_info(slot_info)
+
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            previous = self._timestamp(converter)
+            if previous is not None and previous > timestamp:
+                return False
+
+            self._updated[converter] = (timestamp, slot_info)
+            self._removed.discard(converter)
+            self._decoded.pop(converter, None)
+            self.updates += 1
+
+        return True
+
+    def remove(self, converter):
+        with self._lock:
+            self._updated.pop(converter, None)
+            self._decoded.pop(converter, None)
+            self._removed.add(converter)
+
+    def get(self, converter):
+        """Returns the SlotInfo of a converter, None if unknown."""
+        with self._lock:
+            return self._get(converter)
+
+    def timestamp(self, converter):
+        """Returns when the SlotInfo of a converter was read, None if unknown."""
+        with self._lock:
+            return self._timestamp(converter)
+
+    def slot_infos(self):
+        """Returns converter -> SlotInfo for all the converters."""
+        with self._lock:
+            return {converter: self._get(converter) for converter in self._converters()}
+
+    def converters(self):
+        with self._lock:
+            return list(self._converters())
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for _ in self._converters())
+
+    def __contains__(self, converter):
+        with self._lock:
+            return self._timestamp(converter) is not None
+
+    @property
+    def dirty(self):
+        return bool(self._updated or self._removed)
+
+    def save(self):
+        """Writes the snapshot file if the store changed since it was loaded or saved.
+
+        Returns:
+            bool -- Whether the file was written
+        """
+        if self.path is None:
+            return False
+
+        with self._save_lock:
+            return self._save()
+
+    def _save(self):
+        with self._lock:
+            if not self.dirty:
+                return False
+
+            entries = [(converter, self._timestamp(converter), self._get(converter)) for converter in self._converters()]
+            generation = self.generation + 1
+            updated    = dict(self._updated)
+            removed    = set(self._removed)
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(self._encode(entries, generation))
+            fh.flush()
+            os.fsync(fh.fileno())
+
+        os.replace(tmp_path, self.path)
+        mapped = _MappedSnapshot(self.path)
+
+        with self._lock:
+            # Keep what was updated meanwhile, and the SlotInfo objects of what was saved
+            for converter, (timestamp, slot_info) in updated.items():
+                if self._updated.get(converter, (None, None))[1] is slot_info:
+                    del self._updated[converter]
+                    self._decoded[converter] = slot_info
+
+            self._removed  -= removed
+            self._replace_mapped(mapped)
+            self.generation = generation
+            self.saves     += 1
+
+        self._logger.debug(f"SLOT_INFO snapshot {self.path} saved: {len(entries)} converters, generation {generation}")
+        return True
+
+    def close(self):
+        with self._lock:
+            self._replace_mapped(None)
+
+    def stats(self):
+        with self._lock:
+            return {"converters" : sum(1 for _ in self._converters()),
+                    "generation" : self.generation,
+                    "pending"    : len(self._updated) + len(self._removed),
+                    "updates"    : self.updates,
+                    "saves"      : self.saves}
+
+    def _replace_mapped(self, mapped):
+        # Called with the lock held. Decoded SlotInfos stay valid: they do not refer to the map
+        if self._mapped is not None:
+            self._mapped.close()
+
+        self._mapped = mapped
+        if mapped is None:
+            self._decoded = {converter: slot_info for converter, slot_info in self._decoded.items() if converter in self._updated}
+
+        else:
+            self._decoded = {converter: slot_info for converter, slot_info in self._decoded.items() if converter in mapped.converters}
+
+    def _converters(self):
+        # Called with the lock held
+        yield from self._updated
+        if self._mapped is not None:
+            for converter in self._mapped.converters:
+                if converter not in self._updated and converter not in self._removed:
+                    yield converter
+
+    def _get(self, converter):
+        # Called with the lock held
+        try:
+            return self._updated[converter][1]
+
+        except KeyError:
+            pass
+
+        if converter in self._removed or self._mapped is None:
+            return None
+
+        try:
+            return self._decoded[converter]
+
+        except KeyError:
+            pass
+
+        try:
+            i = self._mapped.converters[converter]
+
+        except KeyError:
+            return None
+
+        slot_info = self._decoded[converter] = self._mapped.slot_info(i)
+        return slot_info
+
+    def _timestamp(self, converter):
+        # Called with the lock held
+        try:
+            return self._updated[converter][0]
+
+        except KeyError:
+            pass
+
+        if converter in self._removed or self._mapped is None:
+            return None
+
+        try:
+            return self._mapped.timestamps[self._mapped.converters[converter]]
+
+        except KeyError:
+            return None
+
+    @staticmethod
+    def _encode(entries, generation):
+        string_ids = {"": _EMPTY}
+        def string_id(string):
+            try:
+                return string_ids[string]
+
+            except KeyError:
+                string_ids[string] = len(string_ids)
+                return string_ids[string]
+
+        timestamps  = array("d")
+        names       = array("I")
+        row_offsets = array("I", [0])
+        columns     = [array("I") for _ in ROW_COLUMNS]
+        for converter, timestamp, slot_info in entries:
+            timestamps.append(timestamp)
+            names.append(string_id(converter))
+            for board in slot_info:
+                for device in board.devices or [Device("", "", "", "")]:
+                    for column, value in zip(columns, (board.SLOT, board.BOARD, board.STATE) + tuple(device)):
+                        column.append(string_id(value))
+
+            row_offsets.append(len(columns[0]))
+
+        encoded        = [string.encode() for string in string_ids]
+        string_offsets = array("I", [0])
+        for string in encoded:
+            string_offsets.append(string_offsets[-1] + len(string))
+
+        blob = b"".join(encoded)
+        body = b"".join([_to_bytes(string_offsets), blob, bytes(_padding(len(blob))),
+                         _to_bytes(timestamps), _to_bytes(names), _to_bytes(row_offsets)]
+                        + [_to_bytes(column) for column in columns])
+
+        header = _HEADER.pack(MAGIC, FORMAT_VERSION, generation, zlib.crc32(body), len(string_ids), len(entries), len(columns[0]))
+        return header + bytes(_padding(len(header))) + body
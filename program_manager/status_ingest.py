@@ -0,0 +1,119 @@
+"""Incremental ingestion of the status server replies.
+
+The status server publishes the status of every FGC, per gateway, every few
+seconds. StatusIngester keeps the set of devices flagging SYNC_REGFGC3 and,
+on every reply, only looks into the gateways whose recv_time_sec changed.
+Only the devices that started flagging SYNC_REGFGC3 are reported, except
+every full_resync_sec, when all of them are reported again so that devices
+whose job finished without clearing the flag are retried.
+"""
+
+import logging
+import re
+import time
+
+import pyfgc_name
+
+SYNC_FLAG                = "SYNC_REGFGC3"
+STATUS_SRV_REFRESH_SEC   = 5
+FULL_RESYNC_SEC          = 60
+FLAGS_CACHE_MAX_ENTRIES  = 4096
+
+_FLAG_SEPARATOR_REGEX = re.compile(r"[\s,|]+")
+
+class _SyncFlagCache(dict):
+    # ST_UNLATCHED -> whether SYNC_REGFGC3 is set. Few distinct flag
+    # combinations exist, so each of them is parsed once
+    def __missing__(self, st_unlatched):
+        if len(self) >= FLAGS_CACHE_MAX_ENTRIES:
+            self.clear()
+
+        is_sync = SYNC_FLAG in _FLAG_SEPARATOR_REGEX.split(st_unlatched)
+        self[st_unlatched] = is_sync
+        return is_sync
+
+def area_from_name_file(device):
+    """Area (first group of the gateway) of a device, None if unknown."""
+    try:
+        return pyfgc_name.gateways[pyfgc_name.devices[device]["gateway"]]["groups"][0]
+
+    except (KeyError, IndexError):
+        return None
+
+class StatusIngester:
+    def __init__(self, area_of=area_from_name_file, full_resync_sec=FULL_RESYNC_SEC,
+                 refresh_sec=STATUS_SRV_REFRESH_SEC, clock=time.time):
+        self.full_resync_sec = full_resync_sec
+        self.refresh_sec     = refresh_sec
+        self._area_of        = area_of
+        self._clock          = clock
+
+        # gateway -> last recv_time_sec; gateway -> devices flagging SYNC_REGFGC3
+        self._recv_times     = dict()
+        self._sync_per_gw    = dict()
+        self._areas          = dict()
+        self._is_sync        = _SyncFlagCache()
+        self._last_resync    = None
+        self._logger         = logging.getLogger("pm_main." + __name__)
+
+        self.gateways_parsed  = 0
+        self.gateways_skipped = 0
+
+    def ingest(self, status_rsp):
+        """Updates the SYNC devices with a status server reply.
+
+        Returns:
+            list -- (device, area) of the devices to program
+        """
+        now = self._clock()
+        full_resync = self._last_resync is None or now - self._last_resync >= self.full_resync_sec
+        if full_resync:
+            self._recv_times.clear()
+            self._last_resync = now
+
+        new_sync = set()
+        is_sync  = self._is_sync
+        for gw in set(self._sync_per_gw) - set(status_rsp):
+            self._forget_gateway(gw)
+
+        for gw, gw_status in status_rsp.items():
+            recv_time = gw_status["recv_time_sec"]
+            if recv_time < now - self.refresh_sec * 2:
+                self._forget_gateway(gw)
+                continue
+
+            if self._recv_times.get(gw) == recv_time:
+                self.gateways_skipped += 1
+                continue
+
+            self.gateways_parsed += 1
+            self._recv_times[gw] = recv_time
+
+            sync = {dev for dev, dev_status in gw_status["devices"].items() if is_sync[dev_status.get("ST_UNLATCHED", "")]}
+
+            new_sync |= sync - self._sync_per_gw.get(gw, set())
+            self._sync_per_gw[gw] = sync
+
+        to_program = self.sync_devices if full_resync else new_sync
+        return [(dev, area) for dev, area in ((dev, self._area(dev)) for dev in to_program) if area is not None]
+
+    @property
+    def sync_devices(self):
+        return set().union(*self._sync_per_gw.values())
+
+    def reload_names(self):
+        """Forgets the cached areas, to be called after re-reading the name file."""
+        self._areas.clear()
+
+    def _forget_gateway(self, gw):
+        self._recv_times.pop(gw, None)
+        self._sync_per_gw.pop(gw, None)
+
+    def _area(self, dev):
+        try:
+            return self._areas[dev]
+
+        except KeyError:
+            area = self._area_of(dev)
+            self._areas[dev] = area
+            return area
@@ -0,0 +1,135 @@
+"""Per-job traces of the programming work.
+
+Every job queued in an AreaProgramManager carries a JobTrace. The server,
+workers, programmer and FSM add spans to it (time queued, connection, every
+interim FSM state, every programming attempt...), and the finished trace is
+written as one JSON line to a rotating local file. utils/trace_summary.py
+summarises those files into per-span percentiles.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from logging    import handlers
+
+TRACE_FILE_MAX_BYTES    = 10000000
+TRACE_FILE_BACKUP_COUNT = 10
+
+_local = threading.local()
+
+class Span:
+    __slots__ = ("name", "start", "duration", "attrs", "_start_mono")
+
+    def __init__(self, name, attrs):
+        self.name        = name
+        self.start       = time.time()
+        self.duration    = None
+        self.attrs       = attrs
+        self._start_mono = time.monotonic()
+
+    def end(self, **attrs):
+        self.duration = time.monotonic() - self._start_mono
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {"name": self.name, "start": self.start, "duration": self.duration, "attrs": self.attrs}
+
+class JobTrace:
+    def __init__(self, job_name, tracer=None, **attrs):
+        self.job_name  = job_name
+        self.trace_id  = uuid.uuid4().hex
+        self.attrs     = attrs
+        self.spans     = list()
+        self._open     = dict()
+        self._tracer   = tracer
+        self._lock     = threading.Lock()
+
+    def start_span(self, name, **attrs):
+        span = Span(name, attrs)
+        with self._lock:
+            self.spans.append(span)
+            self._open[name] = span
+
+        return span
+
+    def end_span(self, name, **attrs):
+        with self._lock:
+            span = self._open.pop(name, None)
+
+        if span is not None:
+            span.end(**attrs)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Context manager timing a span. An exception is recorded in the span's attributes."""
+        span = self.start_span(name, **attrs)
+        try:
+            yield span
+
+        except Exception as e:
+            span.attrs["error"] = f"{e}"
+            raise
+
+        finally:
+            self.end_span(name)
+
+    def finish(self, **attrs):
+        """Closes the spans left open and writes the trace."""
+        self.attrs.update(attrs)
+        for name in list(self._open):
+            self.end_span(name)
+
+        if self._tracer is not None:
+            self._tracer.write(self)
+
+    def to_dict(self):
+        return {"trace_id": self.trace_id,
+                "job"     : self.job_name,
+                "attrs"   : self.attrs,
+                "spans"   : [span.to_dict() for span in self.spans]}
+
+class Tracer:
+    """Creates job traces and writes the finished ones to a rotating JSONL file.
+
+    Without trace_file traces are still built but not written.
+    """
+    def __init__(self, trace_file=None, max_bytes=TRACE_FILE_MAX_BYTES, backup_count=TRACE_FILE_BACKUP_COUNT):
+        self.trace_file   = trace_file
+        self._trace_log   = None
+
+        if trace_file:
+            self._trace_log = logging.getLogger(f"pm_trace.{id(self)}")
+            self._trace_log.setLevel(logging.INFO)
+            self._trace_log.propagate = False
+
+            fh = handlers.RotatingFileHandler(trace_file, maxBytes=max_bytes, backupCount=backup_count)
+            fh.setFormatter(logging.Formatter("%(message)s"))
+            self._trace_log.addHandler(fh)
+
+    def new_trace(self, job_name, **attrs):
+        return JobTrace(job_name, self, **attrs)
+
+    def write(self, trace):
+        if self._trace_log is not None:
+            self._trace_log.info(json.dumps(trace.to_dict()))
+
+    def close(self):
+        if self._trace_log is not None:
+            for handler in list(self._trace_log.handlers):
+                handler.close()
+                self._trace_log.removeHandler(handler)
+
+def set_current_trace(trace):
+    """Sets the trace of the job running in the calling thread."""
+    _local.trace = trace
+
+def current_trace():
+    """Returns the trace of the job running in the calling thread.
+
+    Outside of a traced job a detached trace is returned, so callers can add
+    spans unconditionally.
+    """
+    return getattr(_local, "trace", None) or JobTrace("")
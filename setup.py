@@ -12,6 +12,7 @@ setuptools.setup(
   url              = "https://gitlab.cern.ch/ccs/fgc/tree/master/sw/clients/python/program_manager",
   python_requires  = ">=3.6",
   install_requires = ["pyfgc>=1.1", "pyfgc_statussrv>=1.0", "docopt>=0.6", "termcolor>=1.1"],
+  extras_require   = {"db": ["sqlalchemy>=1.4"]},
   packages         = setuptools.find_packages(),
-  data_files       = [("program_manager", ["data/pm_config.cfg"])]
+  data_files       = [("program_manager", ["data/pm_config.cfg", "data/program_detected_firmware.sql"])]
 )
@@ -0,0 +1,396 @@
+"""Micro-benchmarks of the program manager hot paths.
+
+Every benchmark is timed in rounds of `number` calls, `number` being chosen so
+that a round lasts at least MIN_ROUND_SEC. The per call min, median, mean and
+standard deviation are saved as JSON. With --compare, the medians are checked
+against a baseline saved by a previous run and any benchmark slower than the
+baseline by more than the threshold is reported as a regression (exit code 1).
+
+Usage:
+    python tests/benchmarks/run_benchmarks.py [--quick] [-k <substring>] [-o <results.json>]
+                                              [--compare <baseline.json>] [--threshold <ratio>]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import program_manager.regfgc3_programmer as programmer
+from program_manager.adapters import Adapter, FileSystemAdapter
+from program_manager.area_worker import AreaProgramManager
+from program_manager.async_fsm import AsyncProgrammingEngine
+from program_manager.fgc_simulator import SimulatedFleet, scaled_poll_schedules
+from program_manager.fw_payload import payload_cache
+from program_manager.pm_fsm import PmStateTransferring
+from program_manager.planner import Planner
+from program_manager.pm_server import STATUS_SRV_REFRESH_SEC
+from program_manager.regfgc3_programmer import DEVICES_LIST, parse_slot_info
+from program_manager.scheduler import WorkScheduler
+from program_manager.slot_snapshot import SlotInfoStore
+from program_manager.status_ingest import StatusIngester
+
+ROUNDS            = 7
+QUICK_ROUNDS      = 3
+MIN_ROUND_SEC     = 0.05
+DEFAULT_THRESHOLD = 0.2
+
+FW_SIZES             = (256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+SLOTS_PER_CRATE      = 20
+DEVICES_PER_SLOT     = 6
+STATUS_DEVICES       = 10000
+DEVICES_PER_GW       = 40
+SYNC_RATIO           = 0.01
+EXPECTED_FILES       = 5000
+EXPECTED_LOOKUPS     = 100
+AREA_JOBS            = AreaProgramManager.MAX_NUM_TASKS
+FLEET_CONVERTERS     = 1000
+OUTDATED_RATIO       = 0.01
+FLEET_LATENCY_SCALE  = 0.005
+
+_BENCHMARKS = list()
+
+def benchmark(name, quick=True):
+    """Registers a benchmark. The decorated function gets a temporary folder and
+    returns the function to time, called without arguments."""
+    def register(setup):
+        _BENCHMARKS.append((name, setup, quick))
+        return setup
+
+    return register
+
+def _transfer_setup(size):
+    def setup(tmp_dir):
+        fw_file_loc = os.path.join(tmp_dir, f"EDA_2261-MF-IGBT_34-208-208-B58C_{size}.bin")
+        with open(fw_file_loc, "wb") as fwh:
+            fwh.write(os.urandom(size))
+
+        kwargs = dict(slot="5", device="MF", variant="IGBT_34", var_revision="208", api_revision="208",
+                      bin_crc="B58C", fw_file_loc=fw_file_loc)
+
+        def encode():
+            # Cold cache: measures the encoding, not the cache hit
+            payload_cache.clear()
+            _, chunks = PmStateTransferring.prepare_transfer(**kwargs)
+            for _ in chunks:
+                pass
+
+        return encode
+
+    return setup
+
+for _size in FW_SIZES:
+    benchmark(f"transfer_encoding[{_size // 1024}KiB]", quick=_size == FW_SIZES[0])(_transfer_setup(_size))
+
+def crate_reply(slots=SLOTS_PER_CRATE, devices=DEVICES_PER_SLOT, converter=None):
+    """SLOT_INFO reply of a full crate. Given a converter index, the revisions vary between converters and slots."""
+    fields = list()
+    for slot in range(1, slots + 1):
+        fields += ["------------------------------", f"SLOT       {slot}", f"BOARD       VS_BOARD_{slot}", "STATE      ProductionBoot"]
+        var_revision = 208 if converter is None else 200 + (converter + slot) % 8
+        for device in ["DB", "MF"] + [f"DEVICE_{i}" for i in range(2, devices)]:
+            fields += [f"Device     {device}", "Variant    4", f"Var_Rev    {var_revision}", "API_Rev    200", ""]
+
+    return ",".join(fields)
+
+@benchmark("parse_slot_info[full_crate]")
+def _parse_slot_info_setup(tmp_dir):
+    reply = crate_reply()
+    return lambda: parse_slot_info(reply)
+
+def status_reply(num_devices=STATUS_DEVICES, now=None):
+    """Status server reply, and the name map of its devices (devices and gateways, as in pyfgc_name).
+
+    The name map is local: pyfgc_name itself is left alone.
+    """
+    rng   = random.Random(0)
+    now   = now or time.time()
+    rsp   = dict()
+    names = types.SimpleNamespace(devices=dict(), gateways=dict())
+    for i in range(num_devices):
+        gw  = f"CFC-GW-{i // DEVICES_PER_GW}"
+        dev = f"RPZES.{i}.ETH1"
+        if gw not in rsp:
+            rsp[gw] = {"recv_time_sec": now, "devices": dict()}
+
+        rsp[gw]["devices"][dev] = {"ST_UNLATCHED": "PC_PERMIT FGC_STATE_OK" + (" SYNC_REGFGC3" if rng.random() < SYNC_RATIO else "")}
+        names.devices[dev] = {"gateway": gw}
+        names.gateways[gw] = {"groups": [f"AREA{i % 10}"]}
+
+    return rsp, names
+
+def area_of(names):
+    """Area lookup of a name map, as status_ingest.area_from_name_file does with pyfgc_name."""
+    return lambda device: names.gateways[names.devices[device]["gateway"]]["groups"][0]
+
+def filter_jobs(status_rsp, names):
+    """Legacy status filtering of ProgramManagerServer, before StatusIngester.
+
+    It scanned every device of every fresh gateway, each status server cycle.
+    Kept as the reference the ingester is measured against; names stands for pyfgc_name.
+    """
+    for gw in status_rsp.keys():
+        if status_rsp[gw]["recv_time_sec"] >= (time.time() - (STATUS_SRV_REFRESH_SEC * 2)):
+            for dev in status_rsp[gw]["devices"].keys():
+                try:
+                    if "SYNC_REGFGC3" in status_rsp[gw]["devices"][dev]["ST_UNLATCHED"]:
+                        device_obj = names.devices[dev]
+                        yield dev, names.gateways[device_obj["gateway"]]["groups"][0]
+
+                except KeyError:
+                    pass
+
+@benchmark(f"filter_jobs[{STATUS_DEVICES}_devices]")
+def _filter_jobs_setup(tmp_dir):
+    rsp, names = status_reply()
+    return lambda: list(filter_jobs(rsp, names))
+
+@benchmark(f"status_ingest[{STATUS_DEVICES}_devices]")
+def _status_ingest_setup(tmp_dir):
+    rsp, names = status_reply()
+    ingester   = StatusIngester(area_of=area_of(names), full_resync_sec=0)
+    return lambda: ingester.ingest(rsp)
+
+def write_expected_files(db_folder, num_files=EXPECTED_FILES):
+    os.makedirs(db_folder, exist_ok=True)
+    converters = list()
+    for i in range(num_files):
+        converter = f"RPZES.{i}.ETH1"
+        with open(os.path.join(db_folder, converter), "w") as efh:
+            efh.write("# slot,board,device,variant,var_revision,api_revision\n")
+            for slot in range(1, SLOTS_PER_CRATE + 1):
+                efh.write(f"{slot},VS_BOARD_{slot},MF,IGBT_34,208,208\n")
+
+        converters.append(converter)
+
+    return converters
+
+@benchmark(f"fs_get_expected[{EXPECTED_FILES}_files]")
+def _fs_get_expected_setup(tmp_dir):
+    converters = write_expected_files(os.path.join(tmp_dir, "DB"))
+    adapter    = FileSystemAdapter("FW", "DB", tmp_dir)
+    lookups    = random.Random(0).sample(converters, EXPECTED_LOOKUPS)
+
+    def get_expected():
+        for converter in lookups:
+            adapter.get_expected(converter)
+
+    return get_expected
+
+@benchmark("fs_parse_expected_file")
+def _fs_parse_expected_file_setup(tmp_dir):
+    converter = write_expected_files(os.path.join(tmp_dir, "DB"), num_files=1)[0]
+    adapter   = FileSystemAdapter("FW", "DB", tmp_dir)
+    path      = os.path.join(tmp_dir, "DB", converter)
+    return lambda: adapter._parse_expected_file(path)
+
+@benchmark(f"area_enqueue_dequeue[{AREA_JOBS}_jobs]")
+def _area_enqueue_dequeue_setup(tmp_dir):
+    # No workers: the jobs are taken and run by the benchmark itself
+    area     = AreaProgramManager("BENCH", scheduler=WorkScheduler(max_workers=0))
+    names    = [f"RPZES.{i}.ETH1" for i in range(AREA_JOBS)]
+    accept   = lambda job: True
+    no_op    = lambda logger, job_name: None
+    logger   = area._logger
+
+    def enqueue_dequeue():
+        for name in names:
+            area.add_job(no_op, name)
+
+        job = area.tasks.get_first(accept)
+        while job is not None:
+            area.run_job(job, "bench", logger)
+            job = area.tasks.get_first(accept)
+
+    return enqueue_dequeue
+
+@benchmark(f"planner[{FLEET_CONVERTERS}_converters]")
+def _planner_setup(tmp_dir):
+    # Cold pass: every converter is planned, 1% of the slots have an outdated MF
+    rng        = random.Random(0)
+    fw_entry   = types.SimpleNamespace(bin_crc="B58C", path="/fw/MF-4-208-200-B58C.bin")
+    slot_info  = parse_slot_info(crate_reply())
+    slot_infos = {f"RPZES.{i}.ETH1": slot_info for i in range(FLEET_CONVERTERS)}
+    expected   = dict()
+    for converter in slot_infos:
+        expected[converter] = {str(slot): {"board": f"VS_BOARD_{slot}", "devices": {device: Adapter.Device(device, "4", "208", "200") for device in DEVICES_LIST}}
+                               for slot in range(1, SLOTS_PER_CRATE + 1)}
+        for slot in expected[converter].values():
+            if rng.random() < OUTDATED_RATIO:
+                slot["devices"]["MF"] = Adapter.Device("MF", "4", "209", "200")
+
+    fw_lookup = lambda device, variant, var_revision, api_revision: fw_entry
+    return lambda: Planner(fw_lookup).plan(slot_infos, expected.__getitem__)
+
+@benchmark(f"slot_snapshot_load[{FLEET_CONVERTERS}_converters]")
+def _slot_snapshot_load_setup(tmp_dir):
+    # Startup: map the snapshot and decode the SlotInfo of every converter
+    path  = os.path.join(tmp_dir, "slot_info.snapshot")
+    store = SlotInfoStore(path)
+    for i in range(FLEET_CONVERTERS):
+        store.update(f"RPZES.{i}.ETH1", crate_reply(converter=i))
+
+    store.save()
+    store.close()
+
+    def load():
+        store = SlotInfoStore(path)
+        store.load()
+        store.slot_infos()
+        store.close()
+
+    return load
+
+def _fleet_setup(tmp_dir):
+    # Returns a function building a fleet of simulated FGCs needing all their MF reprogrammed
+    fw_files = SimulatedFleet(0).write_firmware(os.path.join(tmp_dir, "FW"))
+
+    def new_fleet():
+        fleet = SimulatedFleet(FLEET_CONVERTERS, latency_scale=FLEET_LATENCY_SCALE, seed=0)
+        fleet.fw_files.update(fw_files)
+        return fleet, {converter: fleet.pending_devices(converter) for converter in fleet.fgcs}
+
+    return new_fleet
+
+@benchmark(f"reprogram_thread_pool[{FLEET_CONVERTERS}_converters]", quick=False)
+def _reprogram_thread_pool_setup(tmp_dir):
+    # One blocked worker thread per crate in flight, as many as an area has workers
+    new_fleet      = _fleet_setup(tmp_dir)
+    poll_schedules = scaled_poll_schedules(FLEET_LATENCY_SCALE)
+
+    def reprogram():
+        fleet, crates = new_fleet()
+        with ThreadPoolExecutor(max_workers=AreaProgramManager.MAX_NUM_WORKERS) as pool:
+            list(pool.map(lambda converter: programmer.program_crate(converter, crates[converter], fleet.connect(converter), poll_schedules=poll_schedules),
+                          crates))
+
+    return reprogram
+
+@benchmark(f"reprogram_event_loop[{FLEET_CONVERTERS}_converters]", quick=False)
+def _reprogram_event_loop_setup(tmp_dir):
+    # All the crates in flight on one event loop
+    new_fleet      = _fleet_setup(tmp_dir)
+    poll_schedules = scaled_poll_schedules(FLEET_LATENCY_SCALE)
+
+    def reprogram():
+        fleet, crates = new_fleet()
+        engine = AsyncProgrammingEngine(fleet.connect_async, max_concurrency=FLEET_CONVERTERS, poll_schedules=poll_schedules)
+        asyncio.run(engine.run(crates))
+
+    return reprogram
+
+def _time(func, rounds):
+    func()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_ROUND_SEC:
+            break
+
+        number *= 2
+
+    times = [elapsed / number]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+
+        times.append((time.perf_counter() - start) / number)
+
+    return {"min"    : min(times),
+            "median" : statistics.median(times),
+            "mean"   : statistics.mean(times),
+            "stdev"  : statistics.stdev(times) if len(times) > 1 else 0.0,
+            "rounds" : rounds,
+            "number" : number}
+
+def run(quick=False, select=None):
+    """Runs the benchmarks whose name contains select. Returns the results as saved in JSON."""
+    results = dict()
+    for name, setup, in_quick in _BENCHMARKS:
+        if (quick and not in_quick) or (select and select not in name):
+            continue
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results[name] = _time(setup(tmp_dir), QUICK_ROUNDS if quick else ROUNDS)
+
+    return {"meta"    : {"python"    : platform.python_version(),
+                         "platform"  : platform.platform(),
+                         "machine"   : platform.node(),
+                         "timestamp" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+                         "quick"     : quick},
+            "results" : results}
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compares the medians of two runs.
+
+    Returns:
+        list -- (name, baseline median, current median, ratio, regressed) of
+                the benchmarks present in both runs
+    """
+    rows = list()
+    for name, current in results["results"].items():
+        try:
+            previous = baseline["results"][name]
+
+        except KeyError:
+            continue
+
+        ratio = current["median"] / previous["median"]
+        rows.append((name, previous["median"], current["median"], ratio, ratio > 1 + threshold))
+
+    return rows
+
+def _format_time(seconds):
+    for unit, factor in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= factor:
+            return f"{seconds / factor:8.2f} {unit}"
+
+    return f"{seconds / 1e-9:8.2f} ns"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the program manager hot paths")
+    parser.add_argument("--quick", action="store_true", help="fewer rounds, smallest payload only")
+    parser.add_argument("-k", dest="select", help="only run benchmarks whose name contains this substring")
+    parser.add_argument("-o", "--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare the results with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="tolerated slowdown ratio [default: %(default)s]")
+    args = parser.parse_args(argv)
+
+    results = run(args.quick, args.select)
+    for name, timing in results["results"].items():
+        print(f"{name:40s} median {_format_time(timing['median'])}  min {_format_time(timing['min'])}  "
+              f"(+/- {_format_time(timing['stdev'])}, {timing['rounds']} x {timing['number']})")
+
+    if args.output:
+        with open(args.output, "w") as rfh:
+            json.dump(results, rfh, indent=2)
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare, "r") as bfh:
+        baseline = json.load(bfh)
+
+    regressions = 0
+    print(f"\nComparison with {args.compare} (threshold {args.threshold:.0%}):")
+    for name, previous, current, ratio, regressed in compare(results, baseline, args.threshold):
+        regressions += regressed
+        print(f"{name:40s} {_format_time(previous)} -> {_format_time(current)}  x{ratio:5.2f}  {'REGRESSION' if regressed else 'ok'}")
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,13 @@
+import types
+
+import pytest
+
+import program_manager.pm_fsm as pm_fsm
+from fakes import FakeClock
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """FakeClock standing for the time of pm_fsm: polling and transfer delays take no time."""
+    clock = FakeClock()
+    monkeypatch.setattr(pm_fsm, "time", types.SimpleNamespace(sleep=clock.sleep, monotonic=clock.monotonic))
+    return clock
@@ -0,0 +1,80 @@
+"""Fakes shared by the tests: a clock moved by hand and an FGC session."""
+
+import types
+
+import program_manager.pm_fsm as pm_fsm
+
+SLOT_INFO = ("------------------------------,"
+             "SLOT       5,BOARD       VS_STATE_CTRL,STATE      ProductionBoot,"
+             "Device     MF,Variant    4,Var_Rev    208,API_Rev    208,,")
+
+class FakeClock:
+    """Clock only moved by sleep or by setting now. Called, it returns now, as time.monotonic."""
+    def __init__(self, now=0.0):
+        self.now   = now
+        self.slept = list()
+
+    def __call__(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class FakeFgcSession:
+    """FGC moving one interim state forward each time the mode is set, recording the modes it was given.
+
+    With states, a list of (time, state), the FSM state is the last one reached at clock.now instead.
+    """
+    TRANSITIONS = dict(pm_fsm.ProgramManagerFsm.STATE_TO_MODE_TO_INTERIM_STATES)
+    TRANSITIONS["PROGRAMMED"] = dict(TRANSITIONS["PROGRAMMED"], **pm_fsm.ProgramManagerFsm.STATE_TO_MODE_TO_INTERIM_STATES_NO_PROD_BOOT["PROGRAMMED"])
+
+    def __init__(self, failing_device=None, clock=None, states=None):
+        self.modes          = list()
+        self.booted_by      = list()
+        self.slot_rescans   = 0
+        self.disconnected   = False
+        self.failing_device = failing_device
+        self._clock         = clock
+        self._states        = states
+        self._device        = None
+        self._mode          = None
+        self._path          = list()
+        self._state         = "UNINITIALIZED"
+
+    def get(self, prop):
+        state = self._state
+        if self._states is not None:
+            state = [state for reached_t, state in self._states if reached_t <= self._clock.now][-1]
+
+        values = {"REGFGC3.PROG.FSM.STATE": state, "REGFGC3.SLOT_INFO": SLOT_INFO}
+        return types.SimpleNamespace(value=values.get(prop, ""))
+
+    def set(self, prop, value):
+        if prop == "REGFGC3.SLOT_INFO":
+            self.slot_rescans += 1
+
+        if prop == "REGFGC3.PROG.DEVICE":
+            self._device = value
+
+        if prop != "REGFGC3.PROG.FSM.MODE":
+            return
+
+        if value != self._mode:
+            self._mode = value
+            self.modes.append(value)
+            self._path = [s(None).name for s in self.TRANSITIONS[self._state][value]]
+            if value == "TO_PROD_BOOT":
+                self.booted_by.append(self._device)
+
+        if self._path:
+            self._state = self._path.pop(0)
+            if self._state == "PROGRAMMING" and self._device == self.failing_device:
+                self._state = "ERROR"
+                self._path  = list()
+
+    def disconnect(self):
+        self.disconnected = True
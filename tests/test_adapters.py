@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from program_manager.adapters import Adapter, FileSystemAdapter, LocalFileSystemAdapter
+from program_manager.recorder import DetectedRecord
+
+EXPECTED = ("# slot,board,device,variant,var_revision,api_revision\n"
+            "5,VS_STATE_CTRL,MF,IGBT_34,208,208\n"
+            "5,VS_STATE_CTRL,DB,DB_3,208,200\n"
+            "6,VS_REG_DSP,MF,DSP_2,105,208\n")
+
+def write(path, contents, mtime_ns=None):
+    path.write_text(contents)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+@pytest.fixture
+def db_folder(tmp_path):
+    db_folder = tmp_path / "DB"
+    db_folder.mkdir()
+    for i in range(3):
+        write(db_folder / f"RPZES.{i}.ETH1", EXPECTED)
+
+    return db_folder
+
+def test_expected_data_is_parsed(db_folder):
+    adapter  = FileSystemAdapter("FW", "DB", str(db_folder.parent))
+    expected = adapter.get_expected("RPZES.0.ETH1")
+
+    assert expected["5"]["board"] == "VS_STATE_CTRL"
+    assert expected["5"]["devices"]["MF"] == Adapter.Device("MF", "IGBT_34", "208", "208")
+    assert list(expected["6"]["devices"]) == ["MF"]
+
+def test_expected_data_is_cached_and_always_returned(db_folder):
+    adapter = FileSystemAdapter("FW", "DB", str(db_folder.parent))
+    first   = adapter.get_expected("RPZES.1.ETH1")
+
+    for _ in range(10):
+        assert adapter.get_expected("RPZES.1.ETH1") is first
+
+    for i in range(3):
+        adapter.get_expected(f"RPZES.{i}.ETH1")
+
+    assert adapter.stats() == {"converters": 3, "cached": 3, "index_scans": 1, "parses": 3, "hits": 11}
+
+def test_modified_file_is_parsed_again(db_folder):
+    adapter = FileSystemAdapter("FW", "DB", str(db_folder.parent))
+    path    = db_folder / "RPZES.0.ETH1"
+    adapter.get_expected("RPZES.0.ETH1")
+
+    write(path, EXPECTED.replace("IGBT_34,208", "IGBT_34,209"), mtime_ns=os.stat(path).st_mtime_ns + 10**9)
+
+    assert adapter.get_expected("RPZES.0.ETH1")["5"]["devices"]["MF"].Var_Rev == "209"
+    assert adapter.stats()["index_scans"] == 1
+
+def test_index_follows_added_and_removed_files(db_folder):
+    adapter  = FileSystemAdapter("FW", "DB", str(db_folder.parent))
+    dir_time = os.stat(db_folder).st_mtime_ns
+    with pytest.raises(FileNotFoundError):
+        adapter.get_expected("RPZES.9.ETH1")
+
+    write(db_folder / "RPZES.9.ETH1", EXPECTED)
+    os.remove(db_folder / "RPZES.0.ETH1")
+    os.utime(db_folder, ns=(dir_time + 10**9, dir_time + 10**9))
+
+    assert adapter.get_expected("RPZES.9.ETH1")["6"]["board"] == "VS_REG_DSP"
+    with pytest.raises(FileNotFoundError):
+        adapter.get_expected("RPZES.0.ETH1")
+
+    assert adapter.stats()["index_scans"] == 2
+
+def test_local_adapter_records_only_with_a_file(tmp_path):
+    records = [DetectedRecord("RPZES.0.ETH1", 0.0, None, "ok")]
+    LocalFileSystemAdapter().record_detected(records)
+
+    inserted = tmp_path / "inserted.jsonl"
+    LocalFileSystemAdapter(inserted_data=str(inserted)).record_detected(records)
+    assert '"converter": "RPZES.0.ETH1"' in inserted.read_text()
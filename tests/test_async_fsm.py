@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import pytest
+
+import program_manager.async_fsm as async_fsm
+from program_manager.async_fsm import AsyncProgramManagerFsm, AsyncProgrammingEngine
+from program_manager.fgc_simulator import SimulatedAsyncFgc, SimulatedFgc, SimulatedFleet, scaled_poll_schedules
+from program_manager.gateway_limiter import GatewayLimiter
+from program_manager.job_journal import STATE_DONE, JobProgress
+from program_manager.regfgc3_programmer import parse_slot_info
+
+LATENCY_SCALE = 0.001
+POLLING       = scaled_poll_schedules(LATENCY_SCALE)
+
+class RecordingProgress(JobProgress):
+    def __init__(self, resume=None):
+        super().__init__(resume=resume)
+        self.states = list()
+
+    def state_reached(self, slot, device, state):
+        self.states.append((slot, device, state))
+
+@pytest.fixture
+def fleet(tmp_path):
+    fleet = SimulatedFleet(200, latency_scale=LATENCY_SCALE)
+    fleet.write_firmware(str(tmp_path / "FW"), size=1001)
+    return fleet
+
+def crates(fleet):
+    return {converter: fleet.pending_devices(converter) for converter in fleet.fgcs}
+
+def test_async_fsm_goes_through_all_states(fleet):
+    fgc       = SimulatedFgc("RPSIM.0000.00", latency_scale=LATENCY_SCALE)
+    prog_data = (fgc.name, *fleet.pending_devices("RPSIM.0000.00")[0])
+    pm_fsm    = AsyncProgramManagerFsm(prog_data, SimulatedAsyncFgc(fgc), poll_schedules=POLLING)
+    asyncio.run(pm_fsm.process())
+
+    assert pm_fsm.state == "WAITING"
+    assert fgc.devices_programmed == 1
+    assert parse_slot_info(fgc.slot_info())["5"].STATE == "ProductionBoot"
+
+def test_async_fsm_recovers_through_clean_up_after_error(fleet):
+    fgc       = SimulatedFgc("RPSIM.0000.00", latency_scale=LATENCY_SCALE, state_failures={"PROGRAMMING": 1.0})
+    prog_data = (fgc.name, *fleet.pending_devices("RPSIM.0000.00")[0])
+    pm_fsm    = AsyncProgramManagerFsm(prog_data, SimulatedAsyncFgc(fgc), poll_schedules=POLLING)
+    with pytest.raises(RuntimeError, match="after recovery attempt"):
+        asyncio.run(pm_fsm.process())
+
+    assert pm_fsm.state == "WAITING"
+    assert fgc.state == "WAITING"
+
+def test_async_fsm_needs_a_session(fleet):
+    with pytest.raises(RuntimeError, match="No FGC session"):
+        AsyncProgramManagerFsm(("RPSIM.0000.00", *fleet.pending_devices("RPSIM.0000.00")[0]), None)
+
+def test_engine_reprograms_many_crates_concurrently(fleet):
+    engine = AsyncProgrammingEngine(fleet.connect_async, max_concurrency=200, poll_schedules=POLLING)
+
+    start   = time.monotonic()
+    results = asyncio.run(engine.run(crates(fleet)))
+
+    assert all(attempts == 0 for crate_results, _ in results.values() for attempts in crate_results.values())
+    assert not any(fleet.pending_devices(converter) for converter in fleet.fgcs)
+    assert all(not fgc.connected for fgc in fleet.fgcs.values())
+    # A crate takes ~0.1 s; one after the other they would need 20 s
+    assert time.monotonic() - start < 10
+
+def test_engine_bounds_concurrency(fleet):
+    in_flight     = set()
+    max_in_flight = list()
+
+    class CountingSession(SimulatedAsyncFgc):
+        async def disconnect(self):
+            in_flight.discard(self.fgc.name)
+
+    async def session_factory(converter):
+        in_flight.add(converter)
+        max_in_flight.append(len(in_flight))
+        return CountingSession(fleet.connect(converter))
+
+    engine = AsyncProgrammingEngine(session_factory, max_concurrency=3, poll_schedules=POLLING)
+    asyncio.run(engine.run(dict(list(crates(fleet).items())[:10])))
+    assert max(max_in_flight) == 3
+
+def test_engine_reports_progress_and_resumes(fleet):
+    converter = "RPSIM.0000.00"
+    jobs      = fleet.pending_devices(converter)
+    engine    = AsyncProgrammingEngine(fleet.connect_async, poll_schedules=POLLING)
+
+    done     = RecordingProgress(resume={(job[0], job[2]): STATE_DONE for job in jobs})
+    results  = asyncio.run(engine.run({converter: jobs}, progress_of=lambda converter: done))
+    assert results[converter][0] == {(job[0], job[2]): 0 for job in jobs}
+    assert fleet.fgcs[converter].devices_programmed == 0
+    assert not done.states
+
+    progress = RecordingProgress()
+    asyncio.run(engine.program_crate(converter, jobs, progress))
+    assert fleet.fgcs[converter].devices_programmed == len(jobs)
+    assert ("5", "MF", "TO_PROD_BOOT") in progress.states
+    assert ("5", "MF", STATE_DONE) in progress.states
+
+def test_engine_reports_connection_failures(fleet):
+    engine = AsyncProgrammingEngine(fleet.connect_async, poll_schedules=POLLING)
+
+    results, slot_info = asyncio.run(engine.program_crate("RPSIM.UNKNOWN", [("5", "VS_STATE_CTRL", "MF", "IGBT_34", "208", "208", "0000", "")]))
+    assert results == {("5", "MF"): 3}
+    assert slot_info is None
+
+def test_transfers_wait_for_a_gateway_slot_without_blocking_the_loop(monkeypatch):
+    limiter = GatewayLimiter(max_transfers=1)
+    monkeypatch.setattr(async_fsm, "gateway_limiter", limiter)
+    monkeypatch.setattr(async_fsm, "TRANSFER_POLL_SEC", 0.001)
+
+    async def scenario():
+        held    = limiter.acquire("GW1")
+        waiting = asyncio.ensure_future(async_fsm._acquire_transfer("GW1"))
+        other   = await async_fsm._acquire_transfer("GW2")
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+
+        held.release()
+        transfer = await asyncio.wait_for(waiting, 1)
+        assert transfer.gateway == "GW1"
+        transfer.release()
+        other.release()
+
+    asyncio.run(scenario())
+    assert limiter.stats()["GW1"]["transfers"] == 2
@@ -0,0 +1,27 @@
+import json
+
+from benchmarks.run_benchmarks import compare, main, run
+
+def results(**medians):
+    return {"meta": {}, "results": {name: {"median": median} for name, median in medians.items()}}
+
+def test_compare_flags_regressions_over_threshold():
+    rows = compare(results(a=1.3, b=1.1, c=0.5, new=1.0), results(a=1.0, b=1.0, c=1.0, gone=1.0), threshold=0.2)
+
+    assert [(name, regressed) for name, *_, regressed in rows] == [("a", True), ("b", False), ("c", False)]
+
+def test_quick_run_saves_and_compares(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    assert main(["--quick", "-k", "parse_slot_info", "-o", str(baseline)]) == 0
+
+    saved = json.loads(baseline.read_text())
+    assert list(saved["results"]) == ["parse_slot_info[full_crate]"]
+    assert saved["results"]["parse_slot_info[full_crate]"]["median"] > 0
+
+    # Much slower than a baseline that was impossibly fast
+    saved["results"]["parse_slot_info[full_crate]"]["median"] = 1e-12
+    baseline.write_text(json.dumps(saved))
+    assert main(["--quick", "-k", "parse_slot_info", "--compare", str(baseline)]) == 1
+
+def test_quick_run_skips_large_payloads():
+    assert list(run(quick=True, select="transfer_encoding")["results"]) == ["transfer_encoding[256KiB]"]
@@ -0,0 +1,101 @@
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+
+from program_manager.adapters import Adapter, DbAdapter, getAdapter
+from program_manager.recorder import ROW_FIELDS, DetectedRecord
+from fakes import FakeClock
+
+ROWS = [("RPZES.1.ETH1", "VS_STATE_CTRL", "MF", "IGBT_34", "208", "208", "/fw/mf_208.bin"),
+        ("RPZES.1.ETH1", "VS_STATE_CTRL", "DB", "DB_3", "208", "200", "/fw/db_208.bin"),
+        ("RPZES.1.ETH1", "VS_REG_DSP",    "MF", "DSP_2", "105", "208", "/fw/dsp_105.bin"),
+        ("RPZES.2.ETH1", "VS_STATE_CTRL", "MF", "IGBT_34", "208", "208", "/fw/mf_208.bin")]
+
+@pytest.fixture
+def db_url(tmp_path):
+    url    = f"sqlite:///{tmp_path / 'release_info.db'}"
+    engine = sqlalchemy.create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text("create table Program_Files_Parameters_View (hcr_container text, device text, board text, component_type text, "
+                                     "variant text, variant_revision text, api_revision text, edms_location text)"))
+        insert_rows(conn, ROWS)
+        conn.execute(sqlalchemy.text(f"create table Program_Detected_Firmware ({', '.join(ROW_FIELDS)})"))
+
+    yield url
+    engine.dispose()
+
+def insert_rows(conn, rows):
+    conn.execute(sqlalchemy.text("insert into Program_Files_Parameters_View values ('HCR', :c, :b, :d, :v, :vr, :ar, :loc)"),
+                 [dict(zip(("c", "b", "d", "v", "vr", "ar", "loc"), row)) for row in rows])
+
+def make_adapter(db_url, record_table="Program_Detected_Firmware", **kwargs):
+    return DbAdapter(db_url, record_table=record_table, table="Program_Files_Parameters_View", **kwargs)
+
+def test_view_is_loaded_in_one_query(db_url):
+    adapter = make_adapter(db_url)
+
+    for _ in range(100):
+        expected = adapter.get_expected("RPZES.1.ETH1")
+
+    assert expected["VS_STATE_CTRL"]["devices"]["MF"] == Adapter.Device("MF", "IGBT_34", "208", "208")
+    assert list(expected["VS_STATE_CTRL"]["devices"]) == ["MF", "DB"]
+    assert adapter.get_expected("RPZES.2.ETH1")["VS_STATE_CTRL"]["board"] == "VS_STATE_CTRL"
+    assert adapter.stats()["queries"] == 1
+
+    with pytest.raises(KeyError):
+        adapter.get_expected("RPZES.3.ETH1")
+
+def test_view_is_refreshed_on_interval_and_on_demand(db_url):
+    clock   = FakeClock()
+    adapter = make_adapter(db_url, refresh_sec=60, clock=clock)
+    adapter.get_expected("RPZES.1.ETH1")
+
+    with sqlalchemy.create_engine(db_url).begin() as conn:
+        insert_rows(conn, [("RPZES.3.ETH1", "VS_STATE_CTRL", "MF", "IGBT_34", "209", "208", "/fw/mf_209.bin")])
+
+    clock.now = 30
+    with pytest.raises(KeyError):
+        adapter.get_expected("RPZES.3.ETH1")
+
+    clock.now = 60
+    assert adapter.get_expected("RPZES.3.ETH1")["VS_STATE_CTRL"]["devices"]["MF"].Var_Rev == "209"
+    assert adapter.refresh() == 3
+    assert adapter.stats()["queries"] == 3
+
+def test_failed_refresh_keeps_previous_data(db_url):
+    clock   = FakeClock()
+    adapter = make_adapter(db_url, refresh_sec=60, clock=clock)
+    adapter.get_expected("RPZES.1.ETH1")
+
+    adapter.table  = "Missing_View"
+    adapter._query = sqlalchemy.text("select * from Missing_View")
+    clock.now = 120
+    assert adapter.get_expected("RPZES.1.ETH1")["VS_REG_DSP"]["devices"]["MF"].Variant == "DSP_2"
+    with pytest.raises(RuntimeError):
+        adapter.refresh()
+
+def test_get_adapter_builds_db_adapter_from_config_data(db_url):
+    adapter = getAdapter("db", (db_url, "", "", "Program_Detected_Firmware"))
+
+    assert isinstance(adapter, DbAdapter)
+    assert adapter.table == DbAdapter.RELEASE_INFO_TABLE
+    assert adapter.record_table == "Program_Detected_Firmware"
+
+def test_missing_record_table_fails_at_creation(db_url):
+    with pytest.raises(RuntimeError, match="Table Program_Missing_Records of the detected firmware does not exist"):
+        make_adapter(db_url, record_table="Program_Missing_Records")
+
+    # The default table, in the Alim schema
+    with pytest.raises(RuntimeError, match=DbAdapter.RECORD_DETECTED_TABLE):
+        DbAdapter(db_url)
+
+def test_detected_records_are_inserted(db_url):
+    adapter   = make_adapter(db_url)
+    slot_info = ("------------------------------,SLOT       5,BOARD       VS_STATE_CTRL,STATE      ProductionBoot,"
+                 "Device     MF,Variant    4,Var_Rev    208,API_Rev    208,,")
+    adapter.record_detected([DetectedRecord("RPZES.1.ETH1", 1000.0, slot_info, "ok"), DetectedRecord("RPZES.2.ETH1", 1001.0, None, "error")])
+
+    with sqlalchemy.create_engine(db_url).connect() as conn:
+        rows = conn.execute(sqlalchemy.text("select converter, slot, device, var_revision, outcome from Program_Detected_Firmware")).fetchall()
+
+    assert [tuple(row) for row in rows] == [("RPZES.1.ETH1", "5", "MF", "208", "ok"), ("RPZES.2.ETH1", None, None, None, "error")]
@@ -0,0 +1,142 @@
+import pytest
+
+import pyfgc
+import program_manager.fgc_pool as fgc_pool_module
+import program_manager.regfgc3_programmer as programmer
+from program_manager.fgc_pool import FgcSessionPool
+from program_manager.fgc_simulator import SimulatedFleet, SimulatedNameIndex, scaled_poll_schedules
+from program_manager.gateway_limiter import gateway_limiter
+from program_manager.pm_server import ProgramManagerServer
+from program_manager.tracing import JobTrace, set_current_trace
+
+
+class FakeSession:
+    def __init__(self, converter):
+        self.converter = converter
+        self.closed    = False
+        self.healthy   = True
+
+    def get(self, prop):
+        if not self.healthy:
+            raise pyfgc.PyFgcError("connection lost")
+
+    def disconnect(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    opened = list()
+
+    def connect(converter):
+        opened.append(FakeSession(converter))
+        return opened[-1]
+
+    kwargs.setdefault("gateway_of", lambda converter: "CFC-GW")
+    return FgcSessionPool(connect=connect, **kwargs), opened
+
+def test_session_is_reused():
+    pool, opened = make_pool()
+
+    for _ in range(3):
+        with pool.session("RPAGM.866.21.ETH1") as fgc:
+            assert fgc is opened[0]
+
+    assert len(opened) == 1
+    assert pool.stats()["connects"] == 1
+    assert pool.stats()["reuses"] == 2
+
+def test_pyfgc_error_discards_session():
+    pool, opened = make_pool()
+
+    with pytest.raises(pyfgc.PyFgcError):
+        with pool.session("RPAGM.866.21.ETH1"):
+            raise pyfgc.PyFgcError("broken")
+
+    assert opened[0].closed
+    with pool.session("RPAGM.866.21.ETH1") as fgc:
+        assert fgc is opened[1]
+
+    assert pool.stats()["open_per_gateway"] == {"CFC-GW": 1}
+
+def test_unhealthy_session_is_replaced():
+    pool, opened = make_pool(health_check_after=0)
+
+    with pool.session("RPAGM.866.21.ETH1"):
+        pass
+
+    opened[0].healthy = False
+    with pool.session("RPAGM.866.21.ETH1") as fgc:
+        assert fgc is opened[1]
+
+    assert opened[0].closed
+    assert pool.stats()["failures"] == 1
+
+def test_gateway_cap_evicts_idle_session_of_other_converter():
+    pool, opened = make_pool(max_per_gateway=1)
+
+    with pool.session("RPAGM.866.21.ETH1"):
+        pass
+
+    with pool.session("RPAGM.866.22.ETH1") as fgc:
+        assert fgc is opened[1]
+
+    assert opened[0].closed
+    assert pool.stats()["evictions"] == 1
+    assert pool.stats()["open_per_gateway"] == {"CFC-GW": 1}
+
+def test_gateway_cap_times_out_when_all_busy():
+    pool, _ = make_pool(max_per_gateway=1)
+
+    with pool.session("RPAGM.866.21.ETH1"):
+        with pytest.raises(RuntimeError):
+            pool.acquire("RPAGM.866.22.ETH1", timeout=0.05)
+
+def test_evict_idle():
+    pool, opened = make_pool(idle_timeout=0)
+
+    with pool.session("RPAGM.866.21.ETH1"):
+        pass
+
+    pool.evict_idle()
+    assert opened[0].closed
+    assert pool.stats()["idle"] == 0
+    assert pool.stats()["open_per_gateway"] == {"CFC-GW": 0}
+
+def test_pooled_job_trace_has_connect_span(tmp_path, monkeypatch):
+    fleet = SimulatedFleet(1, latency_scale=0.001)
+    fleet.write_firmware(str(tmp_path / "FW"), size=1001)
+    monkeypatch.setattr(programmer, "fgc_pool", FgcSessionPool(connect=fleet.connect, gateway_of=fleet.converter_gateway.get))
+    converter = next(iter(fleet.fgcs))
+
+    trace = JobTrace(converter)
+    set_current_trace(trace)
+    try:
+        programmer.program_crate(converter, fleet.pending_devices(converter), poll_schedules=scaled_poll_schedules(0.001))
+
+    finally:
+        set_current_trace(None)
+
+    spans = [span.name for span in trace.spans]
+    assert spans[0] == "connect"
+    assert trace.spans[0].attrs == {"converter": converter, "reused": False}
+    assert "state.PROGRAMMING" in spans
+
+def test_server_derives_gateway_limits_and_lookup(tmp_path, monkeypatch):
+    # The server configures the shared pool and limiter, restored after the test
+    monkeypatch.setattr(fgc_pool_module.fgc_pool, "gateway_lookup", fgc_pool_module.fgc_pool.gateway_lookup)
+    monkeypatch.setattr(fgc_pool_module.fgc_pool, "max_per_gateway", fgc_pool_module.fgc_pool.max_per_gateway)
+    monkeypatch.setattr(gateway_limiter, "max_transfers", gateway_limiter.max_transfers)
+
+    fleet  = SimulatedFleet(4, converters_per_gateway=2)
+    server = ProgramManagerServer(name_file=None,
+                                  fw_repo_loc=str(tmp_path),
+                                  expected_data="fs",
+                                  db_data=None,
+                                  name_index=SimulatedNameIndex(fleet),
+                                  max_jobs_per_gateway=6)
+
+    assert fgc_pool_module.fgc_pool.max_per_gateway == 6
+    assert gateway_limiter.max_transfers == 3
+    assert fgc_pool_module.gateway_of("RPSIM.0001.00") == "cfc-sim-0001"
+    assert fgc_pool_module.gateway_of("RPSIM.UNKNOWN") == "RPSIM.UNKNOWN"
+    server.stop()
@@ -0,0 +1,96 @@
+import itertools
+import threading
+import time
+import types
+
+import pytest
+
+import program_manager.regfgc3_programmer as programmer
+from program_manager.fgc_simulator import SimulatedFgc, SimulatedFleet, SimulatedNameIndex, SimulatedStatusServer, scaled_poll_schedules
+from program_manager.pm_server import ProgramManagerServer
+from program_manager.regfgc3_programmer import parse_slot_info
+
+@pytest.fixture
+def fleet(tmp_path):
+    fleet = SimulatedFleet(1)
+    fleet.write_firmware(str(tmp_path / "FW"), size=1001)
+    return fleet
+
+def program_mf(fgc, fleet, bin_crc=None):
+    slot, board, device, variant, var_revision, api_revision, crc, fw_file_loc = fleet.pending_devices(fgc.name)[0]
+    return programmer.program(fgc.name, slot, board, device, variant, var_revision, api_revision, bin_crc or crc, fw_file_loc, fgc_session=fgc)
+
+def test_simulated_fgc_is_reprogrammed(fake_clock, fleet):
+    fgc = SimulatedFgc("RPSIM.0000.00", clock=fake_clock.monotonic)
+
+    assert program_mf(fgc, fleet) == 0
+    assert fgc.state == "WAITING"
+    slot_info = parse_slot_info(fgc.get("REGFGC3.SLOT_INFO").value)
+    assert slot_info.device("5", "MF")[1:] == ("IGBT_34", "208", "208")
+    assert slot_info["5"].STATE == "ProductionBoot"
+    assert slot_info["6"].STATE == "DownloadBoot"
+
+def test_simulated_fgc_rejects_corrupt_binary(fake_clock, fleet):
+    fgc = SimulatedFgc("RPSIM.0000.00", clock=fake_clock.monotonic)
+
+    assert program_mf(fgc, fleet, bin_crc="0000") == 3
+    assert fgc.errors == 3
+    assert fgc.get("REGFGC3.PROG.FSM.STATE").value == "WAITING"
+    assert parse_slot_info(fgc.slot_info()).device("5", "MF").Variant == "0"
+
+def test_simulated_fgc_recovers_from_injected_failure(fake_clock, fleet):
+    # Fails the first time PROGRAMMING is reached only
+    rng = types.SimpleNamespace(random=itertools.chain([0.0], itertools.repeat(0.9)).__next__)
+    fgc = SimulatedFgc("RPSIM.0000.00", clock=fake_clock.monotonic, state_failures={"PROGRAMMING": 0.5}, rng=rng)
+
+    assert program_mf(fgc, fleet) == 1
+    assert fgc.errors == 1
+    assert fgc.devices_programmed == 1
+
+def test_simulated_fgc_communication_errors():
+    fgc = SimulatedFgc("RPSIM.0000.00", comm_failure_rate=1.0)
+    with pytest.raises(Exception, match="simulated communication error"):
+        fgc.get("REGFGC3.SLOT_INFO")
+
+    fgc = SimulatedFgc("RPSIM.0000.00")
+    fgc.disconnect()
+    with pytest.raises(Exception, match="not connected"):
+        fgc.get("REGFGC3.SLOT_INFO")
+
+def test_status_server_flags_released_converters():
+    fleet      = SimulatedFleet(70, converters_per_gateway=30, gateways_per_area=2, release=False)
+    status_srv = SimulatedStatusServer(fleet)
+    names      = SimulatedNameIndex(fleet)
+    fleet.release_converter("RPSIM.0001.05")
+
+    status = status_srv.get_status_all()
+    assert len(status) == 3
+    assert names.areas == {"SIM000", "SIM001"}
+    assert names.gateway_of("RPSIM.0001.05") == "cfc-sim-0001"
+    assert [dev for gw in status.values() for dev, dev_status in gw["devices"].items() if dev_status["ST_UNLATCHED"]] == ["RPSIM.0001.05"]
+
+def test_server_reprograms_simulated_fleet(tmp_path):
+    scale = 0.001
+    fleet = SimulatedFleet(40, converters_per_gateway=5, gateways_per_area=4, latency_scale=scale)
+    fleet.write_firmware(str(tmp_path / "FW"))
+    server = ProgramManagerServer(name_file=None,
+                                  fw_repo_loc=str(tmp_path),
+                                  expected_data="fs",
+                                  db_data=None,
+                                  name_index=SimulatedNameIndex(fleet),
+                                  status_source=SimulatedStatusServer(fleet).get_status_all,
+                                  status_period=0.05,
+                                  job_func=fleet.job(scaled_poll_schedules(scale)))
+
+    server_thread = threading.Thread(target=server.start, daemon=True)
+    server_thread.start()
+    deadline = time.monotonic() + 30
+    while len(fleet.synced_at) < 40 and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    server.stop()
+    server_thread.join(5)
+
+    assert len(fleet.synced_at) == 40
+    assert fleet.stats()["devices_programmed"] == 80
+    assert not any(fleet.pending_devices(converter) for converter in fleet.fgcs)
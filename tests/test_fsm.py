@@ -1,9 +1,15 @@
+import logging
+import types
+
 import pytest
 from hypothesis import given
 from hypothesis.strategies import integers, text, tuples
 
+from program_manager.fgc_simulator import SimulatedFleet
+from program_manager.pm_fsm import PollSchedule
 from program_manager.pm_fsm import PmState, PmStateWaiting, PmStateTransferred, PmStateProgrammed, PmStateSetProdBootPars, PmStateToProdBoot, PmStateCleanUp, PmStateError
 from program_manager.pm_fsm import ProgramManagerFsm
+from fakes import FakeFgcSession
 
 ALLOWED_FSM_MODES = ["TRANSFERRED", "PROGRAMMED",
                      "SET_PROD_BOOT_PARS", "TO_PROD_BOOT", "CLEAN_UP", "WAITING"]
@@ -104,7 +110,50 @@ def test_fsm_moves_as_it_should():
         assert fsm.state == mode
     
 
+def test_poll_schedule_backs_off_up_to_maximum():
+    delays = PollSchedule(first_delay=0.5, initial=0.25, factor=2, maximum=1).delays()
+    assert [next(delays) for _ in range(6)] == [0.5, 0.25, 0.5, 1, 1, 1]
+
+def test_state_is_detected_soon_after_being_reached(fake_clock):
+    state = PmState(logging.getLogger(), name="PROGRAMMED")
+    state.poll_schedule = PollSchedule(first_delay=0, initial=0.1, factor=2, maximum=3)
+    state.run(FakeFgcSession(clock=fake_clock, states=((0, "PROGRAMMING"), (1.0, "PROGRAMMED"))))
+
+    assert 1.0 <= fake_clock.now < 1.6
+    assert state.polls == 5
+
+def test_state_timeout_is_respected(fake_clock):
+    state = PmState(logging.getLogger(), name="PROGRAMMED", timeout=10)
+    with pytest.raises(RuntimeError, match="Timeout"):
+        state.run(FakeFgcSession(clock=fake_clock, states=((0, "PROGRAMMING"),)))
+
+    assert fake_clock.now == pytest.approx(10)
+
+def test_fgc_error_state_fails_without_waiting_for_timeout(fake_clock):
+    state = PmState(logging.getLogger(), name="PROGRAMMED")
+    with pytest.raises(RuntimeError, match="ERROR"):
+        state.run(FakeFgcSession(clock=fake_clock, states=((0, "PROGRAMMING"), (0.5, "ERROR"))))
+
+    assert fake_clock.now < 2
+
+def test_clean_up_waits_while_fgc_reports_error(fake_clock):
+    state = PmStateCleanUp(logging.getLogger())
+    state.run(FakeFgcSession(clock=fake_clock, states=((0, "ERROR"), (0.5, "CLEAN_UP"))))
 
+    assert fake_clock.now >= 0.5
 
+def test_fsm_in_error_still_reaches_clean_up(fake_clock, tmp_path):
+    fleet  = SimulatedFleet(1, clock=fake_clock.monotonic)
+    fleet.write_firmware(str(tmp_path / "FW"))
+    fgc    = fleet.fgcs[next(iter(fleet.fgcs))]
+    fgc.state_failures = {"PROGRAMMING": 1.0}
+    states = list()
+    fsm    = ProgramManagerFsm((fgc.name, *fleet.pending_devices(fgc.name)[0]), fgc,
+                               progress=types.SimpleNamespace(state_reached=lambda slot, device, state: states.append(state)))
 
+    with pytest.raises(RuntimeError, match="after recovery attempt"):
+        fsm.process()
 
+    assert fgc.errors == 1
+    assert states[-2:] == ["CLEAN_UP", "WAITING"]
+    assert fgc.state == "WAITING"
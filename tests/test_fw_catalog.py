@@ -0,0 +1,89 @@
+import binascii
+import glob
+import os
+
+import pytest
+
+from program_manager.fw_catalog import CRC_FUNCTIONS, FirmwareCatalog
+from program_manager.fw_payload import FW_FILE_REGEX
+
+# Production binaries, as released in the FW repository, to check the CRC algorithm against
+FW_SAMPLES_DIR = os.environ.get("PM_FW_SAMPLES_DIR", os.path.join(os.path.dirname(__file__), "data", "fw"))
+
+# Helpers
+def write_fw_file(folder, device="MF", variant="IGBT_34", var_rev="208", api_rev="208", fw_bin=b"\x12\x34\x56\x78", crc=None):
+    crc = crc or f"{binascii.crc_hqx(fw_bin, 0xFFFF):04X}"
+    fw_file = folder / f"EDA_2261-{device}-{variant}-{var_rev}-{api_rev}-{crc}.bin"
+    fw_file.write_bytes(fw_bin)
+    return str(fw_file)
+
+
+def test_catalog_indexes_valid_files(tmp_path):
+    fw_file = write_fw_file(tmp_path)
+    catalog = FirmwareCatalog(str(tmp_path))
+    assert catalog.scan() == {fw_file}
+
+    entry = catalog.lookup("MF", "IGBT_34", 208, "208")
+    assert entry.path == fw_file
+    assert catalog.check(fw_file) is None
+
+@pytest.mark.parametrize("file_name", ("EDA_2261-MF-IGBT_34-208-208-0000.bin", "firmware.bin", "EDA_2261-MF-IGBT_34-208-208-XYZW.bin"))
+def test_catalog_rejects_corrupt_or_misnamed_files(tmp_path, file_name):
+    fw_file = tmp_path / file_name
+    fw_file.write_bytes(b"\x12\x34\x56\x78")
+    catalog = FirmwareCatalog(str(tmp_path), verify_crc=True)
+    catalog.scan()
+
+    assert len(catalog) == 0
+    assert catalog.check(str(fw_file))
+
+def test_catalog_only_rechecks_changed_files(tmp_path):
+    crc_calls = list()
+    def counting_crc(fw_bin):
+        crc_calls.append(fw_bin)
+        return binascii.crc_hqx(fw_bin, 0xFFFF)
+
+    fw_file = write_fw_file(tmp_path)
+    write_fw_file(tmp_path, device="DB")
+    catalog = FirmwareCatalog(str(tmp_path), crc_func=counting_crc, verify_crc=True)
+    catalog.scan()
+    assert len(crc_calls) == 2
+
+    assert catalog.scan() == set()
+    assert len(crc_calls) == 2
+
+    os.remove(fw_file)
+    assert catalog.scan() == {fw_file}
+    assert catalog.lookup("MF", "IGBT_34", "208", "208") is None
+    assert catalog.check(fw_file)
+
+def test_catalog_of_missing_folder_is_empty(tmp_path):
+    catalog = FirmwareCatalog(str(tmp_path / "FW"))
+    assert catalog.scan() == set()
+    assert len(catalog) == 0
+
+def test_catalog_checks_crc_by_default(tmp_path):
+    fw_file = write_fw_file(tmp_path, crc="0000")
+    catalog = FirmwareCatalog(str(tmp_path))
+    catalog.scan()
+
+    assert catalog.lookup("MF", "IGBT_34", "208", "208") is None
+    assert "does not match" in catalog.check(fw_file)
+
+def test_catalog_crc_check_can_be_turned_off(tmp_path):
+    fw_file = write_fw_file(tmp_path, crc="0000")
+    catalog = FirmwareCatalog(str(tmp_path), verify_crc=False)
+    catalog.scan()
+
+    assert catalog.lookup("MF", "IGBT_34", "208", "208").path == fw_file
+    assert catalog.check(fw_file) is None
+
+@pytest.mark.parametrize("crc_check", sorted(CRC_FUNCTIONS))
+@pytest.mark.parametrize("fw_file", sorted(glob.glob(os.path.join(FW_SAMPLES_DIR, "*.bin"))) or [None])
+def test_crc_check_accepts_production_binaries(fw_file, crc_check):
+    if fw_file is None:
+        pytest.skip(f"no production binaries in {FW_SAMPLES_DIR} (set PM_FW_SAMPLES_DIR)")
+
+    bin_crc = FW_FILE_REGEX.fullmatch(os.path.basename(fw_file)).groups()[-1]
+    with open(fw_file, "rb") as fwh:
+        assert CRC_FUNCTIONS[crc_check](fwh.read()) == int(bin_crc, 16)
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+import tracemalloc
+from binascii import hexlify
+
+import pytest
+
+import program_manager.fw_payload as fw_payload
+from program_manager.fw_payload import CHARS_PER_WORD, FW_FILE_LIMIT_BYTES, LIMIT_GW_CMD_WORDS
+from program_manager.fw_payload import PayloadCache, encode_fw_bin, encode_fw_file, get_fw_chunks, iter_fw_chunks
+
+# Helpers
+def legacy_encode(fw_bin):
+    packet = list()
+    for pos in range(0, len(fw_bin), 4):
+        ascii_word = hexlify(fw_bin[pos:pos + 4]).decode()
+        ascii_word += "".join(["0"] * (CHARS_PER_WORD - len(ascii_word)))
+        packet.append(hex(int(ascii_word, 16)))
+
+    return [(i, ",".join(packet[i:i + LIMIT_GW_CMD_WORDS])) for i in range(0, len(packet), LIMIT_GW_CMD_WORDS)]
+
+
+@pytest.mark.parametrize("size", (1, 2, 3, 4, 5, 8, 1023, LIMIT_GW_CMD_WORDS * 4, LIMIT_GW_CMD_WORDS * 4 + 3, 300001))
+def test_bulk_encoding_matches_legacy_encoding(size):
+    fw_bin = os.urandom(size)
+    assert encode_fw_bin(fw_bin) == legacy_encode(fw_bin)
+
+def test_short_last_word_is_right_padded():
+    assert encode_fw_bin(b"\x12\x34\x56\x78\xab") == [(0, "0x12345678,0xab000000")]
+
+def test_zero_words_are_encoded_as_legacy():
+    assert encode_fw_bin(b"\x00" * 8 + b"\x00\x01") == [(0, "0x0,0x0,0x10000")]
+
+def test_chunks_are_indexed_by_first_word():
+    chunks = encode_fw_bin(os.urandom(40), chunk_words=3)
+    assert [i for i, _ in chunks] == [0, 3, 6, 9]
+    assert all(len(chunk.split(",")) == 3 for _, chunk in chunks[:-1])
+
+def test_file_encoding(tmp_path):
+    fw_bin  = os.urandom(1001)
+    fw_file = tmp_path / "EDA_2261-MF-IGBT_34-208-208-B58C.bin"
+    fw_file.write_bytes(fw_bin)
+    assert encode_fw_file(str(fw_file)) == legacy_encode(fw_bin)
+
+def test_payload_cache_hits_after_first_encoding(tmp_path):
+    fw_file = tmp_path / "EDA_2261-MF-IGBT_34-208-208-B58C.bin"
+    fw_file.write_bytes(os.urandom(100))
+    cache = PayloadCache()
+
+    first = cache.get(str(fw_file))
+    assert cache.get(str(fw_file)) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_payload_cache_detects_modified_file(tmp_path):
+    fw_file = tmp_path / "EDA_2261-MF-IGBT_34-208-208-B58C.bin"
+    fw_file.write_bytes(b"\x00" * 8)
+    cache = PayloadCache()
+    cache.get(str(fw_file))
+
+    fw_file.write_bytes(b"\x01" * 12)
+    assert cache.get(str(fw_file)) == [(0, "0x1010101,0x1010101,0x1010101")]
+    assert cache.stats()["entries"] == 1
+
+def test_payload_cache_evicts_least_recently_used(tmp_path):
+    files = list()
+    for i in range(3):
+        fw_file = tmp_path / f"EDA_226{i}-MF-IGBT_34-208-208-B58C.bin"
+        fw_file.write_bytes(os.urandom(400))
+        files.append(str(fw_file))
+
+    one_entry_size = len(encode_fw_file(files[0])[0][1]) + 49
+    cache = PayloadCache(max_bytes=2 * one_entry_size + 10)
+    cache.get(files[0])
+    cache.get(files[1])
+    cache.get(files[0])
+    cache.get(files[2])
+
+    assert cache.evictions == 1
+    cache.get(files[0])
+    assert cache.hits == 2
+
+def test_payload_cache_encodes_once_for_concurrent_misses(tmp_path, monkeypatch):
+    fw_file = tmp_path / "EDA_2261-MF-IGBT_34-208-208-B58C.bin"
+    fw_file.write_bytes(os.urandom(100))
+    calls = list()
+
+    def slow_encode(fw_file_loc):
+        calls.append(fw_file_loc)
+        time.sleep(0.2)
+        return encode_fw_file(fw_file_loc)
+
+    monkeypatch.setattr(fw_payload, "encode_fw_file", slow_encode)
+    cache   = PayloadCache()
+    results = list()
+    threads = [threading.Thread(target=lambda: results.append(cache.get(str(fw_file)))) for _ in range(5)]
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert len(results) == 5 and all(r is results[0] for r in results)
+    assert cache.waits + cache.hits == 4
+
+@pytest.mark.parametrize("size", (0, 1, 3, 4, 4097 * 4 + 2, LIMIT_GW_CMD_WORDS * 4, LIMIT_GW_CMD_WORDS * 4 + 1, 600003))
+def test_streamed_chunks_match_bulk_encoding(tmp_path, size):
+    fw_bin  = os.urandom(size)
+    fw_file = tmp_path / "EDA_2261-MF-IGBT_34-208-208-B58C.bin"
+    fw_file.write_bytes(fw_bin)
+    assert list(iter_fw_chunks(str(fw_file))) == encode_fw_bin(fw_bin)
+
+def test_streamed_transfer_memory_is_bounded_by_one_chunk(tmp_path):
+    fw_file = tmp_path / "EDA_2261-MF-IGBT_34-208-208-B58C.bin"
+    fw_file.write_bytes(os.urandom(FW_FILE_LIMIT_BYTES))
+    max_chunk_len = 0
+
+    tracemalloc.start()
+    try:
+        for _, chunk in iter_fw_chunks(str(fw_file)):
+            max_chunk_len = max(max_chunk_len, len(chunk))
+            del chunk
+
+        _, peak = tracemalloc.get_traced_memory()
+
+    finally:
+        tracemalloc.stop()
+
+    # Whole payload is ~16 chunks; streaming keeps about the chunk being built plus its pieces
+    assert peak < 3 * max_chunk_len
+
+def test_payload_over_cache_budget_is_streamed(tmp_path):
+    fw_file = tmp_path / "EDA_2261-MF-IGBT_34-208-208-B58C.bin"
+    fw_file.write_bytes(os.urandom(1000))
+    cache = PayloadCache(max_bytes=1000)
+
+    chunks = get_fw_chunks(str(fw_file), cache)
+    assert not isinstance(chunks, list)
+    assert list(chunks) == encode_fw_file(str(fw_file))
+    assert cache.misses == 0
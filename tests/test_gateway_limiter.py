@@ -0,0 +1,103 @@
+import threading
+import time
+
+from program_manager.gateway_limiter import GatewayLimiter
+from fakes import FakeClock
+
+
+def test_concurrent_transfers_are_capped_per_gateway():
+    limiter = GatewayLimiter(max_transfers=2)
+    active  = {"GW1": 0, "GW2": 0}
+    maximum = {"GW1": 0, "GW2": 0}
+    lock    = threading.Lock()
+
+    def transfer(gateway):
+        with limiter.transfer(gateway):
+            with lock:
+                active[gateway] += 1
+                maximum[gateway] = max(maximum[gateway], active[gateway])
+
+            time.sleep(0.02)
+            with lock:
+                active[gateway] -= 1
+
+    threads = [threading.Thread(target=transfer, args=(gw,)) for gw in ["GW1"] * 6 + ["GW2"] * 2]
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    assert maximum == {"GW1": 2, "GW2": 2}
+    stats = limiter.stats()
+    assert stats["GW1"]["transfers"] == 6
+    assert stats["GW1"]["max_active"] == 2
+    assert stats["GW1"]["wait_max"] > 0
+    assert stats["GW2"]["active"] == 0
+
+def test_bandwidth_is_throttled():
+    clock   = FakeClock()
+    limiter = GatewayLimiter(bytes_per_sec=1000, clock=clock, sleep=clock.sleep)
+
+    with limiter.transfer("GW1") as transfer:
+        # The first second worth of bytes is the burst
+        transfer.throttle(1000)
+        assert clock.slept == []
+
+        for _ in range(4):
+            transfer.throttle(500)
+
+    assert sum(clock.slept) == 2.0
+    assert limiter.stats()["GW1"]["bytes_sent"] == 3000
+
+def test_utilisation():
+    clock   = FakeClock()
+    limiter = GatewayLimiter(max_transfers=2, clock=clock, sleep=clock.sleep)
+
+    with limiter.transfer("GW1"):
+        clock.now += 10
+
+    clock.now += 10
+    assert limiter.stats()["GW1"]["utilisation"] == 10 / (2 * 20)
+
+def test_freed_slot_is_given_to_its_own_gateway():
+    limiter  = GatewayLimiter(max_transfers=1)
+    release  = {"GW1": threading.Event(), "GW2": threading.Event()}
+    admitted = list()
+
+    def transfer(gateway, name):
+        with limiter.transfer(gateway):
+            admitted.append(name)
+            release[gateway].wait(5)
+
+    def start(gateway, name):
+        thread = threading.Thread(target=transfer, args=(gateway, name), daemon=True)
+        thread.start()
+        return thread
+
+    def waiting(gateway, number):
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            with limiter._lock:
+                if len(limiter._gateways[gateway].slot_freed._waiters) == number:
+                    return
+
+            time.sleep(0.001)
+
+    start("GW1", "GW1.a")
+    start("GW2", "GW2.a")
+    while len(admitted) < 2:
+        time.sleep(0.001)
+
+    # GW1's transfer waits first, then GW2's
+    start("GW1", "GW1.b")
+    waiting("GW1", 1)
+    gw2_waiter = start("GW2", "GW2.b")
+    waiting("GW2", 1)
+
+    # A slot of GW2 is freed while GW1 stays full
+    release["GW2"].set()
+    gw2_waiter.join(2)
+    assert not gw2_waiter.is_alive()
+    assert "GW2.b" in admitted and "GW1.b" not in admitted
+    release["GW1"].set()
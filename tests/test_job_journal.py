@@ -0,0 +1,198 @@
+import shutil
+import threading
+import time
+
+import pytest
+
+import program_manager.pm_fsm as pm_fsm
+import program_manager.regfgc3_programmer as programmer
+from program_manager.area_worker import JOB_ACCEPTED, AreaProgramManager
+from program_manager.fgc_simulator import SimulatedFgc, SimulatedFleet, SimulatedNameIndex, SimulatedStatusServer
+from program_manager.job_journal import STATE_DONE, STATE_DONE_NO_PB, JobJournal, JobProgress, current_progress
+from program_manager.pm_server import ProgramManagerServer
+from program_manager.regfgc3_programmer import parse_slot_info
+from program_manager.scheduler import WorkScheduler
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "journal" / "jobs.jsonl")
+
+def test_replay_returns_unfinished_jobs(path):
+    journal = JobJournal(path)
+    journal.enqueued("AREA1", "RPZES.1", 10, "cfc-1")
+    journal.enqueued("AREA1", "RPZES.2", 10, "cfc-1")
+    journal.enqueued("AREA2", "RPZES.3", 0)
+    journal.started("RPZES.1")
+    journal.state_reached("RPZES.1", "5", "MF", "TRANSFERRING")
+    journal.state_reached("RPZES.1", "5", "MF", "PROGRAMMED")
+    journal.state_reached("RPZES.1", "5", "DB", STATE_DONE)
+    journal.started("RPZES.2")
+    journal.finished("RPZES.2", "ok")
+    with open(path, "a") as fh:
+        fh.write('{"event": "state", "job": "RPZES.3", "sl')
+
+    jobs = JobJournal(path).replay()
+
+    assert [(job.area, job.job_name, job.priority, job.gateway, job.started) for job in jobs] == [("AREA1", "RPZES.1", 10, "cfc-1", True),
+                                                                                                  ("AREA2", "RPZES.3", 0, None, False)]
+    assert jobs[0].states == {("5", "MF"): "PROGRAMMED", ("5", "DB"): STATE_DONE}
+    with open(path) as fh:
+        assert len(fh.readlines()) == 3
+
+def test_journal_is_compacted(path):
+    journal = JobJournal(path, compact_after=10)
+    for i in range(50):
+        journal.enqueued("AREA1", f"RPZES.{i}", 0)
+        journal.started(f"RPZES.{i}")
+        journal.finished(f"RPZES.{i}", "ok")
+
+    journal.enqueued("AREA1", "RPZES.50", 0)
+    assert journal.stats()["compactions"] == 15
+    assert [job.job_name for job in JobJournal(path).replay()] == ["RPZES.50"]
+
+    journal.close()
+    with open(path) as fh:
+        assert len(fh.readlines()) == 1
+
+def test_area_journals_its_jobs(path, tmp_path):
+    journal  = JobJournal(path)
+    area     = AreaProgramManager("AREA1", scheduler=WorkScheduler(max_workers=0), journal=journal)
+    crash    = str(tmp_path / "crash.jsonl")
+    resumed  = list()
+
+    def work(logger, job_name):
+        resumed.append(current_progress().resume_state("5", "MF"))
+        current_progress().state_reached("5", "MF", "PROGRAMMED")
+        shutil.copy(path, crash)
+
+    area.add_job(work, "RPZES.1", gateway="cfc-1", resume={("5", "MF"): "SET_PB_PARS"})
+    area.add_job(work, "RPZES.2")
+    area.run_job(area.tasks.get_first(lambda job: True), "worker", area._logger)
+
+    # As if the server was killed while the first job was running
+    jobs = JobJournal(crash).replay()
+    assert resumed == ["SET_PB_PARS"]
+    assert [(job.job_name, job.started, job.states) for job in jobs] == [("RPZES.1", True, {("5", "MF"): "PROGRAMMED"}),
+                                                                         ("RPZES.2", False, {})]
+    assert [job.job_name for job in journal.unfinished()] == ["RPZES.2"]
+
+def test_area_journals_without_holding_its_lock(path):
+    area = None
+
+    class CheckingJournal(JobJournal):
+        def enqueued(self, *args, **kwargs):
+            assert not area._job_set_lock.locked()
+            # The job is known while it is journaled
+            assert area.add_job(work, "RPZES.1") == JOB_ACCEPTED
+            super().enqueued(*args, **kwargs)
+
+    work = lambda logger, job_name: None
+    area = AreaProgramManager("AREA1", scheduler=WorkScheduler(max_workers=0), journal=CheckingJournal(path))
+
+    assert area.add_job(work, "RPZES.1") == JOB_ACCEPTED
+    assert area.stats()["coalesced"] == 1
+    assert [job.job_name for job in JobJournal(path).replay()] == ["RPZES.1"]
+
+@pytest.fixture
+def fgc(tmp_path, fake_clock):
+    fleet = SimulatedFleet(1, clock=fake_clock.monotonic)
+    fleet.write_firmware(str(tmp_path / "FW"))
+    fgc = fleet.fgcs[next(iter(fleet.fgcs))]
+    return fgc, fleet.pending_devices(fgc.name)[0]
+
+def test_program_resumes_from_journaled_state(fgc):
+    fgc, job = fgc
+    fsm = pm_fsm.ProgramManagerFsm((fgc.name, *job), fgc)
+    for mode in ("WAITING", "TRANSFERRED", "PROGRAMMED"):
+        fsm.mode = mode
+
+    sets = fgc.sets
+    assert programmer.program(fgc.name, *job, fgc_session=fgc, progress=JobProgress(resume={("5", "MF"): "PROGRAMMED"})) == 0
+    assert fgc.devices_programmed == 1
+    assert fgc.sets - sets == 4
+    assert fgc.state == "WAITING"
+    assert parse_slot_info(fgc.slot_info())["5"].STATE == "ProductionBoot"
+
+def test_program_skips_done_devices_and_restarts_others(fgc):
+    fgc, job = fgc
+    gets = fgc.gets
+    assert programmer.program(fgc.name, *job, fgc_session=fgc, progress=JobProgress(resume={("5", "MF"): STATE_DONE})) == 0
+    assert fgc.gets == gets
+
+    # The FGC is not in PROGRAMMED any more: programmed from scratch
+    assert programmer.program(fgc.name, *job, fgc_session=fgc, progress=JobProgress(resume={("5", "MF"): "PROGRAMMED"})) == 0
+    assert fgc.devices_programmed == 1
+
+def test_device_done_without_production_boot_boots_its_board_when_last(fgc):
+    fgc, job = fgc
+    states   = list()
+    progress = JobProgress(resume={("5", "MF"): STATE_DONE_NO_PB})
+    progress.state_reached = lambda slot, device, state: states.append(state)
+
+    # Other devices of the slot still follow: nothing to do
+    gets = fgc.gets
+    assert programmer.program(fgc.name, *job, fgc_session=fgc, skip_prod_boot=True, progress=progress) == 0
+    assert fgc.gets == gets
+
+    # Now the slot's last device: programmed again, through production boot
+    assert programmer.program(fgc.name, *job, fgc_session=fgc, progress=progress) == 0
+    assert fgc.devices_programmed == 1
+    assert parse_slot_info(fgc.slot_info())["5"].STATE == "ProductionBoot"
+    assert states[-1] == STATE_DONE
+
+def test_server_restores_journaled_jobs(tmp_path):
+    fleet   = SimulatedFleet(3, converters_per_gateway=2, release=False)
+    path    = str(tmp_path / "jobs.jsonl")
+    journal = JobJournal(path)
+    journal.enqueued("SIM000", "RPSIM.0000.01", 10, "cfc-sim-0000")
+    journal.started("RPSIM.0000.01")
+    journal.state_reached("RPSIM.0000.01", "6", "MF", "TO_PROD_BOOT")
+    journal.enqueued("SIM000", "RPSIM.0001.00", 10, "cfc-sim-0001")
+    journal.close()
+
+    ran = dict()
+    def work(logger, job_name):
+        ran[job_name] = current_progress().resume
+
+    server = ProgramManagerServer(name_file=None,
+                                  fw_repo_loc=str(tmp_path),
+                                  expected_data="fs",
+                                  db_data=None,
+                                  journal_file=path,
+                                  name_index=SimulatedNameIndex(fleet),
+                                  status_source=SimulatedStatusServer(fleet).get_status_all,
+                                  status_period=0.05,
+                                  job_func=work)
+
+    server_thread = threading.Thread(target=server.start, daemon=True)
+    server_thread.start()
+    deadline = time.monotonic() + 10
+    while len(ran) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    server.stop()
+    server_thread.join(5)
+
+    assert ran == {"RPSIM.0000.01": {("6", "MF"): "TO_PROD_BOOT"}, "RPSIM.0001.00": {}}
+    assert JobJournal(path).replay() == []
+
+def test_server_scans_firmware_before_restoring_jobs(tmp_path):
+    fleet = SimulatedFleet(1, release=False)
+    fleet.write_firmware(str(tmp_path / "FW"))
+    server = ProgramManagerServer(name_file=None,
+                                  fw_repo_loc=str(tmp_path),
+                                  expected_data="fs",
+                                  db_data=None,
+                                  name_index=SimulatedNameIndex(fleet),
+                                  status_source=SimulatedStatusServer(fleet).get_status_all,
+                                  job_func=lambda logger, job_name: None)
+
+    catalog_sizes = list()
+    def restore_jobs():
+        catalog_sizes.append(len(server.fw_catalog))
+        server.stop()
+
+    server._restore_jobs = restore_jobs
+    server.start()
+
+    assert catalog_sizes == [len(fleet.fw_files)]
@@ -0,0 +1,119 @@
+import threading
+
+from program_manager.area_worker import AreaProgramManager
+from program_manager.job_queue import DEFAULT_POLICY, PRIORITY_COMMISSIONING, PRIORITY_NORMAL, PRIORITY_SYNC
+from program_manager.job_queue import DurationHistory, Job, PriorityTaskQueue, SchedulingPolicy
+from fakes import FakeClock
+
+
+def drain(tasks):
+    names = list()
+    while not tasks.empty():
+        names.append(tasks.get_nowait().job_name)
+
+    return names
+
+def test_higher_priority_first():
+    tasks = PriorityTaskQueue(clock=FakeClock())
+    tasks.put(Job(None, "commissioning", priority=PRIORITY_COMMISSIONING))
+    tasks.put(Job(None, "normal", priority=PRIORITY_NORMAL))
+    tasks.put(Job(None, "sync", priority=PRIORITY_SYNC))
+
+    assert drain(tasks) == ["sync", "normal", "commissioning"]
+
+def test_fifo_among_equal_jobs():
+    tasks = PriorityTaskQueue(clock=FakeClock())
+    for i in range(10):
+        tasks.put(Job(None, f"job{i}"))
+
+    assert drain(tasks) == [f"job{i}" for i in range(10)]
+
+def test_retries_and_expected_duration_lower_rank():
+    history = DurationHistory(default=10)
+    history.record("slow", 300)
+    tasks = PriorityTaskQueue(history=history, clock=FakeClock())
+    tasks.put(Job(None, "retried", retries=3))
+    tasks.put(Job(None, "slow"))
+    tasks.put(Job(None, "fresh"))
+
+    assert drain(tasks) == ["fresh", "slow", "retried"]
+
+def test_duration_history_is_averaged():
+    history = DurationHistory(alpha=0.5, default=60)
+    assert history.expected("RPZES.866.15.ETH1") == 60
+
+    history.record("RPZES.866.15.ETH1", 10)
+    history.record("RPZES.866.15.ETH1", 20)
+    assert history.expected("RPZES.866.15.ETH1") == 15
+
+def test_no_starvation_under_load():
+    # An overload of SYNC jobs: two arriving per second, one served per second.
+    # Jobs queued more than the aging bound after the commissioning job must
+    # not overtake it
+    clock  = FakeClock()
+    policy = SchedulingPolicy(priority_weight=1.0, retry_weight=2.0, duration_weight=0.0, aging_per_sec=0.5)
+    tasks  = PriorityTaskQueue(policy=policy, clock=clock)
+    tasks.put(Job(None, "commissioning", priority=PRIORITY_COMMISSIONING))
+
+    bound       = (PRIORITY_SYNC - PRIORITY_COMMISSIONING) / policy.aging_per_sec
+    served_jobs = list()
+    for second in range(int(bound) * 4):
+        clock.now = second
+        tasks.put(Job(None, f"sync{second}a", priority=PRIORITY_SYNC))
+        tasks.put(Job(None, f"sync{second}b", priority=PRIORITY_SYNC))
+        job = tasks.get_nowait()
+        if job.job_name == "commissioning":
+            break
+
+        served_jobs.append(job)
+
+    else:
+        assert False, "commissioning job starved"
+
+    assert all(job.enqueue_time <= bound for job in served_jobs)
+
+def test_area_counts_retries_of_failed_jobs():
+    failed = threading.Event()
+
+    def failing_work(logger, job_name):
+        failed.set()
+        raise RuntimeError("boom")
+
+    area = AreaProgramManager("TEST", num_workers=1)
+    area.add_job(failing_work, "RPZES.866.15.ETH1")
+    area._tasks.join()
+    assert failed.is_set()
+    assert area._retries == {"RPZES.866.15.ETH1": 1}
+    assert area._jobs == set()
+    assert area._tasks.history.expected("RPZES.866.15.ETH1") < DurationHistory().default
+
+    area.wait_completion()
+
+def test_area_forgets_retries_of_jobs_not_queued_again(monkeypatch):
+    monkeypatch.setattr(AreaProgramManager, "MAX_NUM_RETRIED", 2)
+    area = AreaProgramManager("TEST", num_workers=1)
+
+    def failing_work(logger, job_name):
+        raise RuntimeError("boom")
+
+    for job_name in ("RPZES.1", "RPZES.2", "RPZES.3"):
+        area.add_job(failing_work, job_name)
+        area._tasks.join()
+
+    assert list(area._retries) == ["RPZES.2", "RPZES.3"]
+
+    # Queued again, the job carries its retries
+    area.add_job(lambda logger, job_name: None, "RPZES.3")
+    area._tasks.join()
+    assert list(area._retries) == ["RPZES.2"]
+
+    area.wait_completion()
+
+def test_get_first_skips_rejected_jobs():
+    tasks = PriorityTaskQueue(clock=FakeClock())
+    tasks.put(Job(None, "blocked", priority=PRIORITY_SYNC, gateway="GW1"))
+    tasks.put(Job(None, "runnable", gateway="GW2"))
+
+    assert tasks.get_first(lambda job: job.gateway != "GW1").job_name == "runnable"
+    assert tasks.get_first(lambda job: job.gateway != "GW1") is None
+    assert drain(tasks) == ["blocked"]
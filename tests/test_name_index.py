@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+import pyfgc_name
+from program_manager.name_index import NameIndex, default_group_file
+
+NAME_FILE  = ("cfc-866-reth1:63:RPZES.866.15.ETH1\n"
+              "cfc-866-reth1:63:RPZES.866.16.ETH1\n"
+              "cfc-193-reth2:92:RPAGM.193.1.ETH2\n")
+GROUP_FILE = ("AREA_866:cfc-866-reth1\n"
+              "AREA_193:cfc-193-reth2\n")
+
+
+@pytest.fixture
+def fake_name_parser(monkeypatch):
+    # Reduced formats: gateway:class_id:device and group:gateway
+    reads = list()
+
+    def read_name_file(path):
+        reads.append(path)
+        pyfgc_name.devices  = dict()
+        pyfgc_name.gateways = dict()
+        with open(path) as fh:
+            for line in fh.read().split():
+                gateway, class_id, device = line.split(":")
+                pyfgc_name.devices[device] = {"gateway": gateway, "class_id": int(class_id)}
+                pyfgc_name.gateways.setdefault(gateway, {"groups": list()})
+
+    def read_group_file(path):
+        pyfgc_name.groups = dict()
+        with open(path) as fh:
+            for line in fh.read().split():
+                group, gateway = line.split(":")
+                pyfgc_name.groups.setdefault(group, list()).append(gateway)
+                pyfgc_name.gateways[gateway]["groups"].append(group)
+
+    monkeypatch.setattr(pyfgc_name, "read_name_file", read_name_file)
+    monkeypatch.setattr(pyfgc_name, "read_group_file", read_group_file)
+    return reads
+
+@pytest.fixture
+def source(tmpdir):
+    tmpdir.join("name").write(NAME_FILE)
+    tmpdir.join("group").write(GROUP_FILE)
+    return tmpdir
+
+def test_default_group_file():
+    assert default_group_file("http://host/fgcd/name") == "http://host/fgcd/group"
+    assert default_group_file(os.path.join("etc", "name")) == os.path.join("etc", "group")
+
+def test_index_maps(fake_name_parser, source):
+    names = NameIndex(str(source.join("name")), str(source.join("snapshot")))
+    assert names.load() == {"AREA_866", "AREA_193"}
+
+    assert names.area_of("RPZES.866.15.ETH1") == "AREA_866"
+    assert names.gateway_of("RPAGM.193.1.ETH2") == "cfc-193-reth2"
+    assert names.devices_of_class(63) == {"RPZES.866.15.ETH1", "RPZES.866.16.ETH1"}
+    assert names.areas == {"AREA_866", "AREA_193"}
+    assert names.area_of("UNKNOWN") is None
+
+def test_unchanged_source_is_not_reparsed(fake_name_parser, source):
+    names = NameIndex(str(source.join("name")), str(source.join("snapshot")))
+    names.load()
+
+    assert names.refresh() == set()
+    assert len(fake_name_parser) == 1
+
+def test_touched_source_with_same_contents_is_not_reparsed(fake_name_parser, source):
+    names = NameIndex(str(source.join("name")), str(source.join("snapshot")))
+    names.load()
+
+    source.join("name").write(NAME_FILE)
+    os.utime(str(source.join("name")), ns=(0, 0))
+    assert names.refresh() == set()
+    assert len(fake_name_parser) == 1
+
+def test_changes_report_affected_areas(fake_name_parser, source):
+    names = NameIndex(str(source.join("name")), str(source.join("snapshot")))
+    names.load()
+
+    source.join("name").write(NAME_FILE + "cfc-193-reth2:92:RPAGM.193.2.ETH2\n")
+    assert names.refresh() == {"AREA_193"}
+    assert names.area_of("RPAGM.193.2.ETH2") == "AREA_193"
+
+def test_restart_loads_snapshot_without_source(fake_name_parser, source):
+    snapshot = str(source.join("snapshot"))
+    NameIndex(str(source.join("name")), snapshot).load()
+
+    source.join("name").remove()
+    names = NameIndex(str(source.join("name")), snapshot)
+    assert names.load() == set()
+    assert names.area_of("RPZES.866.15.ETH1") == "AREA_866"
+
+def test_no_snapshot_and_no_source_raises(fake_name_parser, tmpdir):
+    names = NameIndex(str(tmpdir.join("missing")), str(tmpdir.join("snapshot")))
+    with pytest.raises(RuntimeError):
+        names.load()
@@ -0,0 +1,156 @@
+import logging
+import types
+
+import pytest
+
+import program_manager.area_worker as area_worker
+import program_manager.planner as planner_module
+from program_manager.adapters import Adapter, FileSystemAdapter
+from program_manager.area_worker import OUTCOME_FAULT, OUTCOME_NO_EXPECTED, OUTCOME_OK, fgc_work
+from program_manager.fgc_pool import FgcSessionPool
+from program_manager.fgc_simulator import SimulatedFleet
+from program_manager.fw_catalog import FirmwareCatalog
+from program_manager.planner import Planner, plan_converter
+from program_manager.regfgc3_programmer import parse_slot_info
+from program_manager.slot_snapshot import SlotInfoStore
+
+def crate(*boards):
+    fields = list()
+    for slot, board, devices in boards:
+        fields += ["------------------------------", f"SLOT       {slot}", f"BOARD       {board}", "STATE      ProductionBoot"]
+        for device, variant, var_revision, api_revision in devices:
+            fields += [f"Device     {device}", f"Variant    {variant}", f"Var_Rev    {var_revision}", f"API_Rev    {api_revision}", ""]
+
+    return parse_slot_info(",".join(fields))
+
+def expected(*boards, by_board=False):
+    data = dict()
+    for slot, board, devices in boards:
+        data[board if by_board else slot] = {"board": board, "devices": {dev[0]: Adapter.Device(*dev) for dev in devices}}
+
+    return data
+
+def fw_lookup(device, variant, var_revision, api_revision):
+    if variant == "NO_FW":
+        return None
+
+    return types.SimpleNamespace(bin_crc="B58C", path=f"/fw/{device}-{variant}-{var_revision}-{api_revision}-B58C.bin")
+
+SLOT_INFO = crate(("10", "VS_REG_DSP",    [("DB", "3", "205", "200"), ("MF", "DSP_2", "104", "208")]),
+                  ("5",  "VS_STATE_CTRL", [("DB", "3", "208", "200"), ("MF", "0", "0", "0"), ("DEVICE_2", "0", "0", "0")]))
+
+@pytest.mark.parametrize("by_board", [False, True])
+def test_plan_programs_outdated_devices_in_order(by_board):
+    exp = expected(("10", "VS_REG_DSP",    [("MF", "DSP_2", "105", "208")]),
+                   ("5",  "VS_STATE_CTRL", [("DEVICE_2", "CTRL", "3", "208"), ("MF", "IGBT_34", "208", "208"), ("DB", "3", "208", "200")]),
+                   by_board=by_board)
+
+    plan = plan_converter("RPZES.1", SLOT_INFO, exp, fw_lookup)
+
+    assert not plan.faults and not plan.missing_fw
+    assert [(a.slot, a.device, a.variant, a.var_revision) for a in plan.actions] == [("5", "MF", "IGBT_34", "208"),
+                                                                                      ("5", "DEVICE_2", "CTRL", "3"),
+                                                                                      ("10", "MF", "DSP_2", "105")]
+    assert plan.actions[0][1:] == ("5", "VS_STATE_CTRL", "MF", "IGBT_34", "208", "208", "B58C", "/fw/MF-IGBT_34-208-208-B58C.bin")
+
+def test_plan_faults_wrong_board_and_variant():
+    exp = expected(("10", "VS_STATE_CTRL", [("MF", "IGBT_34", "208", "208")]),
+                   ("5",  "VS_STATE_CTRL", [("MF", "IGBT_34", "208", "208"), ("DB", "4", "208", "200")]),
+                   ("7",  "VS_ANA",        [("MF", "ANA_1", "1", "1")]))
+
+    plan = plan_converter("RPZES.1", SLOT_INFO, exp, fw_lookup)
+
+    assert not plan.actions
+    assert [(f.slot, f.board) for f in plan.faults] == [("10", "VS_REG_DSP"), ("5", "VS_STATE_CTRL"), ("7", "VS_ANA")]
+    assert "runs variant 3" in plan.faults[1].reason
+    assert plan.faults[2].reason == "board not detected"
+
+def test_plan_reports_missing_firmware():
+    exp = expected(("5", "VS_STATE_CTRL", [("MF", "NO_FW", "1", "1"), ("DEVICE_2", "CTRL", "3", "208")]))
+
+    plan = plan_converter("RPZES.1", SLOT_INFO, exp, fw_lookup)
+
+    assert [a.device for a in plan.actions] == ["DEVICE_2"]
+    assert plan.missing_fw == [("RPZES.1", "5", "VS_STATE_CTRL", "MF", "NO_FW", "1", "1")]
+
+def test_planner_reuses_plans_until_inputs_change():
+    planner = Planner(fw_lookup)
+    exp     = {"RPZES.1": expected(("5", "VS_STATE_CTRL", [("MF", "IGBT_34", "208", "208")])),
+               "RPZES.2": expected(("5", "VS_STATE_CTRL", [("MF", "0", "0", "0")]))}
+    slot_infos = {"RPZES.1": SLOT_INFO, "RPZES.2": SLOT_INFO, "RPZES.3": SLOT_INFO}
+
+    fleet_plan = planner.plan(slot_infos, lambda converter: exp[converter])
+    assert fleet_plan.converters_to_program() == ["RPZES.1"]
+    assert fleet_plan.plans["RPZES.3"].faults[0].reason == "no expected data"
+    assert (planner.planned, planner.reused) == (2, 0)
+
+    planner.plan(slot_infos, lambda converter: exp[converter])
+    assert (planner.planned, planner.reused) == (2, 2)
+
+    slot_infos["RPZES.2"] = crate(("5", "VS_STATE_CTRL", [("MF", "0", "0", "0")]))
+    planner.invalidate("RPZES.1")
+    planner.plan(slot_infos, lambda converter: exp[converter])
+    assert (planner.planned, planner.reused) == (4, 2)
+
+class FakeRecorder:
+    def __init__(self):
+        self.records = list()
+
+    def submit(self, record):
+        self.records.append(record)
+
+@pytest.fixture
+def simulated(tmp_path, monkeypatch, fake_clock):
+    fleet = SimulatedFleet(1, clock=fake_clock.monotonic)
+    fleet.write_firmware(str(tmp_path / "FW"))
+    monkeypatch.setattr(area_worker, "fgc_pool", FgcSessionPool(connect=fleet.connect, gateway_of=fleet.converter_gateway.get))
+
+    (tmp_path / "DB").mkdir()
+    catalog = FirmwareCatalog(str(tmp_path / "FW"))
+    catalog.scan()
+    return fleet, FileSystemAdapter("FW", "DB", str(tmp_path)), catalog, tmp_path / "DB"
+
+def test_fgc_work_reprograms_planned_devices(simulated):
+    fleet, adapter, catalog, db_folder = simulated
+    converter = next(iter(fleet.fgcs))
+    (db_folder / converter).write_text("5,VS_STATE_CTRL,MF,IGBT_34,208,208\n6,VS_REG_DSP,MF,DSP_2,105,208\n")
+    recorder  = FakeRecorder()
+    snapshots = SlotInfoStore()
+
+    fgc_work(logging.getLogger("test"), converter, adapter, catalog, recorder, snapshots=snapshots)
+
+    assert not fleet.pending_devices(converter)
+    assert recorder.records[0].outcome == OUTCOME_OK
+    assert parse_slot_info(recorder.records[0].slot_info).device("6", "MF").Variant == "DSP_2"
+    assert snapshots.get(converter).device("6", "MF").Variant == "DSP_2"
+    assert snapshots.timestamp(converter) == recorder.records[0].timestamp
+
+def test_fgc_work_parses_and_plans_unchanged_converters_once(simulated, monkeypatch):
+    fleet, adapter, catalog, db_folder = simulated
+    converter = next(iter(fleet.fgcs))
+    (db_folder / converter).write_text("5,VS_STATE_CTRL,DB,3,208,200\n")
+    planner   = Planner(catalog.lookup)
+    snapshots = SlotInfoStore()
+    parses    = list()
+    monkeypatch.setattr(planner_module, "parse_slot_info", lambda reply: parses.append(reply) or parse_slot_info(reply))
+
+    fgc_work(logging.getLogger("test"), converter, adapter, catalog, planner=planner, snapshots=snapshots)
+    first = snapshots.get(converter)
+    fgc_work(logging.getLogger("test"), converter, adapter, catalog, planner=planner, snapshots=snapshots)
+
+    assert len(parses) == 1
+    assert (planner.planned, planner.reused) == (1, 1)
+    assert snapshots.get(converter) is first
+
+def test_fgc_work_records_faults_and_unknown_converters(simulated):
+    fleet, adapter, catalog, db_folder = simulated
+    converter = next(iter(fleet.fgcs))
+    recorder  = FakeRecorder()
+    logger    = logging.getLogger("test")
+
+    fgc_work(logger, converter, adapter, catalog, recorder)
+    (db_folder / converter).write_text("5,VS_STATE_CTRL,MF,IGBT_34,208,208\n6,VS_ANA,MF,DSP_2,105,208\n")
+    fgc_work(logger, converter, adapter, catalog, recorder)
+
+    assert [record.outcome for record in recorder.records] == [OUTCOME_NO_EXPECTED, OUTCOME_FAULT]
+    assert [job[0] for job in fleet.pending_devices(converter)] == ["6"]
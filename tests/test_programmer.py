@@ -49,10 +49,24 @@ def test_programmer_parse_single_slot_correctly():
                      ("12", "DB", "VS_DIG_INTK", "3"),
                      ("12", "MF", "VS_DIG_INTK", "0")))
 def test_programmer_slot_info_string_is_parsed_correctly(slot, device, board, variant):
-    board, dev, var, *_ = parse_slot_info(slot, device, SLOT_INFO_STRING)
-    assert board == board
-    assert dev == device
-    assert var == variant
+    slot_info = parse_slot_info(SLOT_INFO_STRING)
+    assert slot_info[slot].BOARD == board
+    assert slot_info.device(slot, device).Device == device
+    assert slot_info.device(slot, device).Variant == variant
 
+def test_programmer_slot_info_is_indexed_by_int_slot():
+    slot_info = parse_slot_info(SLOT_INFO_STRING)
+    assert [b.SLOT for b in slot_info] == ["5", "6", "9", "12"]
+    assert slot_info[9].STATE == "ProductionBoot"
+    assert 12 in slot_info and 7 not in slot_info
+    assert slot_info.device(9, "DB") is None
+    assert len(slot_info[6].devices) == 3
 
+def test_programmer_download_boot_detected():
+    slot_info = parse_slot_info(SLOT_INFO_STRING)
+    assert programmer.check_board_in_download_boot(slot_info[5])
+    assert not programmer.check_board_in_download_boot(slot_info[9])
 
+def test_programmer_malformed_slot_info_raises():
+    with pytest.raises(RuntimeError):
+        parse_slot_info("Variant    3,SLOT       5")
@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+
+from program_manager.adapters import FileSystemAdapter
+from program_manager.pm_server import ProgramManagerServer
+from program_manager.recorder import DetectedRecord, WriteBehindRecorder, detected_rows
+
+SLOT_INFO = ("------------------------------,"
+             "SLOT       5,BOARD       VS_STATE_CTRL,STATE      ProductionBoot,"
+             "Device     DB,Variant    3,Var_Rev    208,API_Rev    200,,"
+             "Device     MF,Variant    4,Var_Rev    208,API_Rev    208,,")
+
+class Backend:
+    def __init__(self, failures=0):
+        self.batches  = list()
+        self.failures = failures
+
+    def __call__(self, records):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("DB unavailable")
+
+        self.batches.append(list(records))
+
+    @property
+    def records(self):
+        return [record for batch in self.batches for record in batch]
+
+def record(i, slot_info=None):
+    return DetectedRecord(f"RPZES.{i}.ETH1", 1000.0 + i, slot_info, "ok")
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+    return condition()
+
+def test_records_are_written_in_batches():
+    backend  = Backend()
+    recorder = WriteBehindRecorder(backend, batch_size=100, flush_interval=60)
+    for i in range(250):
+        recorder.submit(record(i))
+
+    assert wait_for(lambda: len(backend.records) >= 200)
+    assert recorder.flush(timeout=2)
+    assert backend.records == [record(i) for i in range(250)]
+    assert max(len(batch) for batch in backend.batches) <= 100
+    recorder.close()
+
+def test_records_are_written_after_flush_interval():
+    backend  = Backend()
+    recorder = WriteBehindRecorder(backend, batch_size=100, flush_interval=0.05)
+    for i in range(3):
+        recorder.submit(record(i))
+
+    assert wait_for(lambda: len(backend.records) == 3)
+    assert len(backend.batches) == 1
+    recorder.close()
+
+def test_submit_does_not_wait_for_backend():
+    release  = threading.Event()
+    recorder = WriteBehindRecorder(lambda records: release.wait(), batch_size=10, flush_interval=60)
+
+    start = time.monotonic()
+    for i in range(1000):
+        assert recorder.submit(record(i))
+
+    assert time.monotonic() - start < 0.5
+    release.set()
+    assert recorder.flush(timeout=2)
+    recorder.close()
+
+def test_failed_batches_are_retried_in_order():
+    backend  = Backend(failures=2)
+    recorder = WriteBehindRecorder(backend, batch_size=5, flush_interval=0.01, retry_delay=0.01)
+    for i in range(12):
+        recorder.submit(record(i))
+
+    assert recorder.flush(timeout=2)
+    assert backend.records == [record(i) for i in range(12)]
+    assert recorder.stats()["failures"] == 2
+    recorder.close()
+
+def test_pending_records_are_bounded():
+    recorder = WriteBehindRecorder(Backend(failures=10**6), batch_size=5, flush_interval=0.01, max_pending=10, retry_delay=0.01)
+    for i in range(50):
+        recorder.submit(record(i))
+
+    stats = recorder.stats()
+    assert stats["pending"] <= 10
+    assert stats["dropped"] >= 40
+    recorder.close(timeout=2)
+    assert not recorder.submit(record(51))
+
+def test_fs_adapter_records_one_row_per_device(tmp_path):
+    adapter = FileSystemAdapter("FW", "DB", str(tmp_path))
+    adapter.record_detected([record(1, SLOT_INFO), record(2)])
+
+    rows = [json.loads(line) for line in (tmp_path / FileSystemAdapter.DETECTED_FILE_NAME).read_text().splitlines()]
+    assert [(row["converter"], row["slot"], row["device"], row["variant"]) for row in rows] == \
+           [("RPZES.1.ETH1", "5", "DB", "3"), ("RPZES.1.ETH1", "5", "MF", "4"), ("RPZES.2.ETH1", None, None, None)]
+    assert rows == detected_rows(record(1, SLOT_INFO)) + detected_rows(record(2))
+
+def test_server_stop_flushes_recorder(tmp_path):
+    server = ProgramManagerServer(name_file=str(tmp_path / "name"),
+                                  name_snapshot_dir=str(tmp_path / "snapshot"),
+                                  fw_repo_loc=str(tmp_path),
+                                  expected_data="fs",
+                                  db_data=None)
+    server.recorder.flush_interval = 60
+    server.recorder.submit(record(1, SLOT_INFO))
+    server.stop()
+
+    assert len((tmp_path / FileSystemAdapter.DETECTED_FILE_NAME).read_text().splitlines()) == 2
@@ -1 +1,58 @@
-import pytest
\ No newline at end of file
+import os
+
+import pytest
+
+import program_manager.regfgc3_programmer as programmer
+from fakes import SLOT_INFO, FakeFgcSession
+
+pytestmark = pytest.mark.usefixtures("fake_clock")
+
+@pytest.fixture
+def fw_file(tmp_path):
+    fw_file = tmp_path / "EDA_2261-MF-IGBT_34-208-208-B58C.bin"
+    fw_file.write_bytes(os.urandom(64))
+    return str(fw_file)
+
+def test_program_goes_through_production_boot(fw_file):
+    fgc = FakeFgcSession()
+    attempts = programmer.program("RPZES.866.15.ETH1", "5", "VS_STATE_CTRL", "MF", "IGBT_34", "208", "208", "B58C", fw_file, fgc_session=fgc)
+
+    assert attempts == 0
+    assert "TO_PROD_BOOT" in fgc.modes
+
+def test_crate_transaction_boots_each_slot_once(fw_file):
+    fgc  = FakeFgcSession()
+    jobs = [("5", "VS_STATE_CTRL", "MF", "IGBT_34", "208", "208", "B58C", fw_file),
+            ("6", "VS_REG_DSP", "MF", "IGBT_34", "208", "208", "B58C", fw_file),
+            ("6", "VS_REG_DSP", "DEVICE_2", "IGBT_34", "208", "208", "B58C", fw_file),
+            ("6", "VS_REG_DSP", "DEVICE_3", "IGBT_34", "208", "208", "B58C", fw_file)]
+
+    results, slot_info = programmer.program_crate("RPZES.866.15.ETH1", jobs, fgc_session=fgc)
+
+    assert results == {("5", "MF"): 0, ("6", "MF"): 0, ("6", "DEVICE_2"): 0, ("6", "DEVICE_3"): 0}
+    assert fgc.modes.count("TRANSFERRED") == 4
+    assert fgc.modes.count("SET_PB_PARS") == 2
+    assert fgc.modes.count("TO_PROD_BOOT") == 2
+    assert fgc.slot_rescans == 1
+    assert slot_info == SLOT_INFO
+    # The caller's connection is left open
+    assert not fgc.disconnected
+
+def test_slot_is_booted_when_its_last_device_fails(fw_file):
+    fgc  = FakeFgcSession(failing_device="DEVICE_3")
+    jobs = [("6", "VS_REG_DSP", "MF", "IGBT_34", "208", "208", "B58C", fw_file),
+            ("6", "VS_REG_DSP", "DEVICE_2", "IGBT_34", "208", "208", "B58C", fw_file),
+            ("6", "VS_REG_DSP", "DEVICE_3", "IGBT_34", "208", "208", "B58C", fw_file)]
+
+    results, _ = programmer.program_crate("RPZES.866.15.ETH1", jobs, fgc_session=fgc)
+
+    assert results == {("6", "MF"): 0, ("6", "DEVICE_2"): 0, ("6", "DEVICE_3"): 3}
+    # The last device reprogrammed switches the board, once
+    assert fgc.booted_by == ["DEVICE_2"]
+
+def test_slot_without_reprogrammed_device_is_not_booted(fw_file):
+    fgc  = FakeFgcSession(failing_device="MF")
+    jobs = [("6", "VS_REG_DSP", "MF", "IGBT_34", "208", "208", "B58C", fw_file)]
+
+    assert not programmer.switch_to_production_boot("RPZES.866.15.ETH1", jobs, {("6", "MF"): 3}, fgc)
+    assert fgc.modes == []
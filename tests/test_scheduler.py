@@ -0,0 +1,180 @@
+import threading
+import time
+
+from program_manager.area_worker import JOB_ACCEPTED, JOB_DEFERRED, JOB_REJECTED, AreaProgramManager
+from program_manager.scheduler import WorkScheduler
+
+
+class Concurrency:
+    """Job function recording the maximum number of jobs running at once per key."""
+    def __init__(self, key_of, duration=0.02):
+        self.key_of   = key_of
+        self.duration = duration
+        self.running  = dict()
+        self.maximum  = dict()
+        self.done     = list()
+        self._lock    = threading.Lock()
+
+    def __call__(self, logger, job_name):
+        key = self.key_of(job_name)
+        with self._lock:
+            self.running[key] = self.running.get(key, 0) + 1
+            self.maximum[key] = max(self.maximum.get(key, 0), self.running[key])
+
+        time.sleep(self.duration)
+        with self._lock:
+            self.running[key] -= 1
+            self.done.append(job_name)
+
+
+def test_idle_workers_steal_from_busy_area():
+    scheduler = WorkScheduler(max_workers=4, max_per_area=4)
+    busy      = AreaProgramManager("BUSY", scheduler=scheduler)
+    idle      = AreaProgramManager("IDLE", scheduler=scheduler)
+    work      = Concurrency(lambda job_name: "BUSY")
+
+    busy.map(work, [f"FGC{i}" for i in range(16)])
+    busy.wait_completion()
+    idle.wait_completion()
+    scheduler.stop()
+
+    assert len(work.done) == 16
+    assert work.maximum["BUSY"] == 4
+    assert scheduler.stats()["steals"] > 0
+
+def test_area_cap_is_enforced():
+    scheduler = WorkScheduler(max_workers=6, max_per_area=2)
+    area      = AreaProgramManager("AREA", scheduler=scheduler)
+    work      = Concurrency(lambda job_name: "AREA")
+
+    area.map(work, [f"FGC{i}" for i in range(8)])
+    area.wait_completion()
+    scheduler.stop()
+
+    assert work.maximum["AREA"] == 2
+
+def test_gateway_cap_does_not_block_other_gateways():
+    scheduler = WorkScheduler(max_workers=6, max_per_area=6, max_per_gateway=1)
+    area      = AreaProgramManager("AREA", scheduler=scheduler)
+    work      = Concurrency(lambda job_name: job_name.split(".")[0])
+
+    for i in range(4):
+        area.add_job(work, f"GW1.FGC{i}", gateway="GW1")
+
+    area.add_job(work, "GW2.FGC0", gateway="GW2")
+    area.wait_completion()
+    scheduler.stop()
+
+    assert work.maximum["GW1"] == 1
+    # The GW2 job was not kept behind the GW1 backlog
+    assert work.done.index("GW2.FGC0") < 2
+
+def test_stop_releases_idle_workers():
+    scheduler = WorkScheduler(max_workers=3, min_workers=3)
+    workers   = list(scheduler._workers)
+    scheduler.stop()
+    assert len(workers) == 3
+    assert all(not worker.is_alive() for worker in workers)
+
+def test_workers_start_on_demand_and_retire_when_idle():
+    scheduler = WorkScheduler(max_workers=4, idle_timeout=0.05)
+    area      = AreaProgramManager("AREA", scheduler=scheduler)
+    work      = Concurrency(lambda job_name: "AREA")
+    assert scheduler.stats()["workers"] == 0
+
+    area.map(work, [f"FGC{i}" for i in range(8)])
+    area.wait_completion()
+    assert scheduler.stats()["workers_started"] == 4
+
+    deadline = time.monotonic() + 2
+    while scheduler.stats()["workers"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert scheduler.stats()["workers"] == 0
+    assert scheduler.stats()["workers_retired"] == 4
+
+    # A job queued after scaling to zero starts a worker again
+    area.add_job(work, "FGC8")
+    area.wait_completion()
+    assert "FGC8" in work.done
+    scheduler.stop()
+
+def test_idle_worker_is_reused():
+    scheduler = WorkScheduler(max_workers=4, idle_timeout=5)
+    area      = AreaProgramManager("AREA", scheduler=scheduler)
+    work      = Concurrency(lambda job_name: "AREA", duration=0)
+
+    for i in range(5):
+        area.add_job(work, f"FGC{i}")
+        area.wait_completion()
+
+    assert scheduler.stats()["workers_started"] == 1
+    scheduler.stop()
+
+def test_add_job_never_blocks_and_defers_overflow(monkeypatch):
+    monkeypatch.setattr(AreaProgramManager, "MAX_NUM_TASKS", 2)
+    monkeypatch.setattr(AreaProgramManager, "MAX_NUM_DEFERRED", 2)
+    release   = threading.Event()
+    scheduler = WorkScheduler(max_workers=1)
+    area      = AreaProgramManager("AREA", scheduler=scheduler)
+    started   = list()
+
+    def work(logger, job_name):
+        started.append(job_name)
+        release.wait()
+
+    outcomes = area.map(work, [f"FGC{i}" for i in range(6)])
+    # One job may have been taken by the worker already, making room for a deferred one
+    assert outcomes[:2] == [JOB_ACCEPTED, JOB_ACCEPTED]
+    assert outcomes[-1] == JOB_REJECTED
+    assert area.add_job(work, "FGC0") == JOB_ACCEPTED
+
+    stats = area.stats()
+    assert stats["rejected"] >= 1
+    assert stats["coalesced"] == 1
+
+    release.set()
+    area.wait_completion()
+    scheduler.stop()
+
+    accepted = [f"FGC{i}" for i, outcome in enumerate(outcomes) if outcome != JOB_REJECTED]
+    assert sorted(started) == sorted(accepted)
+    assert area.stats()["deferred"] == 0
+
+def test_deferred_duplicate_is_coalesced(monkeypatch):
+    monkeypatch.setattr(AreaProgramManager, "MAX_NUM_TASKS", 1)
+    # No workers, jobs stay queued
+    scheduler = WorkScheduler(max_workers=0)
+    area      = AreaProgramManager("AREA", scheduler=scheduler)
+    work      = lambda logger, job_name: None
+
+    assert area.add_job(work, "FGC0") == JOB_ACCEPTED
+    assert area.add_job(work, "FGC1") == JOB_DEFERRED
+    assert area.add_job(work, "FGC1") == JOB_DEFERRED
+    assert area.stats() == {"depth": 1, "deferred": 1, "jobs": 1, "accepted": 1, "deferrals": 1, "rejected": 0, "coalesced": 1}
+
+def test_wakeups_racing_idle_timeouts_are_not_lost():
+    # Idle workers time out all the time while jobs are queued, so notify() often
+    # picks a worker whose wait is timing out
+    scheduler = WorkScheduler(max_workers=8, min_workers=8, idle_timeout=0.0002)
+    area      = AreaProgramManager("AREA", scheduler=scheduler)
+    work      = Concurrency(lambda job_name: "AREA", duration=0)
+
+    for burst in range(1000):
+        for i in range(8):
+            area.add_job(work, f"FGC{burst}.{i}")
+
+    area.wait_completion()
+
+    # Idle workers now only wake up when notified: a lost wakeup strands the job
+    scheduler.idle_timeout = 60
+    time.sleep(0.05)
+    for i in range(20):
+        area.add_job(work, f"LAST{i}")
+        deadline = time.monotonic() + 2
+        while f"LAST{i}" not in work.done and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+        assert f"LAST{i}" in work.done
+
+    scheduler.stop()
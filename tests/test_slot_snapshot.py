@@ -0,0 +1,93 @@
+import struct
+
+import pytest
+
+from program_manager.regfgc3_programmer import parse_slot_info
+from program_manager.slot_snapshot import FORMAT_VERSION, MAGIC, SlotInfoStore
+
+CRATE = ",".join(["------------------------------", "SLOT       5", "BOARD       VS_STATE_CTRL", "STATE      ProductionBoot",
+                  "Device     DB", "Variant    3", "Var_Rev    208", "API_Rev    200", "",
+                  "Device     MF", "Variant    IGBT_34", "Var_Rev    208", "API_Rev    208", "",
+                  "------------------------------", "SLOT       6", "BOARD       VS_REG_DSP", "STATE      DownloadBoot",
+                  "------------------------------", "SLOT       10", "BOARD       VS_ANA", "STATE      ProductionBoot",
+                  "Device     DB", "Variant    3", "Var_Rev    208", "API_Rev    200", ""])
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "snapshot" / "slot_info.snapshot")
+
+def test_snapshot_round_trip(path):
+    store = SlotInfoStore(path)
+    store.update("RPZES.1", CRATE, 100.0)
+    store.update("RPZES.2", parse_slot_info(CRATE.replace("IGBT_34", "IGBT_35")), 200.0)
+    assert store.save()
+    assert not store.save()
+
+    loaded = SlotInfoStore(path)
+    assert loaded.load() == 2
+    assert loaded.generation == 1
+    assert sorted(loaded.converters()) == ["RPZES.1", "RPZES.2"]
+    assert repr(loaded.get("RPZES.1")) == repr(parse_slot_info(CRATE))
+    assert loaded.get("RPZES.2").device("5", "MF").Variant == "IGBT_35"
+    assert loaded.get("RPZES.1")["6"].devices == ()
+    assert loaded.timestamp("RPZES.2") == 200.0
+    assert loaded.get("RPZES.3") is None
+    loaded.close()
+
+def test_snapshot_incremental_updates(path):
+    store = SlotInfoStore(path)
+    store.update("RPZES.1", CRATE, 100.0)
+    store.update("RPZES.2", CRATE, 100.0)
+    store.save()
+
+    store = SlotInfoStore(path)
+    store.load()
+    first = store.get("RPZES.1")
+    assert store.get("RPZES.1") is first
+    assert not store.update("RPZES.1", "", 50.0)
+    assert store.update("RPZES.1", CRATE.replace("208,API_Rev    208", "209,API_Rev    208"), 150.0)
+    store.remove("RPZES.2")
+    assert store.get("RPZES.1") is not first
+    assert "RPZES.2" not in store
+
+    updated = store.get("RPZES.1")
+    store.save()
+    assert store.get("RPZES.1") is updated
+    assert store.stats()["generation"] == 2
+    store.close()
+
+    reloaded = SlotInfoStore(path)
+    assert reloaded.load() == 1
+    assert reloaded.get("RPZES.1").device("5", "MF").Var_Rev == "209"
+    assert reloaded.timestamp("RPZES.1") == 150.0
+    reloaded.close()
+
+@pytest.mark.parametrize("contents", [b"", b"garbage" * 10,
+                                      struct.pack("<8sIQIIII", MAGIC, FORMAT_VERSION + 1, 1, 0, 0, 0, 0)])
+def test_unreadable_snapshot_is_ignored(path, contents):
+    store = SlotInfoStore(path)
+    store.update("RPZES.1", CRATE, 100.0)
+    store.save()
+    with open(path, "wb") as fh:
+        fh.write(contents)
+
+    store = SlotInfoStore(path)
+    assert store.load() == 0
+    assert len(store) == 0
+
+def test_corrupt_snapshot_is_ignored(path):
+    store = SlotInfoStore(path)
+    store.update("RPZES.1", CRATE, 100.0)
+    store.save()
+    with open(path, "r+b") as fh:
+        fh.seek(-1, 2)
+        fh.write(b"\xff")
+
+    assert SlotInfoStore(path).load() == 0
+
+def test_memory_only_store():
+    store = SlotInfoStore()
+    store.update("RPZES.1", CRATE)
+    assert store.load() == 0
+    assert not store.save()
+    assert store.slot_infos()["RPZES.1"].device("10", "DB").Variant == "3"
@@ -0,0 +1,65 @@
+from program_manager.status_ingest import StatusIngester
+from fakes import FakeClock
+
+def status(recv_time, **devices):
+    return {"recv_time_sec": recv_time,
+            "devices": {dev: {"ST_UNLATCHED": st} for dev, st in devices.items()}}
+
+def make_ingester(**kwargs):
+    clock = FakeClock(now=1000.0)
+    return StatusIngester(area_of=lambda dev: "TEST", clock=clock, **kwargs), clock
+
+def test_first_reply_reports_all_sync_devices():
+    ingester, clock = make_ingester()
+    rsp = {"GW1": status(clock.now, FGC1="SYNC_REGFGC3 PC_PERMIT", FGC2="PC_PERMIT"),
+           "GW2": status(clock.now, FGC3="PC_PERMIT SYNC_REGFGC3")}
+
+    assert sorted(ingester.ingest(rsp)) == [("FGC1", "TEST"), ("FGC3", "TEST")]
+    assert ingester.sync_devices == {"FGC1", "FGC3"}
+
+def test_unchanged_gateways_are_skipped():
+    ingester, clock = make_ingester()
+    rsp = {"GW1": status(clock.now, FGC1="SYNC_REGFGC3")}
+    ingester.ingest(rsp)
+
+    clock.now += 1
+    assert ingester.ingest(rsp) == []
+    assert ingester.gateways_skipped == 1
+
+def test_only_new_sync_devices_are_reported():
+    ingester, clock = make_ingester()
+    ingester.ingest({"GW1": status(clock.now, FGC1="SYNC_REGFGC3", FGC2="")})
+
+    clock.now += 1
+    assert ingester.ingest({"GW1": status(clock.now, FGC1="SYNC_REGFGC3", FGC2="SYNC_REGFGC3")}) == [("FGC2", "TEST")]
+
+    clock.now += 1
+    assert ingester.ingest({"GW1": status(clock.now, FGC1="", FGC2="SYNC_REGFGC3")}) == []
+    assert ingester.sync_devices == {"FGC2"}
+
+def test_flag_substrings_do_not_match():
+    ingester, clock = make_ingester()
+    assert ingester.ingest({"GW1": status(clock.now, FGC1="NO_SYNC_REGFGC3_X")}) == []
+
+def test_stale_and_missing_gateways_are_forgotten():
+    ingester, clock = make_ingester()
+    ingester.ingest({"GW1": status(clock.now, FGC1="SYNC_REGFGC3"),
+                     "GW2": status(clock.now, FGC2="SYNC_REGFGC3")})
+
+    clock.now += 60
+    assert ingester.ingest({"GW1": status(clock.now - 60, FGC1="SYNC_REGFGC3")}) == []
+    assert ingester.sync_devices == set()
+
+def test_full_resync_reports_all_sync_devices_again():
+    ingester, clock = make_ingester(full_resync_sec=30)
+    rsp = {"GW1": status(clock.now, FGC1="SYNC_REGFGC3")}
+    ingester.ingest(rsp)
+
+    clock.now += 30
+    rsp["GW1"]["recv_time_sec"] = clock.now
+    assert ingester.ingest(rsp) == [("FGC1", "TEST")]
+
+def test_unknown_devices_are_ignored():
+    clock    = FakeClock(now=1000.0)
+    ingester = StatusIngester(area_of=lambda dev: None, clock=clock)
+    assert ingester.ingest({"GW1": status(clock.now, FGC1="SYNC_REGFGC3")}) == []
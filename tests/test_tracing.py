@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from program_manager.tracing import JobTrace, Tracer, current_trace, set_current_trace
+
+
+def test_spans_are_timed_and_keep_attributes():
+    trace = JobTrace("RPZES.866.15.ETH1")
+    trace.start_span("queued")
+    trace.end_span("queued")
+    with trace.span("state.PROGRAMMING", mode="PROGRAMMED") as span:
+        span.attrs["polls"] = 4
+
+    names = [span.name for span in trace.spans]
+    assert names == ["queued", "state.PROGRAMMING"]
+    assert all(span.duration >= 0 for span in trace.spans)
+    assert trace.spans[1].attrs == {"mode": "PROGRAMMED", "polls": 4}
+
+def test_failed_span_records_error():
+    trace = JobTrace("RPZES.866.15.ETH1")
+    with pytest.raises(RuntimeError):
+        with trace.span("connect"):
+            raise RuntimeError("no route to host")
+
+    assert trace.spans[0].attrs["error"] == "no route to host"
+    assert trace.spans[0].duration is not None
+
+def test_finished_traces_are_written_as_json_lines(tmp_path):
+    trace_file = tmp_path / "traces.jsonl"
+    tracer = Tracer(str(trace_file))
+    for job in ("A", "B"):
+        trace = tracer.new_trace(job, area="866")
+        trace.start_span("queued")
+        trace.finish(result="ok")
+
+    tracer.close()
+    lines = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert [line["job"] for line in lines] == ["A", "B"]
+    assert lines[0]["attrs"] == {"area": "866", "result": "ok"}
+    assert lines[0]["spans"][0]["duration"] is not None
+
+def test_current_trace_is_per_thread():
+    trace = JobTrace("A")
+    set_current_trace(trace)
+    try:
+        assert current_trace() is trace
+
+    finally:
+        set_current_trace(None)
+
+    assert current_trace() is not trace
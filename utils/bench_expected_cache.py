@@ -0,0 +1,81 @@
+"""Compares the former FileSystemAdapter.get_expected, listing the DB folder on
+every call, with the indexed and cached one, on one pass over the fleet.
+
+The DB folder has one expected data file per converter (5000 by default).
+Usage:
+    python bench_expected_cache.py [converters]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from program_manager.adapters import FileSystemAdapter
+
+SLOTS_PER_CRATE = 20
+PASSES          = 3
+
+class LegacyFileSystemAdapter(FileSystemAdapter):
+    def __init__(self, fw_subfolder, db_subfolder, fw_file_loc):
+        super().__init__(fw_subfolder, db_subfolder, fw_file_loc)
+        self._converter_last_time_updated = dict()
+
+    def get_expected(self, fgc_name):
+        expected_data = None
+        expected_converters = os.listdir(self._db_files)
+
+        if fgc_name not in expected_converters:
+            raise FileNotFoundError
+
+        expected_converter_file = os.path.join(self._db_files, fgc_name)
+        last_time_updated       = int(os.path.getmtime(expected_converter_file))
+
+        try:
+            last_time = self._converter_last_time_updated[fgc_name]
+
+        except KeyError:
+            self._converter_last_time_updated[fgc_name] = last_time_updated
+            expected_data = self._parse_expected_file(expected_converter_file)
+
+        else:
+            if last_time_updated > last_time:
+                expected_data = self._parse_expected_file(expected_converter_file)
+
+        return expected_data
+
+def write_expected_files(db_folder, num_converters):
+    os.makedirs(db_folder)
+    converters = [f"RPZES.{i}.ETH1" for i in range(num_converters)]
+    for converter in converters:
+        with open(os.path.join(db_folder, converter), "w") as efh:
+            efh.write("# slot,board,device,variant,var_revision,api_revision\n")
+            efh.writelines(f"{slot},VS_BOARD_{slot},MF,IGBT_34,208,208\n" for slot in range(1, SLOTS_PER_CRATE + 1))
+
+    return converters
+
+def fleet_passes(adapter, converters):
+    times = list()
+    for _ in range(PASSES):
+        start = time.perf_counter()
+        for converter in converters:
+            adapter.get_expected(converter)
+
+        times.append(time.perf_counter() - start)
+
+    return times
+
+def main(num_converters):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        converters = write_expected_files(os.path.join(tmp_dir, "DB"), num_converters)
+
+        legacy = fleet_passes(LegacyFileSystemAdapter("FW", "DB", tmp_dir), converters)
+        cached = fleet_passes(FileSystemAdapter("FW", "DB", tmp_dir), converters)
+
+    print(f"{num_converters} converters, one get_expected per converter:")
+    print(f"listdir per call : first pass {legacy[0]:8.3f} s, next passes {min(legacy[1:]):8.3f} s (data returned only on the first pass)")
+    print(f"indexed cache    : first pass {cached[0]:8.3f} s, next passes {min(cached[1:]):8.3f} s")
+    print(f"speedup          : x{legacy[0] / cached[0]:.0f} first pass, x{min(legacy[1:]) / min(cached[1:]):.0f} next passes")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,104 @@
+"""Measures the time one device takes to go through ProgramManagerFsm.process()
+with the legacy fixed 3 s polling (and 5 s digest sleep) and with the adaptive
+poll schedules. Runs on a virtual clock against a simulated FGC, so it does not
+need hardware and it does not really sleep.
+Usage:
+    python bench_fsm_polling.py
+"""
+
+import logging
+import os
+import tempfile
+import types
+
+import program_manager.pm_fsm as fsm
+
+# Seconds the simulated FGC needs to reach each state
+STATE_LATENCIES = {
+    "WAITING"      : 0.3,
+    "TRANSFERRING" : 1.5,
+    "TRANSFERRED"  : 0.2,
+    "GET_PROG_INFO": 0.3,
+    "PROGRAMMING"  : 8.0,
+    "PROG_CHK"     : 1.5,
+    "PROGRAMMED"   : 0.2,
+    "SET_PB_PARS"  : 0.3,
+    "TO_PROD_BOOT" : 5.0,
+    "CLEAN_UP"     : 0.3,
+}
+
+LEGACY_SCHEDULE  = fsm.PollSchedule(first_delay=0, initial=3, factor=1, maximum=3)
+LEGACY_SCHEDULES = dict({name: LEGACY_SCHEDULE for name in STATE_LATENCIES},
+                        TRANSFERRING=fsm.PollSchedule(first_delay=5, initial=3, factor=1, maximum=3))
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def monotonic(self):
+        return self.now
+
+class SimulatedFgc:
+    """FGC moving one interim state forward each time REGFGC3.PROG.FSM.MODE is set."""
+    def __init__(self, clock):
+        self._clock      = clock
+        self._mode       = None
+        self._path       = list()
+        self._state      = "UNINITIALIZED"
+        self._transition = None
+
+    def _current_state(self):
+        if self._transition and self._transition[0] <= self._clock.now:
+            self._state      = self._transition[1]
+            self._transition = None
+
+        return self._state
+
+    def get(self, prop):
+        value = self._current_state() if prop == "REGFGC3.PROG.FSM.STATE" else ""
+        return types.SimpleNamespace(value=value)
+
+    def set(self, prop, value):
+        if prop != "REGFGC3.PROG.FSM.MODE":
+            return
+
+        state = self._current_state()
+        if value != self._mode:
+            self._mode = value
+            self._path = [s(None).name for s in fsm.ProgramManagerFsm.STATE_TO_MODE_TO_INTERIM_STATES[state][value]]
+
+        if self._path and not self._transition:
+            name = self._path.pop(0)
+            self._transition = (self._clock.now + STATE_LATENCIES[name], name)
+
+def run_device(fw_file, poll_schedules):
+    clock   = VirtualClock()
+    fsm.time = types.SimpleNamespace(sleep=clock.sleep, monotonic=clock.monotonic)
+    fgc     = SimulatedFgc(clock)
+    logger  = logging.getLogger("bench_fsm_polling")
+    pm_fsm  = fsm.ProgramManagerFsm(("RPZES.866.15.ETH1", "5", "VS_STATE_CTRL", "MF", "IGBT_34", "208", "208", "B58C", fw_file),
+                                    fgc,
+                                    logger=logger,
+                                    poll_schedules=poll_schedules)
+    pm_fsm.process()
+    return clock.now
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fw_file = os.path.join(tmp_dir, "EDA_2261-MF-IGBT_34-208-208-B58C.bin")
+        with open(fw_file, "wb") as fwh:
+            fwh.write(os.urandom(1024))
+
+        legacy_t   = run_device(fw_file, LEGACY_SCHEDULES)
+        adaptive_t = run_device(fw_file, None)
+
+    fgc_t = sum(STATE_LATENCIES.values()) + STATE_LATENCIES["WAITING"]
+    print(f"FGC processing time : {fgc_t:6.1f} s")
+    print(f"Legacy polling      : {legacy_t:6.1f} s")
+    print(f"Adaptive polling    : {adaptive_t:6.1f} s ({legacy_t - adaptive_t:.1f} s saved per device)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Compares the legacy word by word firmware encoder with the bulk encoder.
+Usage:
+    python bench_fw_payload.py [size_bytes ...]
+"""
+
+import os
+import sys
+import time
+from binascii  import hexlify
+from functools import partial
+from io        import BytesIO
+
+from program_manager.fw_payload import CHARS_PER_WORD, FW_FILE_LIMIT_BYTES, LIMIT_GW_CMD_WORDS
+from program_manager.fw_payload import encode_fw_bin
+
+REPETITIONS = 5
+
+def legacy_encode_fw_bin(fw_bin):
+    packet = list()
+    fwh = BytesIO(fw_bin)
+    for word in iter(partial(fwh.read, 4), b""):
+        ascii_word = hexlify(word).decode()
+        ascii_word += "".join(["0"] * (CHARS_PER_WORD - len(ascii_word)))
+        packet.append(hex(int(ascii_word, 16)))
+
+    return [(i, ",".join(packet[i:i + LIMIT_GW_CMD_WORDS])) for i in range(0, len(packet), LIMIT_GW_CMD_WORDS)]
+
+def best_time(func, fw_bin):
+    times = list()
+    for _ in range(REPETITIONS):
+        start = time.perf_counter()
+        func(fw_bin)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+def main(sizes):
+    for size in sizes:
+        # Odd sizes exercise the padding of the last word
+        fw_bin = os.urandom(size)
+        assert legacy_encode_fw_bin(fw_bin) == encode_fw_bin(fw_bin)
+
+        legacy_time = best_time(legacy_encode_fw_bin, fw_bin)
+        bulk_time   = best_time(encode_fw_bin, fw_bin)
+        print(f"{size:>9} bytes: legacy {legacy_time * 1000:9.2f} ms, bulk {bulk_time * 1000:9.2f} ms, speedup x{legacy_time / bulk_time:.1f}")
+
+if __name__ == "__main__":
+    main([int(s) for s in sys.argv[1:]] or [256 * 1024 + 1, 1024 * 1024 + 2, FW_FILE_LIMIT_BYTES - 1])
@@ -0,0 +1,63 @@
+"""Makespan of a skewed rollout with per area workers and with a shared scheduler.
+
+A few busy areas have long queues while most areas only have a couple of
+jobs. Jobs sleep for a fixed time, standing for a reprogramming.
+Usage:
+    python bench_scheduler.py [job_duration_sec]
+"""
+
+import sys
+import threading
+import time
+
+from program_manager.area_worker import AreaProgramManager
+from program_manager.scheduler import WorkScheduler
+
+NUM_AREAS        = 40
+BUSY_AREAS       = 3
+BUSY_AREA_JOBS   = 150
+IDLE_AREA_JOBS   = 2
+GATEWAYS_PER_AREA = 10
+
+def workload():
+    for a in range(NUM_AREAS):
+        num_jobs = BUSY_AREA_JOBS if a < BUSY_AREAS else IDLE_AREA_JOBS
+        yield f"AREA{a}", [(f"RPZES.{a}.{j}.ETH1", f"CFC-{a}-{j % GATEWAYS_PER_AREA}") for j in range(num_jobs)]
+
+def run(job_duration, scheduler=None):
+    def work(logger, job_name):
+        time.sleep(job_duration)
+
+    threads_before = threading.active_count()
+    start = time.perf_counter()
+
+    areas = list()
+    for area_name, jobs in workload():
+        area = AreaProgramManager(area_name, scheduler=scheduler)
+        areas.append(area)
+        for job_name, gateway in jobs:
+            area.add_job(work, job_name, gateway=gateway)
+
+    threads = threading.active_count() - threads_before
+    for area in areas:
+        area.wait_completion()
+
+    makespan = time.perf_counter() - start
+    if scheduler:
+        scheduler.stop()
+
+    return makespan, threads
+
+def main(job_duration):
+    legacy_makespan, legacy_threads = run(job_duration)
+    print(f"per area workers ({AreaProgramManager.MAX_NUM_WORKERS} each): makespan {legacy_makespan:6.2f} s, {legacy_threads} threads")
+
+    scheduler = WorkScheduler()
+    shared_makespan, _ = run(job_duration, scheduler)
+    stats = scheduler.stats()
+    print(f"shared scheduler ({scheduler.max_workers} workers, {scheduler.max_per_area} per area, {scheduler.max_per_gateway} per gateway): "
+          f"makespan {shared_makespan:6.2f} s, {stats['workers']} threads, {stats['steals']} steals")
+    print(f"makespan x{legacy_makespan / shared_makespan:.1f} shorter")
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.1)
@@ -0,0 +1,100 @@
+"""Compares the legacy REGFGC3.SLOT_INFO parser with the single pass parser.
+
+Parses synthetic replies of a full crate, then of 1000 converters, and looks
+up one device in every slot of each reply.
+Usage:
+    python bench_slot_info.py [converters]
+"""
+
+import sys
+import time
+from collections import namedtuple
+
+from program_manager.regfgc3_programmer import parse_slot_info
+
+REPETITIONS     = 5
+SLOTS_PER_CRATE = 20
+SEPARATOR       = "------------------------------"
+
+def legacy_parse_single_slot(single_slot):
+    Board   = namedtuple("Board", "SLOT, BOARD, STATE, devices")
+    Device  = namedtuple("Device", "Device, Variant, Var_Rev, API_Rev")
+
+    single_slot.pop()
+    devices = list()
+
+    dev_pos = [i for i, element in enumerate(single_slot) if element.startswith("Device")]
+    for i in range(len(dev_pos)):
+        idx_tuple = dev_pos[i:i+2]
+        if len(idx_tuple) == 1:
+            single_device_info = single_slot[idx_tuple[0]:]
+        else:
+            single_device_info = single_slot[idx_tuple[0]:idx_tuple[1]]
+
+        device_dict = dict([el.split() for el in single_device_info if el.strip()])
+        devices.append(Device(**device_dict))
+
+    board_info_dict = dict([el.split() for el in single_slot[0:3]])
+    board_info_dict["devices"] = devices
+    return Board(**board_info_dict)
+
+def legacy_parse_slot_info(slot_info_reply):
+    si_list = slot_info_reply.split(",")
+    slot_start_pos = [idx for idx, element in enumerate(si_list) if element.startswith("SLOT")]
+    boards = list()
+    for i in range(len(slot_start_pos)):
+        idx_tuple = slot_start_pos[i : i+2]
+        if len(idx_tuple) == 1:
+            single_slot_info = si_list[idx_tuple[0]:]
+        else:
+            single_slot_info = si_list[idx_tuple[0]:idx_tuple[1]]
+
+        boards.append(legacy_parse_single_slot(single_slot_info))
+
+    return boards
+
+def legacy_lookups(reply):
+    boards = legacy_parse_slot_info(reply)
+    for slot in range(1, SLOTS_PER_CRATE + 1):
+        for b in boards:
+            if b.SLOT == str(slot):
+                next(d for d in b.devices if d.Device == "MF")
+                break
+
+def new_lookups(reply):
+    slot_info = parse_slot_info(reply)
+    for slot in range(1, SLOTS_PER_CRATE + 1):
+        slot_info.device(slot, "MF")
+
+def crate_reply(slots=SLOTS_PER_CRATE):
+    elements = list()
+    for slot in range(1, slots + 1):
+        elements += [SEPARATOR, f"SLOT       {slot}", f"BOARD       VS_BOARD_{slot}", "STATE      DownloadBoot"]
+        for device in ("DB", "MF", "DEVICE_2"):
+            elements += [f"Device     {device}", "Variant    3", f"Var_Rev    {slot}", "API_Rev    200", ""]
+
+    return ",".join(elements) + ","
+
+def best_time(func, replies):
+    times = list()
+    for _ in range(REPETITIONS):
+        start = time.perf_counter()
+        for reply in replies:
+            func(reply)
+
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+def main(converters):
+    reply = crate_reply()
+    assert [tuple(b[:3]) + tuple(b.devices) for b in legacy_parse_slot_info(reply)] == \
+           [tuple(b[:3]) + b.devices for b in parse_slot_info(reply)]
+
+    for label, replies in (("full crate", [reply]), (f"{converters} converters", [reply] * converters)):
+        legacy_time = best_time(legacy_lookups, replies)
+        new_time    = best_time(new_lookups, replies)
+        print(f"{label:>16}: legacy {legacy_time * 1000:9.2f} ms, single pass {new_time * 1000:9.2f} ms, speedup x{legacy_time / new_time:.1f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
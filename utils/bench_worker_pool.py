@@ -0,0 +1,98 @@
+"""Idle CPU use and enqueue to start latency of the polling workers and of the
+elastic scheduler.
+
+The polling workers reproduce the former FgcWorker loop: 20 threads per area
+getting from the queue with a 2 s timeout, sleeping 1 s when it is empty.
+Usage:
+    python bench_worker_pool.py [areas] [idle_sec]
+"""
+
+import queue
+import random
+import sys
+import threading
+import time
+
+from program_manager.area_worker import AreaProgramManager
+from program_manager.scheduler import WorkScheduler
+
+WORKERS_PER_AREA = 20
+LATENCY_JOBS     = 20
+
+class PollingWorker(threading.Thread):
+    def __init__(self, tasks):
+        super().__init__(daemon=True)
+        self._tasks      = tasks
+        self._stop_event = threading.Event()
+        self.start()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                func, submitted = self._tasks.get(timeout=2)
+
+            except queue.Empty:
+                time.sleep(1)
+                continue
+
+            func(submitted)
+            self._tasks.task_done()
+
+    def stop(self):
+        self._stop_event.set()
+
+def idle_cpu(idle_sec):
+    start_cpu, start = time.process_time(), time.perf_counter()
+    time.sleep(idle_sec)
+    return (time.process_time() - start_cpu) / (time.perf_counter() - start)
+
+def measure_latencies(submit):
+    latencies = list()
+    done      = threading.Semaphore(0)
+
+    def work(submitted):
+        latencies.append(time.perf_counter() - submitted)
+        done.release()
+
+    for _ in range(LATENCY_JOBS):
+        time.sleep(random.uniform(0, 0.5))
+        submit(work, time.perf_counter())
+        done.acquire()
+
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[-1]
+
+def bench_polling(areas, idle_sec):
+    queues  = [queue.Queue() for _ in range(areas)]
+    workers = [PollingWorker(q) for q in queues for _ in range(WORKERS_PER_AREA)]
+    time.sleep(3)
+
+    cpu = idle_cpu(idle_sec)
+    p50, worst = measure_latencies(lambda work, submitted: queues[0].put((work, submitted)))
+
+    for worker in workers:
+        worker.stop()
+
+    return len(workers), cpu, p50, worst
+
+def bench_elastic(areas, idle_sec):
+    scheduler = WorkScheduler(max_workers=areas * WORKERS_PER_AREA, idle_timeout=1)
+    area_pms  = [AreaProgramManager(f"AREA{i}", scheduler=scheduler) for i in range(areas)]
+    time.sleep(3)
+
+    cpu     = idle_cpu(idle_sec)
+    threads = scheduler.stats()["workers"]
+    job_ids = iter(range(LATENCY_JOBS))
+    p50, worst = measure_latencies(lambda work, submitted: area_pms[0].add_job(lambda logger, job_name: work(submitted), f"FGC{next(job_ids)}"))
+
+    scheduler.stop()
+    return threads, cpu, p50, worst
+
+def main(areas, idle_sec):
+    for label, bench in (("polling workers", bench_polling), ("elastic scheduler", bench_elastic)):
+        threads, cpu, p50, worst = bench(areas, idle_sec)
+        print(f"{label:>17}: {threads:4} idle threads, idle CPU {cpu * 100:5.2f} %, "
+              f"enqueue to start p50 {p50 * 1000:7.2f} ms, max {worst * 1000:7.2f} ms")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10, float(sys.argv[2]) if len(sys.argv) > 2 else 10)
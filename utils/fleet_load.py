@@ -0,0 +1,92 @@
+"""Runs ProgramManagerServer end to end against a fleet of simulated FGCs and
+reports the reprogramming throughput and latency.
+
+Converters are released (start flagging SYNC_REGFGC3 in the simulated status
+server) at release_rate converters per second, all at once if 0. The latency
+of a converter is the time from its release until its crate has the expected
+firmware. FGC latencies and poll schedules are multiplied by latency_scale.
+Usage:
+    python fleet_load.py [converters] [latency_scale] [release_rate] [state_failure_rate]
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from program_manager.fgc_simulator import SimulatedFleet, SimulatedNameIndex, SimulatedStatusServer, scaled_poll_schedules
+from program_manager.pm_server import ProgramManagerServer
+
+STATUS_PERIOD_SEC = 0.2
+TIMEOUT_SEC       = 600
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float("nan")
+
+def release(fleet, release_rate, stop):
+    period = 1 / release_rate if release_rate else 0
+    for converter in fleet.fgcs:
+        if stop.is_set():
+            return
+
+        fleet.release_converter(converter)
+        if period:
+            stop.wait(period)
+
+def run(num_converters, latency_scale, release_rate, state_failure_rate):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fleet = SimulatedFleet(num_converters, release=False, seed=0, latency_scale=latency_scale,
+                               state_failures={"PROGRAMMING": state_failure_rate})
+        fleet.write_firmware(os.path.join(tmp_dir, "FW"))
+        status_srv = SimulatedStatusServer(fleet)
+
+        server = ProgramManagerServer(name_file=None,
+                                      fw_repo_loc=tmp_dir,
+                                      expected_data="fs",
+                                      db_data=None,
+                                      trace_file=os.path.join(tmp_dir, "traces.jsonl"),
+                                      name_index=SimulatedNameIndex(fleet),
+                                      status_source=status_srv.get_status_all,
+                                      status_period=STATUS_PERIOD_SEC,
+                                      job_func=fleet.job(scaled_poll_schedules(latency_scale)))
+
+        server_thread = threading.Thread(target=server.start, daemon=True)
+        server_thread.start()
+
+        stop           = threading.Event()
+        release_thread = threading.Thread(target=release, args=(fleet, release_rate, stop), daemon=True)
+        start          = time.monotonic()
+        release_thread.start()
+
+        deadline = start + TIMEOUT_SEC
+        while len(fleet.synced_at) < num_converters and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        elapsed = time.monotonic() - start
+        stop.set()
+        scheduler_stats = server._scheduler.stats()
+        server.stop()
+        server_thread.join()
+
+    latencies = [fleet.synced_at[c] - fleet.released_at[c] for c in fleet.synced_at]
+    return elapsed, latencies, fleet.stats(), scheduler_stats
+
+def main(num_converters, latency_scale, release_rate, state_failure_rate):
+    logging.basicConfig(level=logging.WARNING)
+    elapsed, latencies, fleet_stats, scheduler_stats = run(num_converters, latency_scale, release_rate, state_failure_rate)
+
+    print(f"converters synced : {fleet_stats['synced']}/{num_converters} in {elapsed:.2f} s")
+    print(f"throughput        : {fleet_stats['synced'] / elapsed:.1f} converters/s, {fleet_stats['devices_programmed'] / elapsed:.1f} devices/s")
+    print(f"latency           : p50 {percentile(latencies, 0.5):.2f} s, p95 {percentile(latencies, 0.95):.2f} s, "
+          f"p99 {percentile(latencies, 0.99):.2f} s, max {max(latencies, default=float('nan')):.2f} s")
+    print(f"FGC traffic       : {fleet_stats['gets']} gets, {fleet_stats['sets']} sets, {fleet_stats['fgc_errors']} FSM errors")
+    print(f"workers           : {scheduler_stats['workers_started']} started, {scheduler_stats['steals']} steals")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 0.01,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 0,
+         float(sys.argv[4]) if len(sys.argv) > 4 else 0)
@@ -7,6 +7,7 @@ from logging     import handlers
 
 import pyfgc
 import program_manager.regfgc3_programmer as programmer
+from program_manager.fgc_pool import fgc_pool
 
 
 class ProgrammingSummary:
@@ -124,18 +125,18 @@ except NameError:
    
 #     _module_logger.info(f"Target: board {board} in converter { converter} switched back to download boot")
 
-def _is_board_in_requested_boot_mode(converter_data, boot_mode):
+def _is_board_in_requested_boot_mode(fgc, converter_data, boot_mode):
     global _module_logger
     converter, slot = converter_data
 
-    slot_info = pyfgc.get(converter, "REGFGC3.SLOT_INFO").value
+    slot_info = fgc.get("REGFGC3.SLOT_INFO").value
     slot_info_parsed = programmer.parse_slot_info(slot_info)
     
     if boot_mode.lower() == "downloadboot":
-        return programmer.is_board_in_download_boot(slot_info_parsed[slot])
+        return programmer.check_board_in_download_boot(slot_info_parsed[slot])
 
     else:
-        return not programmer.is_board_in_download_boot(slot_info_parsed[slot])
+        return not programmer.check_board_in_download_boot(slot_info_parsed[slot])
     
 def _switch_boards_boot(converter_data, boot_mode):
     MAX_ATTEMPTS_SWITCH = 3
@@ -143,12 +144,12 @@ def _switch_boards_boot(converter_data, boot_mode):
     attempts_to_switch_boot_mode = MAX_ATTEMPTS_SWITCH
     converter, slot = converter_data
 
-    if _is_board_in_requested_boot_mode(converter_data, boot_mode):
-        _module_logger.info(f"Board in slot {slot} of converter {converter} already in boot mode {boot_mode}")
-        return
-
     switch_success = False
-    with pyfgc.fgcs(converter) as fgc:
+    with fgc_pool.session(converter) as fgc:
+        if _is_board_in_requested_boot_mode(fgc, converter_data, boot_mode):
+            _module_logger.info(f"Board in slot {slot} of converter {converter} already in boot mode {boot_mode}")
+            return
+
         while attempts_to_switch_boot_mode:
             _ = fgc.set("REGFGC3.PROG.SLOT", slot)
             _ = fgc.set("REGFGC3.PROG.DEBUG.ACTION", "SWITCH")
@@ -158,7 +159,7 @@ def _switch_boards_boot(converter_data, boot_mode):
 
             _ = fgc.set("REGFGC3.SLOT_INFO", "")
 
-            if _is_board_in_requested_boot_mode(converter_data, boot_mode):
+            if _is_board_in_requested_boot_mode(fgc, converter_data, boot_mode):
                 _module_logger.info(f"Board in slot {slot} of converter {converter} switched to {boot_mode}, attempt {MAX_ATTEMPTS_SWITCH - attempts_to_switch_boot_mode}")
                 switch_success = True
                 break
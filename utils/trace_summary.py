@@ -0,0 +1,68 @@
+"""Summarises the job traces written by the program manager into per-span
+duration percentiles.
+Usage:
+    python trace_summary.py path/to/program_manager_traces.jsonl [...]
+
+Rotated files (.1, .2, ...) next to the given files are read too.
+"""
+
+import glob
+import json
+import math
+import sys
+from collections import defaultdict
+
+PERCENTILES = (50, 95, 99)
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def read_traces(trace_files):
+    for trace_file in trace_files:
+        for file_name in sorted(glob.glob(trace_file + ".*")) + [trace_file]:
+            try:
+                with open(file_name, "r") as fh:
+                    for line in fh:
+                        line = line.strip()
+                        if line:
+                            yield json.loads(line)
+
+            except FileNotFoundError:
+                continue
+
+def summarise(traces):
+    durations = defaultdict(list)
+    polls     = defaultdict(int)
+    bytes_tx  = 0
+    results   = defaultdict(int)
+
+    for trace in traces:
+        results[trace["attrs"].get("result", "unknown")] += 1
+        for span in trace["spans"]:
+            if span["duration"] is None:
+                continue
+
+            durations[span["name"]].append(span["duration"])
+            polls[span["name"]] += span["attrs"].get("polls", 0)
+            bytes_tx += span["attrs"].get("bytes_sent", 0)
+
+    return durations, polls, bytes_tx, results
+
+def main(trace_files):
+    durations, polls, bytes_tx, results = summarise(read_traces(trace_files))
+    print(f"Jobs: {dict(results)}, payload sent: {bytes_tx} bytes")
+    print(f"{'span':<24}{'count':>8}" + "".join(f"{'p' + str(p) + ' [s]':>12}" for p in PERCENTILES) + f"{'polls/span':>12}")
+
+    for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        row = f"{name:<24}{len(values):>8}" + "".join(f"{percentile(values, p):>12.3f}" for p in PERCENTILES)
+        print(row + f"{polls[name] / len(values):>12.1f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(2)
+
+    main(sys.argv[1:])